@@ -109,6 +109,12 @@ CACHES = {
     }
 }
 
+# The test runner points the cache at this Redis database instead, so the
+# tests' cache.clear() calls never wipe the rate limit windows, access hashes
+# and URLs cached for a server using the database above.
+TEST_CACHE_LOCATION = os.getenv("TEST_CACHE_LOCATION", "redis://127.0.0.1:6379/14")
+TEST_RUNNER = "_file_sharing_app.test_runner.IsolatedCacheTestRunner"
+
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
@@ -177,6 +183,79 @@ AWS_S3_REGION_NAME = os.getenv("AWS_S3_REGION_NAME", "us-east-1")
 AWS_S3_CUSTOM_DOMAIN = f"{AWS_STORAGE_BUCKET_NAME}.s3.amazonaws.com"
 AWS_QUERYSTRING_AUTH = True  # Set to True for pre-signed URLs
 
+# Storage engine for file content (see files/storage.py): "s3" or "local".
+# The local engine keeps files under LOCAL_STORAGE_ROOT instead of a bucket.
+FILE_STORAGE_ENGINE = os.getenv("FILE_STORAGE_ENGINE", "s3")
+LOCAL_STORAGE_ROOT = os.getenv("LOCAL_STORAGE_ROOT", str(BASE_DIR / "storage"))
+
+# Shared S3 client tuning (see files/s3.py)
+AWS_S3_MAX_POOL_CONNECTIONS = int(os.getenv("AWS_S3_MAX_POOL_CONNECTIONS", "50"))
+AWS_S3_CONNECT_TIMEOUT = float(os.getenv("AWS_S3_CONNECT_TIMEOUT", "5"))
+AWS_S3_READ_TIMEOUT = float(os.getenv("AWS_S3_READ_TIMEOUT", "60"))
+AWS_S3_RETRY_MODE = os.getenv("AWS_S3_RETRY_MODE", "standard")
+AWS_S3_MAX_ATTEMPTS = int(os.getenv("AWS_S3_MAX_ATTEMPTS", "3"))
+
+# Rate limiting (see files/middleware.py). Each policy counts the requests
+# sharing a key built from any of "ip", "user" (the user id of a valid access
+# token) and "route" (the URL pattern name) within a sliding window of
+# "window" seconds. "routes" restricts a policy to the named URL patterns, and
+# policies whose key cannot be built, such as "user" ones for anonymous
+# requests, are skipped. A request must be within every policy it matches.
+RATE_LIMIT_POLICIES = [
+    {"name": "ip", "key": ["ip"], "limit": 300, "window": 60},
+    {"name": "user", "key": ["user"], "limit": 600, "window": 60},
+    {
+        "name": "auth",
+        "key": ["ip", "route"],
+        "routes": ["token_obtain_pair", "token_refresh", "register"],
+        "limit": 20,
+        "window": 60,
+    },
+    {
+        "name": "upload",
+        "key": ["user"],
+        "routes": [
+            "file-upload",
+            "file-upload-batch",
+            "file-upload-direct",
+            "upload-session-create",
+        ],
+        "limit": 200,
+        "window": 60 * 60,
+    },
+]
+
+# How many requests one request to each route counts as; other routes count as
+# one. Uploads and bulk operations cost more than reads.
+RATE_LIMIT_ROUTE_COSTS = {
+    "file-upload": 5,
+    "file-upload-batch": 20,
+    "file-upload-direct": 2,
+    "upload-session-create": 5,
+    "share-bulk": 10,
+}
+
+# Each worker leases up to RATE_LIMIT_LEASE_SIZE requests of a policy key from
+# Redis at a time (never more than a twentieth of its limit) and decides
+# requests from them in process for RATE_LIMIT_LEASE_TTL seconds, after which
+# the unused ones are given back.
+RATE_LIMIT_LEASE_SIZE = int(os.getenv("RATE_LIMIT_LEASE_SIZE", "10"))
+RATE_LIMIT_LEASE_TTL = float(os.getenv("RATE_LIMIT_LEASE_TTL", "1"))
+
+# While Redis is unreachable each worker allows its share of every limit on
+# its own, assuming RATE_LIMIT_FALLBACK_WORKERS workers, and tries Redis again
+# every RATE_LIMIT_FALLBACK_RETRY seconds.
+RATE_LIMIT_FALLBACK_WORKERS = int(os.getenv("RATE_LIMIT_FALLBACK_WORKERS", "4"))
+RATE_LIMIT_FALLBACK_RETRY = float(os.getenv("RATE_LIMIT_FALLBACK_RETRY", "5"))
+
+# Proxies, as addresses or networks, whose X-Forwarded-For header is trusted
+# to name the client. Requests from anywhere else are keyed by REMOTE_ADDR.
+RATE_LIMIT_TRUSTED_PROXIES = [
+    proxy.strip()
+    for proxy in os.getenv("RATE_LIMIT_TRUSTED_PROXIES", "").split(",")
+    if proxy.strip()
+]
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.test import override_settings
+from django.test.runner import DiscoverRunner
+
+
+class IsolatedCacheTestRunner(DiscoverRunner):
+    """
+    Runs the tests with the default cache on ``TEST_CACHE_LOCATION``, a Redis
+    database of its own, as the test database stands in for the real one.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        location = settings.TEST_CACHE_LOCATION
+        if location == settings.CACHES["default"]["LOCATION"]:
+            raise ImproperlyConfigured(
+                "TEST_CACHE_LOCATION must differ from the default cache's LOCATION."
+            )
+        self.cache_override = override_settings(
+            CACHES={
+                **settings.CACHES,
+                "default": {**settings.CACHES["default"], "LOCATION": location},
+            }
+        )
+        self.cache_override.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.cache_override.disable()
+        super().teardown_test_environment(**kwargs)
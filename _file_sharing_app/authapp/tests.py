@@ -3,6 +3,7 @@
 from rest_framework.test import APITestCase
 from rest_framework import status
 from django.contrib.auth.models import User
+from django.core.cache import cache
 
 
 class AuthAppTests(APITestCase):
@@ -11,6 +12,8 @@ class AuthAppTests(APITestCase):
     """
 
     def setUp(self):
+        # Start from empty rate limit windows: the auth routes share one per IP
+        cache.clear()
         # Create a test user
         self.user = User.objects.create_user(
             username="testuser", email="testuser@example.com", password="testpassword"
@@ -0,0 +1,203 @@
+from collections import namedtuple
+
+from django.db import transaction
+
+from .access_cache import get_cached_permission, invalidate_access
+from .changes import record_access_changes, record_events
+from .models import (
+    EFFECTIVE_PERMISSION_CHOICES,
+    ChangeEvent,
+    FileAccess,
+    TeamFilePermission,
+    UserFilePermission,
+)
+from .queries import permission_grants
+from .versions import touch_listings
+
+# Effective permissions that allow downloading the file.
+DOWNLOAD_PERMISSIONS = ["view-and-download", "owner"]
+
+# How a user holds a file: their effective permission, whether it comes from
+# ownership ("owner"), a direct share ("user") or a team share ("team"), and
+# the names of the user's teams the file is shared with.
+ResolvedAccess = namedtuple(
+    "ResolvedAccess", ["permission", "granted_via", "team_names"]
+)
+
+# Higher ranks win when a user is granted a file in several ways.
+PERMISSION_RANK = {
+    code: rank for rank, (code, _) in enumerate(EFFECTIVE_PERMISSION_CHOICES)
+}
+
+
+def effective_permissions(user_ids=None, file_ids=None):
+    """
+    Computes the effective permission of users on files from ownership, direct
+    shares and team shares, in a single query. Returns a dict mapping
+    ``(user id, file id)`` to a permission. Both arguments may be lists or
+    querysets of ids; ``None`` leaves that side unrestricted.
+    """
+    access = {}
+    for user_id, file_id, permission in permission_grants(user_ids, file_ids):
+        current = access.get((user_id, file_id))
+        if current is None or PERMISSION_RANK[permission] > PERMISSION_RANK[current]:
+            access[(user_id, file_id)] = permission
+    return access
+
+
+@transaction.atomic
+def refresh_access(user_ids=None, file_ids=None, record_changes=True):
+    """
+    Recomputes the ``FileAccess`` rows of the given users on the given files,
+    adding, updating and removing rows so they match the permission sources.
+    Call it after changing shares or team membership, scoped to what changed.
+    Rebuilds of the table pass ``record_changes=False``: the rows they add
+    are not new grants, and must not reach the change feeds.
+    """
+    if user_ids is not None:
+        user_ids = list(user_ids)
+    if file_ids is not None:
+        file_ids = list(file_ids)
+    access = effective_permissions(user_ids, file_ids)
+
+    existing = FileAccess.objects.all()
+    if user_ids is not None:
+        existing = existing.filter(user__in=user_ids)
+    if file_ids is not None:
+        existing = existing.filter(file__in=file_ids)
+    rows = list(existing.values_list("pk", "user_id", "file_id", "permission"))
+    previous = {
+        (user_id, file_id): permission for _, user_id, file_id, permission in rows
+    }
+    stale = [pk for pk, user_id, file_id, _ in rows if (user_id, file_id) not in access]
+    if stale:
+        FileAccess.objects.filter(pk__in=stale).delete()
+
+    FileAccess.objects.bulk_create(
+        [
+            FileAccess(user_id=user_id, file_id=file_id, permission=permission)
+            for (user_id, file_id), permission in access.items()
+        ],
+        update_conflicts=True,
+        unique_fields=["user", "file"],
+        update_fields=["permission"],
+        batch_size=500,
+    )
+
+    if record_changes:
+        record_access_changes(previous, access)
+
+    # Only users whose access actually changed lose their cached access
+    changed = {
+        user_id
+        for user_id, file_id in previous.keys() | access.keys()
+        if previous.get((user_id, file_id)) != access.get((user_id, file_id))
+    }
+    invalidate_on_commit(changed)
+
+
+def grant_owner_access(files):
+    """
+    Records that newly created files are accessible to their owners. Call it
+    in the transaction creating the files, which it logs as created.
+    """
+    FileAccess.objects.bulk_create(
+        [
+            FileAccess(user_id=file.uploaded_by_id, file=file, permission="owner")
+            for file in files
+        ],
+        update_conflicts=True,
+        unique_fields=["user", "file"],
+        update_fields=["permission"],
+    )
+    record_events(
+        ChangeEvent(
+            user_id=file.uploaded_by_id, event_type="file_created", file_uuid=file.uuid
+        )
+        for file in files
+    )
+    invalidate_on_commit(file.uploaded_by_id for file in files)
+
+
+def invalidate_on_commit(user_ids):
+    """
+    Invalidates cached access right away and again once the transaction
+    commits, so a request that read the old rows meanwhile cannot leave them
+    cached under the current version. The users' listings change too.
+    """
+    user_ids = set(user_ids)
+    invalidate_access(user_ids)
+    transaction.on_commit(lambda: invalidate_access(user_ids))
+    touch_listings(user_ids)
+
+
+def file_audience(file_ids):
+    """
+    Returns the ids of the users who can access the files and of the teams
+    they are shared with, i.e. whose listings show them.
+    """
+    user_ids = FileAccess.objects.filter(file__in=file_ids).values_list(
+        "user_id", flat=True
+    )
+    team_ids = TeamFilePermission.objects.filter(
+        shared_file__file__in=file_ids
+    ).values_list("team_id", flat=True)
+    return set(user_ids), set(team_ids)
+
+
+def team_file_ids(team):
+    """Returns the ids of the files shared with a team."""
+    return list(
+        TeamFilePermission.objects.filter(team=team).values_list(
+            "shared_file__file_id", flat=True
+        )
+    )
+
+
+def get_access(user, file):
+    """Returns the user's effective permission on the file, or None."""
+    return get_cached_permission(user.id, file.id)
+
+
+def resolve_access(user, files):
+    """
+    Resolves how ``user`` holds each of ``files`` (a page of ``File``
+    instances) with two queries, however many files there are. Returns a dict
+    mapping file ids to a ``ResolvedAccess``; files the user cannot access are
+    left out.
+    """
+    file_ids = [file.id for file in files]
+    direct = dict(
+        UserFilePermission.objects.filter(
+            user=user, shared_file__file__in=file_ids
+        ).values_list("shared_file__file_id", "permission")
+    )
+    via_team = {}
+    for file_id, permission, team_name in (
+        TeamFilePermission.objects.filter(
+            team__members=user, shared_file__file__in=file_ids
+        )
+        .order_by("team__name")
+        .values_list("shared_file__file_id", "permission", "team__name")
+    ):
+        via_team.setdefault(file_id, []).append((permission, team_name))
+
+    resolved = {}
+    for file in files:
+        team_grants = via_team.get(file.id, [])
+        team_names = [team_name for _, team_name in team_grants]
+        team_permission = max(
+            (permission for permission, _ in team_grants),
+            key=PERMISSION_RANK.get,
+            default=None,
+        )
+        if file.uploaded_by_id == user.id:
+            resolved[file.id] = ResolvedAccess("owner", "owner", team_names)
+        elif file.id in direct and (
+            team_permission is None
+            or PERMISSION_RANK[direct[file.id]] >= PERMISSION_RANK[team_permission]
+        ):
+            resolved[file.id] = ResolvedAccess(direct[file.id], "user", team_names)
+        elif team_permission is not None:
+            resolved[file.id] = ResolvedAccess(team_permission, "team", team_names)
+    return resolved
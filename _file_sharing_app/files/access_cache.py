@@ -0,0 +1,79 @@
+import logging
+
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+from .config import ACCESS_CACHE_TIMEOUT
+from .models import FileAccess
+from .versions import bump_versions, read_versions
+
+logger = logging.getLogger(__name__)
+
+# Hash field marking a user's access hash as fully loaded, so that users
+# without any files are cached too and a missing field means "no access".
+LOADED_FIELD = "loaded"
+
+
+def _version_key(user_id):
+    return f"file_access_version:{user_id}"
+
+
+def _hash_key(user_id, version):
+    return f"file_access:{user_id}:{version}"
+
+
+def _load(redis, hash_key, user_id):
+    """
+    Reads the user's access from the database into a fresh hash. The access
+    read is returned even if Redis fails to store it.
+    """
+    permissions = {
+        str(file_id): permission
+        for file_id, permission in FileAccess.objects.filter(
+            user_id=user_id
+        ).values_list("file_id", "permission")
+    }
+    try:
+        pipe = redis.pipeline()
+        pipe.hset(hash_key, mapping={LOADED_FIELD: 1, **permissions})
+        pipe.expire(hash_key, ACCESS_CACHE_TIMEOUT)
+        pipe.execute()
+    except RedisError:
+        logger.warning("Failed to cache file access in Redis.", exc_info=True)
+    return permissions
+
+
+def get_cached_permission(user_id, file_id):
+    """
+    Returns the user's effective permission on a file, or None, from a Redis
+    hash of everything the user can access. The hash is loaded from
+    ``FileAccess`` the first time it is needed after each invalidation. While
+    Redis is unreachable the permission is read from ``FileAccess`` directly.
+    """
+    redis = get_redis_connection("default")
+    try:
+        (version,) = read_versions([_version_key(user_id)])
+        hash_key = _hash_key(user_id, version)
+        loaded, permission = redis.hmget(hash_key, LOADED_FIELD, str(file_id))
+    except RedisError:
+        logger.warning(
+            "Redis is unreachable, reading file access from the database.",
+            exc_info=True,
+        )
+        return (
+            FileAccess.objects.filter(user_id=user_id, file_id=file_id)
+            .values_list("permission", flat=True)
+            .first()
+        )
+    if loaded is None:
+        return _load(redis, hash_key, user_id).get(str(file_id))
+    return permission.decode() if permission is not None else None
+
+
+def invalidate_access(user_ids):
+    """
+    Moves the given users to a new access version. Hashes of older versions
+    are never read again and simply expire, so a stale entry cannot grant
+    access even if it is written back by a request that raced the change.
+    """
+    bump_versions(_version_key(user_id) for user_id in user_ids)
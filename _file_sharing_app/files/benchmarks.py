@@ -0,0 +1,275 @@
+"""
+Endpoint benchmarks, run on demand with ``python manage.py test files.benchmarks``.
+
+Each dataset size in ``BENCHMARK_SIZES`` (default ``small,medium``) builds users,
+teams, files and shares, then measures every endpoint as the first user,
+once with the cache emptied before each request and once with it primed: the
+median wall time over ``BENCHMARK_REPEATS`` requests, the number of queries and
+the peak memory allocated. The cache is a Redis database of its own,
+``BENCHMARK_CACHE_LOCATION`` (default database 15 of the local server), so
+emptying it leaves rate limit windows and cached listings alone. S3 is served
+in process by moto. The run fails when a measurement exceeds its budget in
+``benchmark_budgets.json``; ``BENCHMARK_RECORD_BUDGETS=1`` rewrites the budgets
+from the measurements instead, and ``BENCHMARK_OUTPUT`` names a file to write
+them to as JSON.
+"""
+
+import json
+import os
+import statistics
+import time
+import tracemalloc
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APITestCase
+from teams.models import Team
+
+from .access import refresh_access
+from .models import File, SharedFile, TeamFilePermission, UserFilePermission
+from .s3 import client_pool
+
+try:
+    from moto import mock_aws
+except ImportError:  # pragma: no cover
+    mock_aws = None
+
+BUDGETS_PATH = Path(__file__).with_name("benchmark_budgets.json")
+
+# users, teams, files, shares
+DATASET_SIZES = {
+    "small": (5, 2, 20, 20),
+    "medium": (25, 5, 250, 250),
+    "large": (100, 20, 2000, 2000),
+}
+
+# Headroom given to each measurement when budgets are recorded. Query counts
+# must not grow at all; time and memory vary between machines and runs.
+BUDGET_HEADROOM = {"queries": 1, "wall_ms": 3, "memory_kib": 1.5}
+
+PAGE = {"page_size": 100}
+
+# The benchmarks empty their cache between requests, so it must not be the
+# one the server shares with other processes.
+SHARED_CACHE_LOCATION = settings.CACHES["default"]["LOCATION"]
+BENCHMARK_CACHES = {
+    **settings.CACHES,
+    "default": {
+        **settings.CACHES["default"],
+        "LOCATION": os.getenv("BENCHMARK_CACHE_LOCATION", "redis://127.0.0.1:6379/15"),
+    },
+}
+
+
+def build_dataset(users, teams, files, shares):
+    """
+    Creates the dataset and returns the user the endpoints are measured as,
+    who owns files, belongs to every team and has files shared with them.
+    """
+    people = User.objects.bulk_create(
+        User(username=f"bench-{i}", password="!") for i in range(users)
+    )
+    groups = Team.objects.bulk_create(
+        Team(name=f"bench-team-{i}") for i in range(teams)
+    )
+    Membership = Team.members.through
+    Membership.objects.bulk_create(
+        [
+            Membership(team=groups[i % teams], user=person)
+            for i, person in enumerate(people)
+        ]
+        + [Membership(team=team, user=people[0]) for team in groups[1:]],
+        ignore_conflicts=True,
+    )
+
+    owned = File.objects.bulk_create(
+        File(
+            file_name=f"file-{i}.txt",
+            key=f"bench/{i}.txt",
+            file_size=16,
+            uploaded_by=people[i % users],
+        )
+        for i in range(files)
+    )
+    shared = SharedFile.objects.bulk_create(SharedFile(file=file) for file in owned)
+    UserFilePermission.objects.bulk_create(
+        (
+            UserFilePermission(
+                user=people[(i * 7 + 1) % users if i % 3 else 0],
+                shared_file=shared[i % files],
+                permission="view-and-download",
+            )
+            for i in range(0, shares, 2)
+        ),
+        ignore_conflicts=True,
+    )
+    TeamFilePermission.objects.bulk_create(
+        (
+            TeamFilePermission(
+                team=groups[i % teams], shared_file=shared[i % files], permission="view"
+            )
+            for i in range(1, shares, 2)
+        ),
+        ignore_conflicts=True,
+    )
+    refresh_access(record_changes=False)
+    return people[0]
+
+
+def endpoints(user):
+    """Returns the ``(name, method, url, data)`` of every endpoint measured."""
+    own_file = File.objects.filter(uploaded_by=user).first()
+    others = list(User.objects.exclude(id=user.id).values_list("id", flat=True)[:5])
+    teams = list(Team.objects.values_list("id", flat=True)[:5])
+    return [
+        ("file-retrieve", "get", reverse("file-retrieve"), PAGE),
+        ("files-shared-with-user", "get", reverse("files-shared-with-user"), PAGE),
+        (
+            "files-shared-with-user-teams",
+            "get",
+            reverse("files-shared-with-user-teams"),
+            PAGE,
+        ),
+        (
+            "share-file",
+            "post",
+            reverse("share-file", kwargs={"uuid": own_file.uuid}),
+            {
+                "user_permissions": [
+                    {"user_id": user_id, "permission": "view"} for user_id in others
+                ],
+                "team_permissions": [
+                    {"team_id": team_id, "permission": "view"} for team_id in teams
+                ],
+            },
+        ),
+        ("team-list", "get", reverse("team-list"), PAGE),
+    ]
+
+
+def check_budgets(results, budgets):
+    """Returns a description of every measurement over its budget."""
+    failures = []
+    for size, measured in results.items():
+        for endpoint, metrics in measured.items():
+            budget = budgets.get(size, {}).get(endpoint, {})
+            for metric, value in metrics.items():
+                if metric in budget and value > budget[metric]:
+                    failures.append(
+                        f"{size} {endpoint}: {metric} {value} over budget {budget[metric]}"
+                    )
+    return failures
+
+
+def record_budgets(results):
+    return {
+        size: {
+            endpoint: {
+                metric: round(value * BUDGET_HEADROOM[metric], 1)
+                for metric, value in metrics.items()
+            }
+            for endpoint, metrics in measured.items()
+        }
+        for size, measured in results.items()
+    }
+
+
+@override_settings(
+    FILE_STORAGE_ENGINE="s3", RATE_LIMIT_POLICIES=[], CACHES=BENCHMARK_CACHES
+)
+class EndpointBenchmarks(APITestCase):
+    def setUp(self):
+        if mock_aws is None:
+            self.skipTest("The benchmarks need moto to stand in for S3.")
+        if BENCHMARK_CACHES["default"]["LOCATION"] == SHARED_CACHE_LOCATION:
+            self.skipTest("The benchmarks need a cache of their own.")
+        cache.clear()
+        self.addCleanup(cache.clear)
+        aws = mock_aws()
+        aws.start()
+        client_pool.reset()
+        self.addCleanup(client_pool.reset)
+        self.addCleanup(aws.stop)
+        self.s3 = client_pool.get()
+        self.s3.create_bucket(Bucket=settings.AWS_STORAGE_BUCKET_NAME)
+        self.repeats = int(os.getenv("BENCHMARK_REPEATS", "5"))
+
+    def call(self, method, url, data, warm):
+        if not warm:
+            cache.clear()
+        if method == "get":
+            response = self.client.get(url, data)
+        else:
+            response = self.client.post(url, data, format="json")
+        self.assertLess(response.status_code, 400, response.content)
+        return response
+
+    def measure(self, method, url, data, warm):
+        if warm:
+            self.call(method, url, data, warm)
+        with CaptureQueriesContext(connection) as queries:
+            self.call(method, url, data, warm)
+        # Counted now: every request resets the connection's query log
+        query_count = len(queries)
+        tracemalloc.start()
+        try:
+            self.call(method, url, data, warm)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        timings = []
+        for _ in range(self.repeats):
+            started = time.perf_counter()
+            self.call(method, url, data, warm)
+            timings.append(time.perf_counter() - started)
+        return {
+            "queries": query_count,
+            "wall_ms": round(statistics.median(timings) * 1000, 2),
+            "memory_kib": round(peak / 1024, 1),
+        }
+
+    def test_endpoints_stay_within_budget(self):
+        sizes = os.getenv("BENCHMARK_SIZES", "small,medium").split(",")
+        results = {}
+        for size in sizes:
+            with transaction.atomic():
+                user = build_dataset(*DATASET_SIZES[size])
+                for key in File.objects.values_list("key", flat=True):
+                    self.s3.put_object(
+                        Bucket=settings.AWS_STORAGE_BUCKET_NAME,
+                        Key=key,
+                        Body=b"benchmark file\n",
+                    )
+                self.client.force_authenticate(user)
+                results[size] = {
+                    f"{name} ({state})": self.measure(method, url, data, warm)
+                    for name, method, url, data in endpoints(user)
+                    for state, warm in (("cold", False), ("warm", True))
+                }
+                transaction.set_rollback(True)
+
+        if os.getenv("BENCHMARK_OUTPUT"):
+            Path(os.environ["BENCHMARK_OUTPUT"]).write_text(
+                json.dumps(results, indent=2)
+            )
+        if os.getenv("BENCHMARK_RECORD_BUDGETS") == "1":
+            budgets = (
+                json.loads(BUDGETS_PATH.read_text()) if BUDGETS_PATH.exists() else {}
+            )
+            budgets.update(record_budgets(results))
+            BUDGETS_PATH.write_text(
+                json.dumps(budgets, indent=2, sort_keys=True) + "\n"
+            )
+            return
+
+        budgets = json.loads(BUDGETS_PATH.read_text())
+        failures = check_budgets(results, budgets)
+        self.assertFalse(
+            failures, "Benchmark budgets exceeded:\n" + "\n".join(failures)
+        )
@@ -0,0 +1,58 @@
+from .models import ChangeEvent, File
+
+
+def record_events(events):
+    """Appends ``ChangeEvent`` instances to the change log in bulk."""
+    ChangeEvent.objects.bulk_create(events, batch_size=500)
+
+
+def record_file_event(event_type, user_ids, file):
+    """Records a change to ``file`` for every user in ``user_ids``."""
+    record_events(
+        ChangeEvent(user_id=user_id, event_type=event_type, file_uuid=file.uuid)
+        for user_id in set(user_ids)
+    )
+
+
+def record_access_changes(previous, current):
+    """
+    Records ``permission_granted`` and ``permission_revoked`` events from the
+    effective permissions before and after a change, both dicts mapping
+    ``(user id, file id)`` to a permission. Unchanged grants are skipped.
+    """
+    changed = {
+        grant
+        for grant in previous.keys() | current.keys()
+        if previous.get(grant) != current.get(grant)
+    }
+    if not changed:
+        return
+    uuids = dict(
+        File.objects.filter(id__in={file_id for _, file_id in changed}).values_list(
+            "id", "uuid"
+        )
+    )
+    events = []
+    for user_id, file_id in changed:
+        permission = current.get((user_id, file_id))
+        events.append(
+            ChangeEvent(
+                user_id=user_id,
+                event_type="permission_granted" if permission else "permission_revoked",
+                file_uuid=uuids.get(file_id),
+                data={"permission": permission} if permission else {},
+            )
+        )
+    record_events(events)
+
+
+def record_membership_event(event_type, team, member_id, user_ids):
+    """Records that ``member_id`` joined or left ``team`` for ``user_ids``."""
+    record_events(
+        ChangeEvent(
+            user_id=user_id,
+            event_type=event_type,
+            data={"team_id": team.id, "team_name": team.name, "member_id": member_id},
+        )
+        for user_id in set(user_ids)
+    )
@@ -13,3 +13,74 @@ ALLOWED_FILE_TYPES = [
     "application/vnd.openxmlformats-officedocument.presentationml.presentation",
     "text/plain",
 ]
+
+# Size of each part streamed to S3. Uploads that fit in a single part are sent
+# with one PutObject call; anything larger becomes an S3 multipart upload.
+# S3 requires every part except the last one to be at least 5MB.
+S3_MULTIPART_PART_SIZE = 8 * 1024 * 1024
+
+# Lifetime of the presigned POST handed out for direct-to-bucket uploads.
+DIRECT_UPLOAD_EXPIRES_IN = 15 * 60
+
+# Size of each chunk clients send to a resumable upload session. Every chunk
+# except the last one must be exactly this size.
+UPLOAD_SESSION_PART_SIZE = S3_MULTIPART_PART_SIZE
+
+# Bytes of an upload session part read from the request at a time while it is
+# streamed to storage, so no part is ever held in memory whole.
+UPLOAD_PART_READ_SIZE = 64 * 1024
+
+# Number of files a batch upload writes to S3 at the same time.
+BATCH_UPLOAD_MAX_WORKERS = 8
+
+# Lifetime of presigned download URLs.
+PRESIGNED_URL_EXPIRES_IN = 60 * 60
+
+# Cached download URLs are only handed out while they still have at least this
+# much lifetime left, so a client never receives one that is about to expire.
+PRESIGNED_URL_MIN_LIFETIME = 10 * 60
+
+# Leading bytes that files of each allowed binary type must start with. Legacy
+# Office formats share the OLE2 header and the OpenXML ones are zip archives.
+# Text types have no signature; they must simply not contain NUL bytes.
+OLE2_SIGNATURE = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"
+ZIP_SIGNATURE = b"PK\x03\x04"
+FILE_SIGNATURES = {
+    "image/jpeg": b"\xff\xd8\xff",
+    "image/png": b"\x89PNG\r\n\x1a\n",
+    "application/pdf": b"%PDF-",
+    "application/msword": OLE2_SIGNATURE,
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document": ZIP_SIGNATURE,
+    "application/vnd.ms-excel": OLE2_SIGNATURE,
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet": ZIP_SIGNATURE,
+    "application/vnd.ms-powerpoint": OLE2_SIGNATURE,
+    "application/vnd.openxmlformats-officedocument.presentationml.presentation": ZIP_SIGNATURE,
+}
+TEXT_FILE_TYPES = ["text/csv", "text/plain"]
+
+# Number of leading bytes inspected to check a file matches its content type.
+FILE_SNIFF_SIZE = 2048
+
+# Largest multipart request body accepted for a single-file upload: the file
+# itself plus room for boundaries, part headers and other form fields.
+MAX_UPLOAD_REQUEST_SIZE = MAX_FILE_SIZE + 64 * 1024
+
+# How long a user's cached file access hash is kept. Changes to shares and
+# team membership invalidate it right away; this only bounds idle memory.
+ACCESS_CACHE_TIMEOUT = 24 * 60 * 60
+
+# Most files a single bulk share request may name.
+MAX_BULK_SHARE_FILES = 1000
+
+# Listing ETags change at least this often. Listings hand out cached download
+# URLs with at least PRESIGNED_URL_MIN_LIFETIME left, so a client revalidating
+# against an unchanged ETag never keeps a URL past its expiry.
+LISTING_ETAG_WINDOW = PRESIGNED_URL_MIN_LIFETIME
+
+# Most change events returned by one change feed request; clients keep asking
+# with the returned cursor while ``has_more`` is set.
+CHANGE_FEED_PAGE_SIZE = 500
+
+# Files fetched, resolved and signed together when a listing is streamed.
+# Memory use of a streamed listing is bounded by one batch.
+STREAM_BATCH_SIZE = 500
@@ -0,0 +1,289 @@
+import asyncio
+import math
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+# Relative frequency of each scenario when none are given.
+DEFAULT_WEIGHTS = {
+    "upload": 1,
+    "list": 6,
+    "retrieve": 4,
+    "share": 2,
+    "team_membership": 1,
+}
+
+# Endpoints the scenarios record requests under.
+ENDPOINTS = (
+    "upload",
+    "list",
+    "retrieve",
+    "share",
+    "team_add_member",
+    "team_remove_member",
+)
+
+# Body of the small text file each upload scenario sends.
+UPLOAD_CONTENT = b"load test file\n" * 64
+
+
+def percentile(values, p):
+    """Returns the nearest-rank ``p``th percentile of sorted ``values``."""
+    if not values:
+        return None
+    rank = max(1, math.ceil(p / 100 * len(values)))
+    return values[rank - 1]
+
+
+def latency_summary(latencies):
+    """Summarizes latencies in seconds as milliseconds."""
+    values = sorted(latencies)
+    summary = {
+        name: percentile(values, p)
+        for name, p in (("p50", 50), ("p95", 95), ("p99", 99))
+    }
+    summary["max"] = values[-1] if values else None
+    return {
+        name: round(value * 1000, 2) if value is not None else None
+        for name, value in summary.items()
+    }
+
+
+class EndpointStats:
+    """Latencies, status codes and errors of the requests to one endpoint."""
+
+    def __init__(self):
+        self.requests = 0
+        self.latencies = []
+        self.statuses = Counter()
+        self.errors = Counter()
+        self.lock = threading.Lock()
+
+    def record(self, latency, status=None, error=None):
+        """Records a response with ``status``, or a request that failed with ``error``."""
+        with self.lock:
+            self.requests += 1
+            if status is None:
+                self.errors[error] += 1
+                return
+            self.latencies.append(latency)
+            self.statuses[status] += 1
+            if status >= 400:
+                self.errors[str(status)] += 1
+
+    def report(self):
+        requests = self.requests
+        return {
+            "requests": requests,
+            "latency_ms": latency_summary(self.latencies),
+            "status_codes": {
+                str(code): count for code, count in sorted(self.statuses.items())
+            },
+            "errors": dict(self.errors),
+            "error_rate": round(self.errors.total() / requests, 4) if requests else 0,
+            "rate_limited_rate": (
+                round(self.statuses[429] / requests, 4) if requests else 0
+            ),
+        }
+
+
+class VirtualUser:
+    """A synthetic user: its token, its team and the files it uploaded."""
+
+    def __init__(self, user_id, token, team_id, outsiders):
+        self.user_id = user_id
+        self.token = token
+        self.team_id = team_id
+        # Users of the pool outside the team, added and removed by the
+        # team membership scenario
+        self.outsiders = outsiders
+        self.files = []
+        self.lock = threading.Lock()
+
+
+class LoadGenerator:
+    """
+    Drives the API at ``base_url`` with scenarios picked at random, in
+    proportion to ``weights``, for users picked at random from ``users``.
+
+    Requests are made with ``requests`` on a thread pool the asyncio loop
+    schedules them on, either keeping ``concurrency`` scenarios running at all
+    times or starting ``rate`` scenarios per second.
+    """
+
+    def __init__(self, base_url, users, weights=None, timeout=30, seed=None):
+        self.base_url = base_url.rstrip("/")
+        self.users = users
+        self.weights = weights or DEFAULT_WEIGHTS
+        self.timeout = timeout
+        self.random = random.Random(seed)
+        # Created up front: executor threads only read the dict, so no two
+        # of them can race to add the same endpoint
+        self.stats = {endpoint: EndpointStats() for endpoint in ENDPOINTS}
+        self.local = threading.local()
+        self.scenarios = {
+            "upload": self.upload,
+            "list": self.list_files,
+            "retrieve": self.retrieve,
+            "share": self.share,
+            "team_membership": self.team_membership,
+        }
+        unknown = set(self.weights) - set(self.scenarios)
+        if unknown:
+            raise ValueError(f"Unknown scenarios: {', '.join(sorted(unknown))}.")
+        self.dropped = 0
+
+    def session(self):
+        """Returns the HTTP session of the current thread."""
+        if not hasattr(self.local, "session"):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def request(self, endpoint, user, method, path, **kwargs):
+        """Makes a request as ``user`` and records it under ``endpoint``."""
+        headers = {"Authorization": f"Bearer {user.token}"}
+        started = time.perf_counter()
+        try:
+            response = self.session().request(
+                method,
+                self.base_url + path,
+                headers=headers,
+                timeout=self.timeout,
+                **kwargs,
+            )
+        except requests.RequestException as error:
+            self.stats[endpoint].record(
+                time.perf_counter() - started, error=type(error).__name__
+            )
+            return None
+        self.stats[endpoint].record(
+            time.perf_counter() - started, status=response.status_code
+        )
+        return response
+
+    def pick_file(self, user):
+        with user.lock:
+            return self.random.choice(user.files) if user.files else None
+
+    def upload(self, user):
+        name = f"load-{self.random.getrandbits(32):08x}.txt"
+        response = self.request(
+            "upload",
+            user,
+            "POST",
+            "/api/files/upload/",
+            files={"file": (name, UPLOAD_CONTENT, "text/plain")},
+        )
+        if response is not None and response.status_code == 201:
+            with user.lock:
+                user.files.append(response.json()["uuid"])
+
+    def list_files(self, user):
+        self.request("list", user, "GET", "/api/files/retrieve/")
+
+    def retrieve(self, user):
+        uuid = self.pick_file(user)
+        if uuid is None:
+            return self.upload(user)
+        self.request(
+            "retrieve", user, "GET", "/api/files/retrieve/", params={"uuid": uuid}
+        )
+
+    def share(self, user):
+        uuid = self.pick_file(user)
+        if uuid is None:
+            return self.upload(user)
+        target = self.random.choice(self.users)
+        user_permissions = []
+        if target is not user:
+            user_permissions.append({"user_id": target.user_id, "permission": "view"})
+        self.request(
+            "share",
+            user,
+            "POST",
+            f"/api/files/share/{uuid}",
+            json={
+                "user_permissions": user_permissions,
+                "team_permissions": [
+                    {"team_id": user.team_id, "permission": "view-and-download"}
+                ],
+            },
+        )
+
+    def team_membership(self, user):
+        if not user.outsiders:
+            return self.list_files(user)
+        member = {"user_id": self.random.choice(user.outsiders)}
+        path = f"/api/teams/{user.team_id}/"
+        self.request("team_add_member", user, "POST", path + "add_member/", json=member)
+        self.request(
+            "team_remove_member", user, "POST", path + "remove_member/", json=member
+        )
+
+    def run_one(self):
+        """Runs one scenario, picked by weight, as a random user."""
+        names = list(self.weights)
+        (name,) = self.random.choices(names, weights=[self.weights[n] for n in names])
+        self.scenarios[name](self.random.choice(self.users))
+
+    async def run_concurrency(self, concurrency, duration):
+        """Keeps ``concurrency`` scenarios running for ``duration`` seconds."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + duration
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+
+            async def worker():
+                while loop.time() < deadline:
+                    await loop.run_in_executor(executor, self.run_one)
+
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    async def run_rate(self, rate, duration, max_in_flight):
+        """
+        Starts ``rate`` scenarios per second for ``duration`` seconds, on a
+        fixed schedule whatever the response times. Scenarios due while
+        ``max_in_flight`` are still running are dropped and counted.
+        """
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        in_flight = set()
+        with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+            for tick in range(int(rate * duration)):
+                delay = started + tick / rate - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                if len(in_flight) >= max_in_flight:
+                    self.dropped += 1
+                    continue
+                future = loop.run_in_executor(executor, self.run_one)
+                in_flight.add(future)
+                future.add_done_callback(in_flight.discard)
+            if in_flight:
+                await asyncio.gather(*in_flight)
+
+    def report(self, elapsed):
+        """Returns the results of the run as a JSON-serializable dict."""
+        overall = EndpointStats()
+        for stats in self.stats.values():
+            overall.requests += stats.requests
+            overall.latencies += stats.latencies
+            overall.statuses.update(stats.statuses)
+            overall.errors.update(stats.errors)
+        summary = overall.report()
+        summary["achieved_rps"] = (
+            round(summary["requests"] / elapsed, 2) if elapsed else 0
+        )
+        summary["elapsed_s"] = round(elapsed, 2)
+        summary["dropped_scenarios"] = self.dropped
+        return {
+            "summary": summary,
+            "endpoints": {
+                endpoint: stats.report()
+                for endpoint, stats in sorted(self.stats.items())
+                if stats.requests
+            },
+        }
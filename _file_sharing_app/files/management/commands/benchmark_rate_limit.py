@@ -0,0 +1,157 @@
+import multiprocessing
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django_redis import get_redis_connection
+
+from files.ratelimit import LeasingLimiter, SlidingWindowLimiter
+
+KEY_PREFIX = "rate_limit_benchmark"
+
+CANDIDATES = {
+    "list": "Timestamp list (GET + SET)",
+    "lua": "Sliding window counter (Lua)",
+    "policies": "Sliding window counter, three policies in one call (Lua)",
+    "leased": "Sliding window counter with local leases",
+}
+
+
+def timestamp_list_hit(key, limit, window):
+    """
+    The check RateLimitMiddleware made before the sliding window counter: read
+    every request time of the key, filter it and write it back.
+    """
+    request_times = cache.get(key, [])
+    now = time.time()
+    request_times = [t for t in request_times if now - t < window]
+    if len(request_times) >= limit:
+        return False
+    request_times.append(now)
+    cache.set(key, request_times, timeout=window)
+    return True
+
+
+def make_check(name, limit, window):
+    """Returns a function making one check of a client against ``name``."""
+    if name == "list":
+        return lambda key: timestamp_list_hit(f"{KEY_PREFIX}:list:{key}", limit, window)
+
+    limiter = SlidingWindowLimiter()
+    if name == "lua":
+        return lambda key: limiter.hit(f"{KEY_PREFIX}:lua:{key}", limit, window).allowed
+    if name == "policies":
+        return lambda key: all(
+            result.allowed
+            for result in limiter.hit_many(
+                [
+                    (f"{KEY_PREFIX}:policies:{policy}:{key}", limit, window, 1)
+                    for policy in ("ip", "user", "route")
+                ]
+            )
+        )
+
+    leasing = LeasingLimiter(
+        limiter,
+        lease_size=settings.RATE_LIMIT_LEASE_SIZE,
+        lease_ttl=settings.RATE_LIMIT_LEASE_TTL,
+        fallback_workers=settings.RATE_LIMIT_FALLBACK_WORKERS,
+        fallback_retry=settings.RATE_LIMIT_FALLBACK_RETRY,
+    )
+
+    def leased(key):
+        (result,) = leasing.hit_many([(f"{KEY_PREFIX}:leased:{key}", limit, window, 1)])
+        return result.allowed
+
+    return leased
+
+
+def run_checks(task):
+    """Makes the checks of one worker process; returns allowed and seconds."""
+    name, requests, keys, limit, window = task
+    check = make_check(name, limit, window)
+    allowed = 0
+    started = time.perf_counter()
+    for i in range(requests):
+        allowed += check(i % keys)
+    return allowed, time.perf_counter() - started
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the throughput and accuracy of rate limit checks made by several "
+        "processes at once against the configured Redis: the former timestamp-list "
+        "check, the Lua sliding window counter and the counter with local leases."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--requests", type=int, default=5000, help="Checks made by each process."
+        )
+        parser.add_argument(
+            "--processes", type=int, default=4, help="Processes checking at once."
+        )
+        parser.add_argument(
+            "--keys",
+            type=int,
+            default=10,
+            help="Distinct clients the checks spread over.",
+        )
+        parser.add_argument(
+            "--limit",
+            type=int,
+            default=1000,
+            help="Requests allowed per client and window.",
+        )
+        parser.add_argument(
+            "--window", type=int, default=60, help="Window length in seconds."
+        )
+        parser.add_argument(
+            "--candidates",
+            nargs="+",
+            choices=list(CANDIDATES),
+            default=list(CANDIDATES),
+            help="Rate limit checks to compare.",
+        )
+
+    def handle(self, *args, **options):
+        processes, requests = options["processes"], options["requests"]
+        self.stdout.write(
+            f"{processes} processes x {requests} checks over {options['keys']} "
+            f"clients; at most {options['limit'] * options['keys']} may be allowed "
+            f"while a run stays within one {options['window']}s window.\n"
+        )
+        # Workers are forked and open their own Redis connections
+        context = multiprocessing.get_context("fork")
+        task = (requests, options["keys"], options["limit"], options["window"])
+        try:
+            for name in options["candidates"]:
+                self.stdout.write(self.style.MIGRATE_HEADING(CANDIDATES[name]))
+                with context.Pool(processes) as pool:
+                    started = time.perf_counter()
+                    results = pool.map(run_checks, [(name, *task)] * processes)
+                    elapsed = time.perf_counter() - started
+                self.stdout.write(
+                    self.style.SUCCESS(
+                        self.report(results, processes * requests, elapsed)
+                    )
+                )
+        finally:
+            self.cleanup(options["keys"])
+
+    def report(self, results, checks, elapsed):
+        allowed = sum(allowed for allowed, _ in results)
+        per_check = sum(seconds for _, seconds in results) / max(checks, 1)
+        return (
+            f"{checks / elapsed:.0f} checks/s, "
+            f"{per_check * 1e6:.0f} us per check, "
+            f"{allowed} allowed\n"
+        )
+
+    def cleanup(self, keys):
+        cache.delete_many([f"{KEY_PREFIX}:list:{key}" for key in range(keys)])
+        redis = get_redis_connection("default")
+        stale = list(redis.scan_iter(match=f"{KEY_PREFIX}:*"))
+        if stale:
+            redis.delete(*stale)
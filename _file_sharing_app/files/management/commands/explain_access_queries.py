@@ -0,0 +1,63 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+from files.models import File, SharedFile
+from files.pagination import KeysetPagination
+from files.queries import permission_grants
+
+
+class Command(BaseCommand):
+    help = (
+        "Show the query plan and average run time of the queries that find the "
+        "files a user can access: the former ORed DISTINCT listing, the UNION of "
+        "permission sources and a page read from the effective-permission table."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("username", help="User whose access is queried.")
+        parser.add_argument(
+            "--runs", type=int, default=20, help="Times each query is run to time it."
+        )
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options["username"])
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['username']!r} does not exist.")
+
+        # The listing FileRetrieveView ran before effective permissions were stored
+        shared_files = SharedFile.objects.filter(
+            Q(userfilepermission__user=user)
+            | Q(teamfilepermission__team__in=user.teams.all())
+        ).distinct()
+        ored_distinct = (
+            File.objects.filter(uploaded_by=user).distinct()
+            | File.objects.filter(shared_info__in=shared_files).distinct()
+        )
+
+        page_size = KeysetPagination.page_size
+        queries = [
+            ("ORed DISTINCT joins", ored_distinct),
+            ("UNION ALL of permission sources", permission_grants([user.id])),
+            (
+                "Keyset page of FileAccess",
+                File.objects.filter(access__user=user).order_by(
+                    *KeysetPagination.ordering
+                )[: page_size + 1],
+            ),
+        ]
+        for label, queryset in queries:
+            self.stdout.write(self.style.MIGRATE_HEADING(label))
+            self.stdout.write(queryset.explain())
+            self.stdout.write(self.style.SUCCESS(self.time(queryset, options["runs"])))
+
+    def time(self, queryset, runs):
+        rows = 0
+        started = time.perf_counter()
+        for _ in range(runs):
+            rows = len(queryset.all())
+        elapsed = (time.perf_counter() - started) / max(runs, 1) * 1000
+        return f"{rows} rows, {elapsed:.2f} ms per run\n"
@@ -0,0 +1,196 @@
+import asyncio
+import datetime
+import json
+import subprocess
+import time
+
+import requests
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from files.loadtest import DEFAULT_WEIGHTS, LoadGenerator, VirtualUser
+from teams.models import Team
+
+USERNAME_PREFIX = "loadtest-"
+PASSWORD = "loadtest-password"
+
+
+def current_commit():
+    """Returns the commit the project is checked out at, or None."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=settings.BASE_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_weights(values):
+    weights = {}
+    for value in values:
+        name, _, weight = value.partition("=")
+        if name not in DEFAULT_WEIGHTS:
+            raise CommandError(
+                f"Unknown scenario {name!r}; choose from {', '.join(DEFAULT_WEIGHTS)}."
+            )
+        try:
+            weights[name] = float(weight)
+        except ValueError:
+            raise CommandError(f"Invalid weight {value!r}; expected scenario=weight.")
+    return weights
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive a running server with weighted scenarios (upload, list, retrieve, "
+        "share, team membership) from a pool of synthetic users, at a target rate "
+        "or concurrency, and print per-endpoint latency percentiles, errors and "
+        "429 rates as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--base-url", default="http://localhost:8000", help="Server under test."
+        )
+        parser.add_argument("--users", type=int, default=20, help="Synthetic users.")
+        parser.add_argument(
+            "--team-size", type=int, default=5, help="Synthetic users per team."
+        )
+        mode = parser.add_mutually_exclusive_group()
+        mode.add_argument(
+            "--concurrency",
+            type=int,
+            help="Scenarios kept running at once (default 10).",
+        )
+        mode.add_argument("--rate", type=float, help="Scenarios started per second.")
+        parser.add_argument(
+            "--max-in-flight",
+            type=int,
+            default=100,
+            help="With --rate, most scenarios running at once; later ones are dropped.",
+        )
+        parser.add_argument(
+            "--duration", type=float, default=30, help="Seconds to generate load for."
+        )
+        parser.add_argument(
+            "--weights",
+            nargs="+",
+            default=[],
+            metavar="SCENARIO=WEIGHT",
+            help="Relative scenario frequencies, e.g. list=5 upload=1.",
+        )
+        parser.add_argument(
+            "--login",
+            action="store_true",
+            help="Authenticate through the login endpoint instead of issuing tokens.",
+        )
+        parser.add_argument(
+            "--timeout", type=float, default=30, help="Request timeout."
+        )
+        parser.add_argument("--seed", type=int, help="Seed for repeatable runs.")
+        parser.add_argument("--output", help="Write the JSON report to this file.")
+
+    def handle(self, *args, **options):
+        weights = parse_weights(options["weights"]) or DEFAULT_WEIGHTS
+        users = self.setup_users(options)
+        generator = LoadGenerator(
+            options["base_url"],
+            users,
+            weights=weights,
+            timeout=options["timeout"],
+            seed=options["seed"],
+        )
+
+        started_at = datetime.datetime.now(datetime.timezone.utc)
+        started = time.perf_counter()
+        if options["rate"]:
+            run = generator.run_rate(
+                options["rate"], options["duration"], options["max_in_flight"]
+            )
+        else:
+            run = generator.run_concurrency(
+                options["concurrency"] or 10, options["duration"]
+            )
+        asyncio.run(run)
+        elapsed = time.perf_counter() - started
+
+        report = {
+            "meta": {
+                "commit": current_commit(),
+                "started_at": started_at.isoformat(),
+                "base_url": options["base_url"],
+                "mode": "rate" if options["rate"] else "concurrency",
+                "rate": options["rate"],
+                "concurrency": (
+                    None if options["rate"] else options["concurrency"] or 10
+                ),
+                "duration_s": options["duration"],
+                "users": len(users),
+                "weights": weights,
+            },
+            **generator.report(elapsed),
+        }
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output + "\n")
+        else:
+            self.stdout.write(output)
+
+    def setup_users(self, options):
+        """
+        Creates the synthetic users and their teams if missing and returns
+        them, authenticated, as ``VirtualUser``s.
+        """
+        if options["users"] < 1 or options["team_size"] < 1:
+            raise CommandError("--users and --team-size must be at least 1.")
+        users = []
+        for i in range(options["users"]):
+            user, created = User.objects.get_or_create(username=f"{USERNAME_PREFIX}{i}")
+            if created:
+                user.set_password(PASSWORD)
+                user.save(update_fields=["password"])
+            users.append(user)
+
+        teams = {}
+        for start in range(0, len(users), options["team_size"]):
+            end = start + options["team_size"]
+            group = users[start:end]
+            team, created = Team.objects.get_or_create(
+                name=f"{USERNAME_PREFIX}team-{start // options['team_size']}"
+            )
+            if created:
+                team.members.add(*group)
+            for user in group:
+                teams[user.id] = team.id
+
+        user_ids = [user.id for user in users]
+        return [
+            VirtualUser(
+                user.id,
+                self.authenticate(user, options),
+                teams[user.id],
+                [uid for uid in user_ids if teams[uid] != teams[user.id]],
+            )
+            for user in users
+        ]
+
+    def authenticate(self, user, options):
+        if not options["login"]:
+            return str(RefreshToken.for_user(user).access_token)
+        response = requests.post(
+            options["base_url"].rstrip("/") + "/api/auth/login/",
+            json={"username": user.username, "password": PASSWORD},
+            timeout=options["timeout"],
+        )
+        if response.status_code != 200:
+            raise CommandError(
+                f"Logging in {user.username} failed with status {response.status_code}."
+            )
+        return response.json()["access"]
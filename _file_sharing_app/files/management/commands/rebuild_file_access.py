@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from files.access import refresh_access
+from files.models import FileAccess
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the effective-permission table from file ownership, user "
+        "shares and team shares. Run it once after deploying the table and "
+        "whenever it may have drifted from its sources."
+    )
+
+    def handle(self, *args, **options):
+        refresh_access(record_changes=False)
+        self.stdout.write(
+            self.style.SUCCESS(f"Rebuilt {FileAccess.objects.count()} access rows.")
+        )
@@ -1,72 +1,212 @@
 import logging
-from django.core.cache import cache
-from time import time
+from math import ceil
+
+from django.conf import settings
 from django.http import JsonResponse
+from django.utils.http import parse_header_parameters
 
-from .config import ALLOWED_FILE_TYPES, MAX_FILE_SIZE
+from .config import ALLOWED_FILE_TYPES, MAX_FILE_SIZE, MAX_UPLOAD_REQUEST_SIZE
+from .ratelimit import (
+    LeasingLimiter,
+    SlidingWindowLimiter,
+    load_policies,
+    parse_networks,
+    policy_key,
+    request_identity,
+)
+from .upload_handlers import UploadValidationHandler
 
 
 logger = logging.getLogger(__name__)
 
 
+class PeekableStream:
+    """
+    Wraps a request body stream so its beginning can be inspected without
+    consuming it; peeked bytes are handed out again by the next reads.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.buffer = b""
+
+    def peek(self, size):
+        if len(self.buffer) < size:
+            self.buffer += self.stream.read(size - len(self.buffer))
+        return self.buffer[:size]
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            data, self.buffer = self.buffer + self.stream.read(), b""
+            return data
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        if len(data) < size:
+            data += self.stream.read(size - len(data))
+        return data
+
+    def readline(self, size=-1):
+        if not self.buffer:
+            return self.stream.readline(size)
+        line, newline, self.buffer = self.buffer.partition(b"\n")
+        if newline:
+            return line + newline
+        return line + self.stream.readline()
+
+    def close(self):
+        self.buffer = b""
+        self.stream.close()
+
+
+def peek_file_content_type(request, peek_size=8 * 1024):
+    """
+    Returns the declared content type of the first file part of a multipart
+    request, read from the start of the body without consuming it, or None if
+    no complete file part header appears within ``peek_size`` bytes.
+
+    This relies on private ``HttpRequest`` attributes: Django (5.2) reads the
+    body through ``_stream`` and sets ``_read_started`` once it has. When
+    either differs, nothing is peeked and the type is left to
+    ``UploadValidationHandler.new_file``, which rejects it as the body is
+    parsed.
+    """
+    _, params = parse_header_parameters(request.META.get("CONTENT_TYPE", ""))
+    boundary = params.get("boundary")
+    if not boundary:
+        return None
+    if getattr(request, "_read_started", True) or not hasattr(request, "_stream"):
+        return None
+
+    # Wrap the stream so the parser still receives every byte peeked here
+    if not isinstance(request._stream, PeekableStream):
+        request._stream = PeekableStream(request._stream)
+    head = request._stream.peek(peek_size)
+
+    for part in head.split(b"--" + boundary.encode())[1:]:
+        part_headers, separator, _ = part.partition(b"\r\n\r\n")
+        if not separator:
+            return None
+        headers = {}
+        for line in part_headers.decode("latin-1").strip().split("\r\n"):
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        _, disposition = parse_header_parameters(headers.get("content-disposition", ""))
+        if "filename" in disposition:
+            return parse_header_parameters(headers.get("content-type", ""))[0]
+    return None
+
+
+def upload_error(detail, status=400):
+    return JsonResponse({"detail": detail}, status=status)
+
+
+FILE_TOO_LARGE = f"File too large. Maximum size is {MAX_FILE_SIZE // (1024 * 1024)}MB."
+
+
 class FileUploadMiddleware:
     """
     Middleware to protect the server from malicious and excessive large file uploads.
+
+    Uploads are rejected before the body is parsed when their Content-Length
+    cannot hold an acceptable file or their first file part declares a
+    disallowed type. Batch uploads (``batch_upload = True``) hold many files
+    and reject them one at a time instead.
+
+    Views that stream uploads (``stream_uploads = True``) validate the file
+    while it is received. For other views the body is parsed here with an
+    ``UploadValidationHandler`` placed first, which stops at the first
+    offending chunk.
     """
 
     def __init__(self, get_response):
         self.get_response = get_response
 
     def __call__(self, request):
-        if request.method == "POST" and request.FILES.get("file"):
-            file = request.FILES.get("file")
-
-            # Check file type
-            if file.content_type not in ALLOWED_FILE_TYPES:
-                return JsonResponse({"detail": "Unsupported file type."}, status=400)
-
-            # Check file size
-            if file.size > MAX_FILE_SIZE:
-                return JsonResponse(
-                    {
-                        "detail": f"File too large. Maximum size is {MAX_FILE_SIZE // (1024 * 1024)}MB."
-                    },
-                    status=400,
-                )
-
         return self.get_response(request)
 
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if request.content_type != "multipart/form-data":
+            return None
+        view_class = getattr(view_func, "view_class", None)
 
-class RateLimitMiddleware:
-    RATE_LIMIT = 20
+        if not getattr(view_class, "batch_upload", False):
+            try:
+                content_length = int(request.META.get("CONTENT_LENGTH") or 0)
+            except ValueError:
+                content_length = 0
+            if content_length > MAX_UPLOAD_REQUEST_SIZE:
+                return upload_error(FILE_TOO_LARGE)
 
-    def __init__(self, get_response):
-        self.get_response = get_response
+            content_type = peek_file_content_type(request)
+            if content_type is not None and content_type not in ALLOWED_FILE_TYPES:
+                return upload_error("Unsupported file type.")
 
-    def __call__(self, request):
-        ip = self.get_client_ip(request)
-        rate_limit_key = f"rate_limit:{ip}"
-        request_times = cache.get(rate_limit_key, [])
+        if getattr(view_class, "stream_uploads", False):
+            return None
 
-        now = time()
-        request_times = [t for t in request_times if now - t < 60]
+        validator = UploadValidationHandler(request)
+        request.upload_handlers.insert(0, validator)
+        request.FILES
+        if validator.error:
+            detail, status = validator.error
+            return upload_error(detail, status)
 
-        if len(request_times) >= self.RATE_LIMIT:
-            logger.info(f"Rate limit exceeded for IP: {ip}.")
-            return JsonResponse({"error": "Too many requests"}, status=429)
+        return None
 
-        # Add current request time and save to cache
-        request_times.append(now)
-        cache.set(rate_limit_key, request_times, timeout=60)
 
-        logger.info(f"Request from IP: {ip}. Cache updated: {request_times}")
+class RateLimitMiddleware:
+    """
+    Applies the ``RATE_LIMIT_POLICIES`` setting: every policy matching a
+    request counts it, weighted by the ``RATE_LIMIT_ROUTE_COSTS`` of its route,
+    against a sliding window counter keyed by the client IP, the user of its
+    access token and/or its route. All counters are checked in a single Redis
+    call and a request is rejected if any policy is exhausted. Most requests
+    are decided from tokens leased from Redis in batches instead, and while
+    Redis is unreachable each worker enforces its share of the limits alone.
+
+    Responses carry ``RateLimit-*`` headers for the policy closest to its limit
+    and rejected ones a ``Retry-After`` header.
+    """
 
-        return self.get_response(request)
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.limiter = LeasingLimiter(
+            SlidingWindowLimiter(),
+            lease_size=settings.RATE_LIMIT_LEASE_SIZE,
+            lease_ttl=settings.RATE_LIMIT_LEASE_TTL,
+            fallback_workers=settings.RATE_LIMIT_FALLBACK_WORKERS,
+            fallback_retry=settings.RATE_LIMIT_FALLBACK_RETRY,
+        )
+        self.policies = load_policies(settings.RATE_LIMIT_POLICIES)
+        self.costs = settings.RATE_LIMIT_ROUTE_COSTS
+        self.trusted_proxies = parse_networks(settings.RATE_LIMIT_TRUSTED_PROXIES)
 
-    def get_client_ip(self, request):
-        x_forwarded_for = request.META.get("HTTP_X_FORWARDED_FOR")
-        if x_forwarded_for:
-            ip = x_forwarded_for.split(",")[0]
+    def __call__(self, request):
+        identity = request_identity(request, self.trusted_proxies)
+        cost = self.costs.get(identity["route"], 1)
+        hits, applied = [], []
+        for policy in self.policies:
+            key = policy_key(policy, identity)
+            if key is not None:
+                hits.append((key, policy.limit, policy.window, cost))
+                applied.append(policy)
+        if not hits:
+            return self.get_response(request)
+
+        results = self.limiter.hit_many(hits)
+        rejected = [result for result in results if not result.allowed]
+        if rejected:
+            result = max(rejected, key=lambda result: result.reset)
+            logger.info(f"Rate limit exceeded for {identity}.")
+            response = JsonResponse({"error": "Too many requests"}, status=429)
+            response["Retry-After"] = ceil(result.reset)
         else:
-            ip = request.META.get("REMOTE_ADDR")
-        return ip
+            result = min(results, key=lambda result: result.remaining)
+            response = self.get_response(request)
+
+        response["RateLimit-Limit"] = result.limit
+        response["RateLimit-Remaining"] = result.remaining
+        response["RateLimit-Reset"] = ceil(result.reset)
+        response["RateLimit-Policy"] = ", ".join(
+            f"{policy.limit};w={policy.window};name={policy.name}" for policy in applied
+        )
+        return response
@@ -9,6 +9,22 @@ PERMISSION_CHOICES = [
 ]
 
 
+class Blob(models.Model):
+    """
+    Stored file content, keyed by its SHA-256 digest and shared by every File
+    with the same content. The S3 object is deleted when the last reference goes.
+    """
+
+    sha256 = models.CharField(max_length=64, unique=True)
+    key = models.CharField(max_length=255)  # S3 bucket key
+    size = models.PositiveIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.sha256} ({self.ref_count} references)"
+
+
 class File(models.Model):
     uuid = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
     file_name = models.CharField(max_length=255)
@@ -18,6 +34,20 @@ class File(models.Model):
         User, on_delete=models.CASCADE, related_name="uploaded_files"
     )
     uploaded_at = models.DateTimeField(auto_now_add=True)
+    # Content shared with other files; empty for files uploaded without hashing
+    blob = models.ForeignKey(
+        Blob, null=True, blank=True, on_delete=models.PROTECT, related_name="files"
+    )
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of listings, newest first
+            models.Index(fields=["-uploaded_at", "-id"], name="file_uploaded_idx"),
+            models.Index(
+                fields=["uploaded_by", "-uploaded_at", "-id"],
+                name="file_owner_uploaded_idx",
+            ),
+        ]
 
     def __str__(self):
         return self.file_name
@@ -54,3 +84,120 @@ class TeamFilePermission(models.Model):
 
     def __str__(self):
         return f"{self.team.name} - {self.permission}"
+
+
+# Effective permissions, from least to most privileged; owners hold every right.
+EFFECTIVE_PERMISSION_CHOICES = PERMISSION_CHOICES + [("owner", "Owner")]
+
+
+class FileAccess(models.Model):
+    """
+    The effective permission of a user on a file, combining ownership, direct
+    shares and shares with the user's teams. Denormalised from those sources
+    by ``files.access`` so an access check is a single indexed lookup.
+    """
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="file_access")
+    file = models.ForeignKey(File, on_delete=models.CASCADE, related_name="access")
+    permission = models.CharField(max_length=20, choices=EFFECTIVE_PERMISSION_CHOICES)
+
+    class Meta:
+        unique_together = ("user", "file")
+
+    def __str__(self):
+        return f"{self.user.username} - {self.file.file_name} - {self.permission}"
+
+
+UPLOAD_SESSION_STATUS_CHOICES = [
+    ("active", "Active"),
+    ("completed", "Completed"),
+    ("aborted", "Aborted"),
+]
+
+
+class UploadSession(models.Model):
+    """
+    A resumable upload backed by an S3 multipart upload. Clients send numbered
+    parts in any order and commit the session once every part has arrived.
+    """
+
+    uuid = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="upload_sessions"
+    )
+    file_name = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=100)
+    file_size = models.PositiveIntegerField()
+    part_size = models.PositiveIntegerField()
+    key = models.CharField(max_length=255)  # S3 bucket key
+    upload_id = models.CharField(max_length=255)  # S3 multipart upload ID
+    status = models.CharField(
+        max_length=20, choices=UPLOAD_SESSION_STATUS_CHOICES, default="active"
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def total_parts(self):
+        return -(-self.file_size // self.part_size)
+
+    def expected_part_size(self, part_number):
+        """
+        Returns the exact size of the given part; only the last one may be short.
+        """
+        if part_number < self.total_parts:
+            return self.part_size
+        return self.file_size - self.part_size * (self.total_parts - 1)
+
+    def __str__(self):
+        return f"{self.file_name} - {self.status}"
+
+
+class UploadPart(models.Model):
+    session = models.ForeignKey(
+        UploadSession, on_delete=models.CASCADE, related_name="parts"
+    )
+    part_number = models.PositiveIntegerField()
+    etag = models.CharField(max_length=255)
+    size = models.PositiveIntegerField()
+    uploaded_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ("session", "part_number")
+
+    def __str__(self):
+        return f"{self.session.file_name} - part {self.part_number}"
+
+
+CHANGE_EVENT_CHOICES = [
+    ("file_created", "File created"),
+    ("file_updated", "File updated"),
+    ("file_deleted", "File deleted"),
+    ("permission_granted", "Permission granted"),
+    ("permission_revoked", "Permission revoked"),
+    ("member_added", "Member added"),
+    ("member_removed", "Member removed"),
+]
+
+
+class ChangeEvent(models.Model):
+    """
+    An append-only record of a change visible to one user, written in the same
+    transaction as the change. Clients sync by reading the events after the
+    last one they saw instead of listing every file again.
+    """
+
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="change_events"
+    )
+    event_type = models.CharField(max_length=20, choices=CHANGE_EVENT_CHOICES)
+    # Not a foreign key: events outlive the files they describe
+    file_uuid = models.UUIDField(null=True, blank=True)
+    data = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["user", "id"], name="change_event_user_idx")]
+
+    def __str__(self):
+        return f"{self.user.username} - {self.event_type}"
@@ -0,0 +1,133 @@
+import base64
+import binascii
+import json
+from functools import reduce
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Paginates on an ordering that ends with a unique field, using an opaque
+    cursor holding the ordering values of the last row seen. Each page is a
+    range scan that starts where the previous one ended, so it costs the same
+    however deep it is, and no ``COUNT`` or ``OFFSET`` is ever run.
+    """
+
+    page_size = 10
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    cursor_query_param = "cursor"
+    invalid_cursor_message = "Invalid cursor"
+    # Newest first; ``id`` breaks ties between files uploaded at the same time
+    ordering = ("-uploaded_at", "-id")
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        fields = [field.lstrip("-") for field in self.ordering]
+        queryset = queryset.order_by(*self.ordering)
+
+        position = self.decode_cursor(request, queryset.model)
+        if position is not None:
+            queryset = queryset.filter(self.after(fields, position))
+
+        limit = page_size + 1
+        page = list(queryset[:limit])
+        self.next_position = None
+        if len(page) > page_size:
+            del page[page_size:]
+            self.next_position = [self.value(page[-1], field) for field in fields]
+        return page
+
+    def after(self, fields, position):
+        """
+        Builds the filter for rows that come after ``position`` in the
+        ordering: ``(a, b) > (x, y)`` is ``a > x OR (a = x AND b > y)``.
+        """
+        conditions = []
+        for n, field in enumerate(fields):
+            lookup = "lt" if self.ordering[n].startswith("-") else "gt"
+            equal = dict(zip(fields[:n], position[:n]))
+            conditions.append(Q(**equal, **{f"{field}__{lookup}": position[n]}))
+        return reduce(lambda a, b: a | b, conditions)
+
+    def value(self, obj, field):
+        for attr in field.split("__"):
+            obj = getattr(obj, attr)
+        return obj.isoformat() if hasattr(obj, "isoformat") else obj
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def model_field(self, model, field):
+        """Returns the model field a ``__``-separated ordering field names."""
+        *relations, name = field.split("__")
+        for relation in relations:
+            model = model._meta.get_field(relation).related_model
+        return model._meta.get_field(name)
+
+    def decode_cursor(self, request, model):
+        """
+        Returns the position a cursor holds, each value converted by its
+        ordering field, or raises ``NotFound`` for a cursor that was not
+        produced by ``encode_cursor``.
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            position = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+        except (TypeError, ValueError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+
+        values = []
+        for ordering, value in zip(self.ordering, position):
+            # Cursors only ever hold scalars; ordering fields are never null
+            if value is None or isinstance(value, (dict, list)):
+                raise NotFound(self.invalid_cursor_message)
+            field = self.model_field(model, ordering.lstrip("-"))
+            try:
+                values.append(field.to_python(value))
+            except (ValidationError, TypeError, ValueError):
+                raise NotFound(self.invalid_cursor_message)
+        return values
+
+    def encode_cursor(self, position):
+        encoded = base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+        return replace_query_param(
+            self.request.build_absolute_uri(), self.cursor_query_param, encoded
+        )
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        return self.encode_cursor(self.next_position)
+
+    def get_paginated_response(self, data):
+        return Response({"next": self.get_next_link(), "results": data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
+
+
+class SharedFilePagination(KeysetPagination):
+    ordering = ("-file__uploaded_at", "-file__id")
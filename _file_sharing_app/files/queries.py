@@ -0,0 +1,37 @@
+from django.db.models import CharField, Value
+
+from .models import File, TeamFilePermission, UserFilePermission
+
+
+def permission_grants(user_ids=None, file_ids=None):
+    """
+    Returns one query yielding a ``(user id, file id, permission)`` row for
+    every way a user is granted a file: owning it, a direct share and a share
+    with one of their teams. The three sources are combined with ``UNION ALL``,
+    so each branch is answered from its own index instead of a DISTINCT over a
+    join of all of them. Both arguments may be lists or querysets of ids;
+    ``None`` leaves that side unrestricted.
+    """
+    owned = File.objects.all()
+    direct = UserFilePermission.objects.all()
+    # A single filter() on the membership, so the selected member is the one
+    # it restricts rather than a second join over every member of the team
+    via_team = TeamFilePermission.objects.filter(team__members__isnull=False)
+    if user_ids is not None:
+        owned = owned.filter(uploaded_by__in=user_ids)
+        direct = direct.filter(user__in=user_ids)
+        via_team = TeamFilePermission.objects.filter(team__members__in=user_ids)
+    if file_ids is not None:
+        owned = owned.filter(id__in=file_ids)
+        direct = direct.filter(shared_file__file__in=file_ids)
+        via_team = via_team.filter(shared_file__file__in=file_ids)
+
+    # Each branch selects the same three columns, in the same order
+    owned = owned.values_list(
+        "uploaded_by_id", "id", Value("owner", output_field=CharField())
+    )
+    direct = direct.values_list("user_id", "shared_file__file_id", "permission")
+    via_team = via_team.values_list(
+        "team__members", "shared_file__file_id", "permission"
+    )
+    return owned.order_by().union(direct.order_by(), via_team.order_by(), all=True)
@@ -0,0 +1,435 @@
+import ipaddress
+import logging
+import math
+import threading
+import time
+from collections import namedtuple
+from itertools import islice
+
+from django.urls import Resolver404, resolve
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+
+logger = logging.getLogger(__name__)
+
+RateLimitResult = namedtuple(
+    "RateLimitResult",
+    ["allowed", "limit", "remaining", "reset", "leased"],
+    defaults=[0],
+)
+
+RateLimitPolicy = namedtuple(
+    "RateLimitPolicy", ["name", "key", "limit", "window", "routes"]
+)
+
+# Parts a policy key may be built from, see ``request_identity``.
+POLICY_KEY_PARTS = ("ip", "user", "route")
+
+# A lease never holds more than this fraction of a limit, so the tokens held
+# unused by all workers cannot add up to much of it.
+LEASE_SHARE = 20
+
+# Most keys a process keeps leases or fallback counters for.
+MAX_LOCAL_KEYS = 10000
+
+# Sliding window counter: requests are counted per fixed window, and the count
+# of the previous window is weighted by how much of it still overlaps the
+# sliding window ending now. Every limit is checked before any is incremented,
+# all in one script, so a request is counted either against all of its limits
+# or, when one of them rejects it, against none, and concurrent workers cannot
+# lose each other's updates.
+#
+# Allowed hits may also lease up to ``lease`` more tokens for the caller to
+# spend locally, and unused tokens of an earlier lease are first given back
+# with ``refund``.
+#
+# KEYS: current and previous window counter of each limit
+# ARGV: limit, window length (ms), time elapsed in the current window (ms),
+#       cost, lease and refund of each limit
+# Returns for each limit: allowed (0 or 1), remaining requests, milliseconds
+# until the limit allows the request, or until its window ends, and tokens
+# leased
+SLIDING_WINDOW_SCRIPT = """
+local count = #KEYS / 2
+local state = {}
+local allowed = 1
+for i = 1, count do
+    local base = (i - 1) * 6
+    local limit = tonumber(ARGV[base + 1])
+    local window = tonumber(ARGV[base + 2])
+    local elapsed = tonumber(ARGV[base + 3])
+    local current = tonumber(redis.call("GET", KEYS[i * 2 - 1]) or "0")
+    local previous = tonumber(redis.call("GET", KEYS[i * 2]) or "0")
+    local refund = math.min(tonumber(ARGV[base + 6]), current)
+    if refund > 0 then
+        current = redis.call("DECRBY", KEYS[i * 2 - 1], refund)
+    end
+    state[i] = {previous * (window - elapsed) / window + current, current, previous}
+    if state[i][1] + tonumber(ARGV[base + 4]) > limit then
+        allowed = 0
+    end
+end
+
+local results = {}
+for i = 1, count do
+    local base = (i - 1) * 6
+    local limit = tonumber(ARGV[base + 1])
+    local window = tonumber(ARGV[base + 2])
+    local cost = tonumber(ARGV[base + 4])
+    local used, current, previous = state[i][1], state[i][2], state[i][3]
+    local reset = window - tonumber(ARGV[base + 3])
+    if used + cost > limit then
+        if previous > 0 and current + cost <= limit then
+            reset = math.ceil(reset - (limit - current - cost) * window / previous)
+        end
+        results[i] = {0, math.max(0, math.floor(limit - used)), math.max(1, reset), 0}
+    elseif allowed == 1 then
+        local available = math.max(0, math.floor(limit - used - cost))
+        local leased = math.min(tonumber(ARGV[base + 5]), available)
+        redis.call("INCRBY", KEYS[i * 2 - 1], cost + leased)
+        redis.call("PEXPIRE", KEYS[i * 2 - 1], window * 2)
+        results[i] = {1, available - leased, reset, leased}
+    else
+        results[i] = {1, math.max(0, math.floor(limit - used)), reset, 0}
+    end
+end
+return results
+"""
+
+
+def window_keys(key, window_ms, now_ms):
+    """
+    Returns the counter keys of the current and previous window of ``key`` and
+    the time elapsed in the current window.
+    """
+    index, elapsed = divmod(now_ms, window_ms)
+    return [f"{key}:{index}", f"{key}:{index - 1}"], elapsed
+
+
+class SlidingWindowLimiter:
+    """
+    Limits how often each key may be hit within a sliding window, keeping two
+    integer counters per key in Redis whatever the limit.
+    """
+
+    def __init__(self, redis=None):
+        self.redis = redis or get_redis_connection("default")
+        self.script = self.redis.register_script(SLIDING_WINDOW_SCRIPT)
+
+    def hit(self, key, limit, window, cost=1, now=None):
+        """
+        Counts a hit of ``cost`` against ``key`` unless that would exceed
+        ``limit`` hits within the last ``window`` seconds. Rejected hits are
+        not counted. ``reset`` is in seconds.
+        """
+        return self.hit_many([(key, limit, window, cost)], now=now)[0]
+
+    def hit_many(self, hits, now=None, leases=None, refunds=None):
+        """
+        Counts every ``(key, limit, window, cost)`` hit in one round trip if
+        all of them are within their limits, and none of them otherwise.
+        Returns a ``RateLimitResult`` for each hit.
+
+        ``leases`` optionally asks for extra tokens of each key, granted as far
+        as its limit allows when the hits are counted, and ``refunds`` gives
+        back unused tokens leased in the current window.
+        """
+        now_ms = int((time.time() if now is None else now) * 1000)
+        leases = leases or [0] * len(hits)
+        refunds = refunds or [0] * len(hits)
+        keys, args = [], []
+        for (key, limit, window, cost), lease, refund in zip(hits, leases, refunds):
+            window_ms = int(window * 1000)
+            counters, elapsed = window_keys(key, window_ms, now_ms)
+            keys += counters
+            args += [limit, window_ms, elapsed, cost, lease, refund]
+        return [
+            RateLimitResult(bool(allowed), limit, remaining, reset / 1000, leased)
+            for (_, limit, _, _), (allowed, remaining, reset, leased) in zip(
+                hits, self.script(keys=keys, args=args)
+            )
+        ]
+
+
+class LocalWindowLimiter:
+    """
+    Sliding window counters kept in process, used while Redis is unreachable.
+    Each process enforces ``1 / workers`` of every limit, so that all workers
+    together stay within it without sharing any state.
+    """
+
+    def __init__(self, workers, max_keys=MAX_LOCAL_KEYS):
+        self.workers = max(1, workers)
+        self.max_keys = max_keys
+        # key -> (window index, current count, previous count)
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def hit_many(self, hits, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            checks = []
+            for key, limit, window, cost in hits:
+                share = max(1, limit // self.workers)
+                index, elapsed = divmod(now, window)
+                counter_index, current, previous = self.counters.get(key, (index, 0, 0))
+                if counter_index == index - 1:
+                    current, previous = 0, current
+                elif counter_index != index:
+                    current, previous = 0, 0
+                used = previous * (window - elapsed) / window + current
+                checks.append(
+                    (key, share, window - elapsed, cost, index, current, previous, used)
+                )
+            allowed = all(
+                used + cost <= share for _, share, _, cost, _, _, _, used in checks
+            )
+
+            results = []
+            for key, share, reset, cost, index, current, previous, used in checks:
+                fits = used + cost <= share
+                if allowed:
+                    # Reinserted, so the dict stays ordered by last use
+                    self.counters.pop(key, None)
+                    self.counters[key] = (index, current + cost, previous)
+                    used += cost
+                results.append(
+                    RateLimitResult(
+                        fits, share, max(0, math.floor(share - used)), reset
+                    )
+                )
+            excess = len(self.counters) - self.max_keys
+            if excess > 0:
+                for key in list(islice(self.counters, excess)):
+                    del self.counters[key]
+        return results
+
+
+class Lease:
+    """Tokens of a key leased from Redis, spent by this process until expiry."""
+
+    __slots__ = ("tokens", "index", "expires", "remaining", "reset_at")
+
+    def __init__(self, tokens, index, expires, remaining, reset_at):
+        self.tokens = tokens
+        self.index = index
+        self.expires = expires
+        self.remaining = remaining
+        self.reset_at = reset_at
+
+
+class LeasingLimiter:
+    """
+    Decides most hits in process. Each allowed hit that reaches Redis also
+    leases up to ``lease_size`` tokens of its keys, and following hits spend
+    those until they run out or ``lease_ttl`` seconds pass. Unused tokens are
+    refunded with the next Redis call for the key, so leases only ever make a
+    process reject early, never let more through than the limit.
+
+    While Redis is unreachable, hits are decided by a ``LocalWindowLimiter``
+    giving each of ``fallback_workers`` processes an equal share of every
+    limit, and Redis is retried every ``fallback_retry`` seconds.
+    """
+
+    def __init__(
+        self, limiter, lease_size, lease_ttl, fallback_workers, fallback_retry
+    ):
+        self.limiter = limiter
+        self.lease_size = lease_size
+        self.lease_ttl = lease_ttl
+        self.fallback = LocalWindowLimiter(fallback_workers)
+        self.fallback_retry = fallback_retry
+        self.redis_down_until = 0
+        self.leases = {}
+        self.lock = threading.Lock()
+
+    def hit_many(self, hits, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            results = self.spend(hits, now)
+            if results is not None:
+                return results
+            refunds = [self.release(key, window, now) for key, _, window, _ in hits]
+
+        if now < self.redis_down_until:
+            return self.fallback.hit_many(hits, now)
+        try:
+            results = self.limiter.hit_many(
+                hits,
+                now=now,
+                leases=[
+                    min(self.lease_size, limit // LEASE_SHARE)
+                    for _, limit, _, _ in hits
+                ],
+                refunds=refunds,
+            )
+        except RedisError:
+            logger.warning(
+                "Redis is unreachable, rate limiting in process only.", exc_info=True
+            )
+            self.redis_down_until = now + self.fallback_retry
+            return self.fallback.hit_many(hits, now)
+
+        # Tokens leased to this process remain available to it
+        results = [
+            result._replace(remaining=result.remaining + result.leased)
+            for result in results
+        ]
+        with self.lock:
+            for (key, _, window, _), result in zip(hits, results):
+                if result.leased:
+                    self.leases[key] = Lease(
+                        result.leased,
+                        int(now // window),
+                        now + self.lease_ttl,
+                        result.remaining - result.leased,
+                        now + result.reset,
+                    )
+            if len(self.leases) > MAX_LOCAL_KEYS:
+                self.leases = {
+                    key: lease
+                    for key, lease in self.leases.items()
+                    if lease.expires > now
+                }
+        return results
+
+    def spend(self, hits, now):
+        """
+        Takes the cost of every hit from its key's lease and returns their
+        results, or returns None when a lease is missing, expired or too small.
+        """
+        leases = [self.leases.get(key) for key, _, _, _ in hits]
+        if not all(
+            lease is not None and lease.expires > now and lease.tokens >= cost
+            for lease, (_, _, _, cost) in zip(leases, hits)
+        ):
+            return None
+        results = []
+        for lease, (_, limit, _, cost) in zip(leases, hits):
+            lease.tokens -= cost
+            results.append(
+                RateLimitResult(
+                    True,
+                    limit,
+                    lease.remaining + lease.tokens,
+                    max(0, lease.reset_at - now),
+                )
+            )
+        return results
+
+    def release(self, key, window, now):
+        """
+        Drops the lease of ``key`` and returns how many of its tokens to give
+        back. Tokens leased in an earlier window are not refunded, since they
+        are no longer in the counter that would be decremented.
+        """
+        lease = self.leases.pop(key, None)
+        if lease is None or lease.index != int(now // window):
+            return 0
+        return lease.tokens
+
+
+def load_policies(policies):
+    """Builds ``RateLimitPolicy`` tuples from the dicts of a settings list."""
+    loaded = []
+    for policy in policies:
+        key = tuple(policy["key"])
+        unknown = set(key) - set(POLICY_KEY_PARTS)
+        if unknown:
+            raise ValueError(
+                f"Rate limit policy {policy['name']!r} has unknown key parts {unknown}."
+            )
+        routes = policy.get("routes")
+        loaded.append(
+            RateLimitPolicy(
+                policy["name"],
+                key,
+                policy["limit"],
+                policy["window"],
+                frozenset(routes) if routes is not None else None,
+            )
+        )
+    return loaded
+
+
+def parse_networks(networks):
+    return [ipaddress.ip_network(network, strict=False) for network in networks]
+
+
+def is_trusted(address, trusted_networks):
+    try:
+        address = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(address in network for network in trusted_networks)
+
+
+def client_ip(request, trusted_networks):
+    """
+    Returns the address of the client that sent ``request``. X-Forwarded-For
+    is only followed through proxies in ``trusted_networks``, from the closest
+    one outwards, so a client cannot choose its address by sending the header.
+    """
+    address = request.META.get("REMOTE_ADDR")
+    forwarded = request.META.get("HTTP_X_FORWARDED_FOR", "")
+    hops = [hop.strip() for hop in forwarded.split(",") if hop.strip()]
+    while hops and is_trusted(address, trusted_networks):
+        address = hops.pop()
+    return address
+
+
+_jwt_authentication = JWTAuthentication()
+
+
+def jwt_user_id(request):
+    """
+    Returns the user id of the valid access token ``request`` carries, or None.
+    Only the token is verified; the user is not loaded from the database.
+    """
+    header = _jwt_authentication.get_header(request)
+    if header is None:
+        return None
+    try:
+        raw_token = _jwt_authentication.get_raw_token(header)
+        if raw_token is None:
+            return None
+        token = _jwt_authentication.get_validated_token(raw_token)
+    except AuthenticationFailed:
+        return None
+    return token.get(jwt_settings.USER_ID_CLAIM)
+
+
+def route_name(request):
+    """Returns the name of the URL pattern ``request`` is for, or None."""
+    try:
+        match = resolve(request.path_info, getattr(request, "urlconf", None))
+    except Resolver404:
+        return None
+    return match.url_name
+
+
+def request_identity(request, trusted_networks):
+    return {
+        "ip": client_ip(request, trusted_networks),
+        "user": jwt_user_id(request),
+        "route": route_name(request),
+    }
+
+
+def policy_key(policy, identity):
+    """
+    Returns the Redis key ``policy`` counts a request with ``identity`` under,
+    or None when the policy does not apply to it: the request is for a route
+    the policy is not restricted to, or lacks a part of the key, such as the
+    user of an anonymous request.
+    """
+    if policy.routes is not None and identity["route"] not in policy.routes:
+        return None
+    parts = [identity[part] for part in policy.key]
+    if None in parts:
+        return None
+    return ":".join(["rate_limit", policy.name, *map(str, parts)])
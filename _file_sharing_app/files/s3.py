@@ -0,0 +1,94 @@
+import logging
+import threading
+
+import boto3
+from botocore.config import Config
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+class S3ClientPool:
+    """
+    Holds the one S3 client shared by every thread of the process.
+
+    boto3 clients are thread-safe once built, and each one keeps its own pool
+    of keep-alive connections, so building a single client and reusing it
+    avoids both the construction cost and new TLS handshakes on every request.
+    """
+
+    def __init__(self):
+        self._session = None
+        self._client = None
+        self._lock = threading.Lock()
+        self._created = 0
+        self._checkouts = 0
+
+    def get(self):
+        return self._checkout()[1]
+
+    def _checkout(self):
+        """Returns the session and the client built from it, as one pair."""
+        with self._lock:
+            if self._client is None:
+                self._client = self._build_client()
+                self._created += 1
+            self._checkouts += 1
+            return self._session, self._client
+
+    def reset(self):
+        """Drops the current client so the next call builds a fresh one."""
+        with self._lock:
+            self._session = None
+            self._client = None
+
+    def credentials(self):
+        """Returns a frozen snapshot of the credentials the client signs with."""
+        session, _ = self._checkout()
+        credentials = session.get_credentials()
+        return credentials.get_frozen_credentials() if credentials else None
+
+    def stats(self):
+        """Returns how many clients were built and how often one was reused."""
+        with self._lock:
+            checkouts, created = self._checkouts, self._created
+        return {
+            "clients_created": created,
+            "checkouts": checkouts,
+            "reuses": max(checkouts - created, 0),
+            "max_pool_connections": settings.AWS_S3_MAX_POOL_CONNECTIONS,
+        }
+
+    def _build_client(self):
+        config = Config(
+            max_pool_connections=settings.AWS_S3_MAX_POOL_CONNECTIONS,
+            connect_timeout=settings.AWS_S3_CONNECT_TIMEOUT,
+            read_timeout=settings.AWS_S3_READ_TIMEOUT,
+            signature_version="s3v4",
+            retries={
+                "mode": settings.AWS_S3_RETRY_MODE,
+                "max_attempts": settings.AWS_S3_MAX_ATTEMPTS,
+            },
+        )
+        logger.info(
+            f"Creating S3 client with {settings.AWS_S3_MAX_POOL_CONNECTIONS} pooled connections."
+        )
+        # A dedicated session: the default boto3 session is not thread-safe
+        self._session = boto3.session.Session()
+        return self._session.client(
+            "s3", region_name=settings.AWS_S3_REGION_NAME, config=config
+        )
+
+
+client_pool = S3ClientPool()
+
+
+def get_s3_client():
+    """Returns the process-wide S3 client."""
+    return client_pool.get()
+
+
+def s3_client_stats():
+    """Returns reuse metrics for the process-wide S3 client."""
+    return client_pool.stats()
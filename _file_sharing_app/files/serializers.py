@@ -1,73 +1,158 @@
+from django.db.models import Prefetch, prefetch_related_objects
 from rest_framework import serializers
-from .models import File, SharedFile
+from .config import ALLOWED_FILE_TYPES, MAX_BULK_SHARE_FILES, MAX_FILE_SIZE
+from .models import (
+    PERMISSION_CHOICES,
+    ChangeEvent,
+    File,
+    SharedFile,
+    TeamFilePermission,
+    UploadPart,
+    UploadSession,
+    UserFilePermission,
+)
 
 
-class FileSerializer(serializers.ModelSerializer):
+def requested_fields(request):
     """
-    Serializer for the File model, including metadata and access details.
+    Returns the set of fields a client asked for with ``?fields=a,b``, or None
+    when it wants them all.
+    """
+    if request is None or not request.query_params.get("fields"):
+        return None
+    return {field.strip() for field in request.query_params["fields"].split(",")}
+
+
+def select_fields(items, fields):
+    """Trims each of ``items`` to the requested ``fields``; None keeps them all."""
+    if fields is None:
+        return items
+    return [
+        {name: value for name, value in item.items() if name in fields}
+        for item in items
+    ]
+
+
+def prefetch_shares(files):
+    """
+    Loads the uploaders and the user and team shares of many files with one
+    query per relation, for serializing them with ``FileReadSerializer``.
+    """
+    prefetch_related_objects(
+        files,
+        "uploaded_by",
+        "shared_info",
+        Prefetch(
+            "shared_info__userfilepermission_set",
+            queryset=UserFilePermission.objects.select_related("user"),
+        ),
+        Prefetch(
+            "shared_info__teamfilepermission_set",
+            queryset=TeamFilePermission.objects.select_related("team"),
+        ),
+    )
+    return files
+
+
+class SparseFieldsMixin:
+    """
+    Lets clients pick the fields they need with ``?fields=a,b``. Fields that
+    were not asked for are neither computed nor sent.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        fields = requested_fields(self.context.get("request"))
+        if fields is not None:
+            for name in set(self.fields) - fields:
+                self.fields.pop(name)
+
+
+class FileReadSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    """
+    Read-only serializer for file metadata and access details. Shares are read
+    from the prefetch cache, so files loaded with ``prefetch_shares`` are
+    serialized without further queries however many there are.
     """
 
     uploaded_by = serializers.ReadOnlyField(source="uploaded_by.username")
     shared_with_users = serializers.SerializerMethodField()
     shared_with_teams = serializers.SerializerMethodField()
     permissions = serializers.SerializerMethodField()
-    file = serializers.FileField(write_only=True)
 
     class Meta:
         model = File
         fields = [
             "uuid",
-            "file",
+            "file_name",
+            "file_size",
             "uploaded_by",
             "uploaded_at",
             "shared_with_users",
             "shared_with_teams",
             "permissions",
         ]
+        read_only_fields = fields
+
+    def user_shares(self, obj):
+        shared_info = getattr(obj, "shared_info", None)
+        return shared_info.userfilepermission_set.all() if shared_info else []
+
+    def team_shares(self, obj):
+        shared_info = getattr(obj, "shared_info", None)
+        return shared_info.teamfilepermission_set.all() if shared_info else []
 
     def get_shared_with_users(self, obj):
         """
-        Returns a list of usernames who have the file shared with them, by querying UserFilePermission.
+        Returns a list of usernames who have the file shared with them.
         """
-        # Access the related SharedFile instance and fetch associated users from UserFilePermission
-        shared_info = obj.shared_info
-        user_permissions = shared_info.userfilepermission_set.all()
-        return [user_permission.user.username for user_permission in user_permissions]
+        return [
+            user_permission.user.username for user_permission in self.user_shares(obj)
+        ]
 
     def get_shared_with_teams(self, obj):
         """
-        Returns a list of team names who have the file shared with them, by querying TeamFilePermission.
+        Returns a list of team names who have the file shared with them.
         """
-        # Access the related SharedFile instance and fetch associated teams from TeamFilePermission
-        shared_info = obj.shared_info
-        team_permissions = shared_info.teamfilepermission_set.all()
-        return [team_permission.team.name for team_permission in team_permissions]
+        return [team_permission.team.name for team_permission in self.team_shares(obj)]
 
     def get_permissions(self, obj):
         """
         Returns a dictionary containing shared permissions for users and teams.
         Includes only users and teams the file is shared with.
         """
-        permissions = {}
-        shared_info = obj.shared_info  # Access the related SharedFile instance
-
-        if shared_info:
-            # Fetch user permissions
-            user_permissions = {
+        if getattr(obj, "shared_info", None) is None:
+            return {}
+        return {
+            "users": {
                 user_permission.user.username: user_permission.permission
-                for user_permission in shared_info.userfilepermission_set.all()
-            }
-
-            # Fetch team permissions
-            team_permissions = {
+                for user_permission in self.user_shares(obj)
+            },
+            "teams": {
                 team_permission.team.name: team_permission.permission
-                for team_permission in shared_info.teamfilepermission_set.all()
-            }
+                for team_permission in self.team_shares(obj)
+            },
+        }
+
+
+class FileSerializer(FileReadSerializer):
+    """
+    Serializer for the File model, including metadata and access details.
+    """
 
-            permissions["users"] = user_permissions
-            permissions["teams"] = team_permissions
+    file = serializers.FileField(write_only=True)
 
-        return permissions
+    class Meta:
+        model = File
+        fields = [
+            "uuid",
+            "file",
+            "uploaded_by",
+            "uploaded_at",
+            "shared_with_users",
+            "shared_with_teams",
+            "permissions",
+        ]
 
     def create(self, validated_data):
         """
@@ -92,3 +177,87 @@ class SharedFileSerializer(serializers.ModelSerializer):
     class Meta:
         model = SharedFile
         fields = ["file"]
+
+
+class DirectUploadRequestSerializer(serializers.Serializer):
+    """
+    Describes a file the client wants to upload straight to the bucket.
+    """
+
+    file_name = serializers.CharField(max_length=200)
+    content_type = serializers.ChoiceField(choices=ALLOWED_FILE_TYPES)
+    file_size = serializers.IntegerField(min_value=1, max_value=MAX_FILE_SIZE)
+
+    def validate_file_name(self, value):
+        if "/" in value or "\\" in value:
+            raise serializers.ValidationError("File name cannot contain a path.")
+        return value
+
+
+class DirectUploadCompleteSerializer(serializers.Serializer):
+    key = serializers.CharField(max_length=255)
+
+
+class UploadPartSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UploadPart
+        fields = ["part_number", "size", "etag", "uploaded_at"]
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    """
+    Serializer for resumable upload sessions, including the parts received so far.
+    """
+
+    total_parts = serializers.ReadOnlyField()
+    parts = UploadPartSerializer(many=True, read_only=True)
+    missing_parts = serializers.SerializerMethodField()
+
+    class Meta:
+        model = UploadSession
+        fields = [
+            "uuid",
+            "file_name",
+            "content_type",
+            "file_size",
+            "part_size",
+            "total_parts",
+            "status",
+            "created_at",
+            "parts",
+            "missing_parts",
+        ]
+
+    def get_missing_parts(self, obj):
+        received = {part.part_number for part in obj.parts.all()}
+        return [n for n in range(1, obj.total_parts + 1) if n not in received]
+
+
+class UserPermissionSerializer(serializers.Serializer):
+    user_id = serializers.IntegerField()
+    permission = serializers.ChoiceField(choices=PERMISSION_CHOICES)
+
+
+class TeamPermissionSerializer(serializers.Serializer):
+    team_id = serializers.IntegerField()
+    permission = serializers.ChoiceField(choices=PERMISSION_CHOICES)
+
+
+class BulkShareSerializer(serializers.Serializer):
+    """
+    Describes many files to share with many users and teams at once.
+    """
+
+    file_uuids = serializers.ListField(
+        child=serializers.UUIDField(),
+        allow_empty=False,
+        max_length=MAX_BULK_SHARE_FILES,
+    )
+    user_permissions = UserPermissionSerializer(many=True, required=False)
+    team_permissions = TeamPermissionSerializer(many=True, required=False)
+
+
+class ChangeEventSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ChangeEvent
+        fields = ["id", "event_type", "file_uuid", "data", "created_at"]
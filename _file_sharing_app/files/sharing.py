@@ -0,0 +1,112 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from teams.models import Team
+from .access import file_audience, refresh_access
+from .models import File, SharedFile, TeamFilePermission, UserFilePermission
+from .versions import touch_listings
+
+
+def missing_ids(model, ids):
+    """Returns the ids among ``ids`` with no matching row, in one query."""
+    ids = set(ids)
+    return ids - set(model.objects.filter(id__in=ids).values_list("id", flat=True))
+
+
+def get_shared_files(files):
+    """Returns the ``SharedFile`` of each file, creating the missing ones in bulk."""
+    SharedFile.objects.bulk_create(
+        [SharedFile(file=file) for file in files], ignore_conflicts=True
+    )
+    return list(SharedFile.objects.filter(file__in=files))
+
+
+@transaction.atomic
+def share_files(files, user_permissions, team_permissions):
+    """
+    Grants every user and team in ``user_permissions`` and ``team_permissions``
+    (dicts mapping ids to permissions) access to every one of ``files``. Existing
+    permissions are overwritten with set-based upserts, so the number of queries
+    does not depend on how many files or principals are involved.
+    """
+    shared_files = get_shared_files(files)
+    UserFilePermission.objects.bulk_create(
+        [
+            UserFilePermission(
+                user_id=user_id, shared_file=shared_file, permission=permission
+            )
+            for shared_file in shared_files
+            for user_id, permission in user_permissions.items()
+        ],
+        update_conflicts=True,
+        unique_fields=["user", "shared_file"],
+        update_fields=["permission"],
+        batch_size=500,
+    )
+    TeamFilePermission.objects.bulk_create(
+        [
+            TeamFilePermission(
+                team_id=team_id, shared_file=shared_file, permission=permission
+            )
+            for shared_file in shared_files
+            for team_id, permission in team_permissions.items()
+        ],
+        update_conflicts=True,
+        unique_fields=["team", "shared_file"],
+        update_fields=["permission"],
+        batch_size=500,
+    )
+
+    # Bring everyone's effective permission on the files up to date
+    file_ids = [file.id for file in files]
+    refresh_access(file_ids=file_ids)
+    # Listings show how each file is shared, even where access did not change
+    touch_listings(*file_audience(file_ids))
+
+
+def bulk_share(owner, file_uuids, user_permissions, team_permissions):
+    """
+    Shares many files owned by ``owner`` with many users and teams. Unknown or
+    foreign files and unknown principals are skipped and reported instead of
+    failing the whole request. Returns the shared files and a list of errors.
+    """
+    errors = []
+
+    files = {str(file.uuid): file for file in File.objects.filter(uuid__in=file_uuids)}
+    owned = []
+    for file_uuid in dict.fromkeys(map(str, file_uuids)):
+        file = files.get(file_uuid)
+        if file is None:
+            errors.append({"file_uuid": file_uuid, "detail": "File not found."})
+        elif file.uploaded_by_id != owner.id:
+            errors.append(
+                {
+                    "file_uuid": file_uuid,
+                    "detail": "You do not have permission to share this file.",
+                }
+            )
+        else:
+            owned.append(file)
+
+    # The last permission given for a principal wins
+    user_permissions = {p["user_id"]: p["permission"] for p in user_permissions}
+    team_permissions = {p["team_id"]: p["permission"] for p in team_permissions}
+
+    if user_permissions.pop(owner.id, None) is not None:
+        errors.append(
+            {
+                "user_id": owner.id,
+                "detail": "The owner cannot share the file with themselves.",
+            }
+        )
+    for user_id in sorted(missing_ids(User, user_permissions)):
+        errors.append({"user_id": user_id, "detail": "User not found."})
+        del user_permissions[user_id]
+    for team_id in sorted(missing_ids(Team, team_permissions)):
+        errors.append({"team_id": team_id, "detail": "Team not found."})
+        del team_permissions[team_id]
+
+    if not owned or not (user_permissions or team_permissions):
+        return [], errors
+    share_files(owned, user_permissions, team_permissions)
+    return owned, errors
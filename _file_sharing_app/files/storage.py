@@ -0,0 +1,512 @@
+import hashlib
+import logging
+import mimetypes
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import namedtuple
+from contextlib import contextmanager
+from urllib.parse import urlencode
+
+from botocore.exceptions import BotoCoreError, ClientError
+from django.conf import settings
+from django.urls import reverse
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+from .config import S3_MULTIPART_PART_SIZE, UPLOAD_PART_READ_SIZE
+from .presigner import get_presigner
+from .s3 import get_s3_client
+
+
+logger = logging.getLogger(__name__)
+
+ObjectInfo = namedtuple("ObjectInfo", ["size", "content_type"])
+
+
+class StorageError(Exception):
+    """Raised when a storage engine fails to carry out an operation."""
+
+
+class ObjectNotFound(StorageError):
+    """Raised when the requested object does not exist."""
+
+
+class StorageEngine(ABC):
+    """
+    Interface every storage backend implements. Views and upload handlers only
+    talk to the engine returned by ``get_storage()``, never to a backend's own
+    client, and only have to handle ``StorageError``. An engine missing any of
+    the methods fails as soon as ``get_storage()`` instantiates it.
+    """
+
+    @abstractmethod
+    def put(self, key, data, content_type):
+        """Stores ``data`` under ``key`` in a single write."""
+
+    @abstractmethod
+    def open_writer(self, key, content_type, part_size=S3_MULTIPART_PART_SIZE):
+        """
+        Returns a writer with ``write(data)``, ``close()`` and ``abort()`` that
+        stores a stream of bytes under ``key`` without holding it all in memory.
+        """
+
+    @abstractmethod
+    def get_range(self, key, start=0, end=None):
+        """Returns bytes ``start`` to ``end`` (inclusive) of an object."""
+
+    @abstractmethod
+    def head(self, key):
+        """Returns the ``ObjectInfo`` of an object."""
+
+    @abstractmethod
+    def delete(self, key):
+        """Deletes an object. Deleting a missing object is not an error."""
+
+    @abstractmethod
+    def delete_many(self, keys):
+        """Deletes several objects with as few calls as the backend allows."""
+
+    @abstractmethod
+    def presign_many(self, keys, expires_in):
+        """Returns a dict mapping each of ``keys`` to a signed download URL."""
+
+    @abstractmethod
+    def presign_post(self, key, content_type, max_size, expires_in):
+        """
+        Returns the ``url`` and form ``fields`` a client posts a file to in
+        order to store it under ``key`` directly.
+        """
+
+    @abstractmethod
+    def create_multipart(self, key, content_type):
+        """Starts a multipart upload and returns its upload id."""
+
+    @abstractmethod
+    def upload_part(self, key, upload_id, part_number, body, size):
+        """
+        Stores one part of a multipart upload, streamed from ``body``, a
+        file-like object holding ``size`` bytes, and returns its ETag.
+        """
+
+    @abstractmethod
+    def complete_multipart(self, key, upload_id, parts):
+        """Assembles ``parts``, a list of ``(part number, etag)``, into ``key``."""
+
+    @abstractmethod
+    def abort_multipart(self, key, upload_id):
+        """Discards a multipart upload and every part stored for it."""
+
+
+@contextmanager
+def s3_errors():
+    """Turns botocore errors raised inside the block into ``StorageError``."""
+    try:
+        yield
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+            raise ObjectNotFound(str(e)) from e
+        raise StorageError(str(e)) from e
+    except BotoCoreError as e:
+        raise StorageError(str(e)) from e
+
+
+class S3MultipartWriter:
+    """
+    Writes a stream of bytes to a single S3 object.
+
+    Data is buffered until more than one part is available; only then is a
+    multipart upload started, so small files still cost a single PutObject.
+    """
+
+    def __init__(
+        self, client, bucket, key, content_type, part_size=S3_MULTIPART_PART_SIZE
+    ):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.content_type = content_type
+        self.part_size = part_size
+        self.buffer = bytearray()
+        self.upload_id = None
+        self.parts = []
+
+    def write(self, data):
+        self.buffer += data
+        # Keep at least one byte back so the final part is never empty.
+        while len(self.buffer) > self.part_size:
+            self._upload_part(bytes(self.buffer[: self.part_size]))
+            del self.buffer[: self.part_size]
+
+    def close(self):
+        with s3_errors():
+            if self.upload_id is None:
+                self.client.put_object(
+                    Bucket=self.bucket,
+                    Key=self.key,
+                    Body=bytes(self.buffer),
+                    ContentType=self.content_type,
+                )
+            else:
+                if self.buffer:
+                    self._upload_part(bytes(self.buffer))
+                self.client.complete_multipart_upload(
+                    Bucket=self.bucket,
+                    Key=self.key,
+                    UploadId=self.upload_id,
+                    MultipartUpload={"Parts": self.parts},
+                )
+        self.buffer = bytearray()
+
+    def abort(self):
+        self.buffer = bytearray()
+        if self.upload_id is None:
+            return
+        try:
+            with s3_errors():
+                self.client.abort_multipart_upload(
+                    Bucket=self.bucket, Key=self.key, UploadId=self.upload_id
+                )
+        except StorageError as e:
+            logger.error(f"Failed to abort multipart upload {self.upload_id}: {e}")
+        self.upload_id = None
+
+    def _upload_part(self, body):
+        with s3_errors():
+            if self.upload_id is None:
+                response = self.client.create_multipart_upload(
+                    Bucket=self.bucket, Key=self.key, ContentType=self.content_type
+                )
+                self.upload_id = response["UploadId"]
+
+            part_number = len(self.parts) + 1
+            response = self.client.upload_part(
+                Bucket=self.bucket,
+                Key=self.key,
+                UploadId=self.upload_id,
+                PartNumber=part_number,
+                Body=body,
+            )
+        self.parts.append({"ETag": response["ETag"], "PartNumber": part_number})
+
+
+class S3Storage(StorageEngine):
+    """Stores objects in the ``AWS_STORAGE_BUCKET_NAME`` bucket."""
+
+    # DeleteObjects accepts at most this many keys per call
+    delete_batch_size = 1000
+
+    @property
+    def client(self):
+        return get_s3_client()
+
+    @property
+    def bucket(self):
+        return settings.AWS_STORAGE_BUCKET_NAME
+
+    def put(self, key, data, content_type):
+        with s3_errors():
+            self.client.put_object(
+                Bucket=self.bucket, Key=key, Body=data, ContentType=content_type
+            )
+
+    def open_writer(self, key, content_type, part_size=S3_MULTIPART_PART_SIZE):
+        return S3MultipartWriter(self.client, self.bucket, key, content_type, part_size)
+
+    def get_range(self, key, start=0, end=None):
+        byte_range = f"bytes={start}-{'' if end is None else end}"
+        with s3_errors():
+            response = self.client.get_object(
+                Bucket=self.bucket, Key=key, Range=byte_range
+            )
+            return response["Body"].read()
+
+    def head(self, key):
+        with s3_errors():
+            response = self.client.head_object(Bucket=self.bucket, Key=key)
+        return ObjectInfo(response["ContentLength"], response.get("ContentType"))
+
+    def delete(self, key):
+        with s3_errors():
+            self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    def delete_many(self, keys):
+        keys = list(keys)
+        while keys:
+            batch = keys[: self.delete_batch_size]
+            del keys[: self.delete_batch_size]
+            with s3_errors():
+                response = self.client.delete_objects(
+                    Bucket=self.bucket,
+                    Delete={"Objects": [{"Key": key} for key in batch], "Quiet": True},
+                )
+            if response.get("Errors"):
+                failed = ", ".join(error["Key"] for error in response["Errors"])
+                raise StorageError(f"Failed to delete {failed}")
+
+    def presign_many(self, keys, expires_in):
+        with s3_errors():
+            return get_presigner().presign_many(keys, expires_in)
+
+    def presign_post(self, key, content_type, max_size, expires_in):
+        with s3_errors():
+            presigned_post = self.client.generate_presigned_post(
+                self.bucket,
+                key,
+                Fields={"Content-Type": content_type},
+                Conditions=[
+                    {"Content-Type": content_type},
+                    ["content-length-range", 1, max_size],
+                ],
+                ExpiresIn=expires_in,
+            )
+        return {"url": presigned_post["url"], "fields": presigned_post["fields"]}
+
+    def create_multipart(self, key, content_type):
+        with s3_errors():
+            response = self.client.create_multipart_upload(
+                Bucket=self.bucket, Key=key, ContentType=content_type
+            )
+        return response["UploadId"]
+
+    def upload_part(self, key, upload_id, part_number, body, size):
+        with s3_errors():
+            response = self.client.upload_part(
+                Bucket=self.bucket,
+                Key=key,
+                UploadId=upload_id,
+                PartNumber=part_number,
+                Body=body,
+                ContentLength=size,
+            )
+        return response["ETag"]
+
+    def complete_multipart(self, key, upload_id, parts):
+        with s3_errors():
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket,
+                Key=key,
+                UploadId=upload_id,
+                MultipartUpload={
+                    "Parts": [
+                        {"ETag": etag, "PartNumber": part_number}
+                        for part_number, etag in parts
+                    ]
+                },
+            )
+
+    def abort_multipart(self, key, upload_id):
+        with s3_errors():
+            self.client.abort_multipart_upload(
+                Bucket=self.bucket, Key=key, UploadId=upload_id
+            )
+
+
+class LocalFileWriter:
+    """
+    Writes a stream of bytes to a temporary file that is moved into place on
+    ``close()``, so readers never see a partially written object.
+    """
+
+    def __init__(self, path, temp_dir, key=None):
+        self.path = path
+        self.key = key
+        os.makedirs(temp_dir, exist_ok=True)
+        self.file = tempfile.NamedTemporaryFile(dir=temp_dir, delete=False)
+
+    def write(self, data):
+        try:
+            self.file.write(data)
+        except OSError as e:
+            raise StorageError(str(e)) from e
+
+    def close(self):
+        try:
+            self.file.close()
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            os.replace(self.file.name, self.path)
+        except OSError as e:
+            self.abort()
+            raise StorageError(str(e)) from e
+
+    def abort(self):
+        self.file.close()
+        try:
+            os.unlink(self.file.name)
+        except FileNotFoundError:
+            pass
+
+
+class LocalStorage(StorageEngine):
+    """
+    Stores objects as files under ``LOCAL_STORAGE_ROOT``, so the service can
+    run on a single box without an object store.
+
+    Download and upload URLs point at this app and carry an HMAC token over
+    the key and expiry time, standing in for S3 presigned URLs. Downloads are
+    served with ``FileResponse``, which hands the open file to the server's
+    ``wsgi.file_wrapper`` so servers that support it send it with sendfile.
+    """
+
+    salt = "files.storage.LocalStorage"
+
+    @property
+    def root(self):
+        return os.path.realpath(settings.LOCAL_STORAGE_ROOT)
+
+    def path(self, key):
+        """Returns the file path of ``key``, refusing keys outside the root."""
+        objects_root = os.path.join(self.root, "objects")
+        path = os.path.realpath(os.path.join(objects_root, key))
+        if (
+            os.path.commonpath([path, objects_root]) != objects_root
+            or path == objects_root
+        ):
+            raise StorageError(f"Invalid key: {key}")
+        return path
+
+    def sign(self, *values):
+        value = "\n".join(str(value) for value in values)
+        return salted_hmac(self.salt, value, algorithm="sha256").hexdigest()
+
+    def verify(self, signature, expires, *values):
+        """Checks a token made by ``presign_many`` or ``presign_post``."""
+        try:
+            expired = int(expires) < time.time()
+        except (TypeError, ValueError):
+            return False
+        return not expired and constant_time_compare(
+            signature or "", self.sign(expires, *values)
+        )
+
+    def open(self, key):
+        """Opens an object for reading."""
+        try:
+            return open(self.path(key), "rb")
+        except FileNotFoundError as e:
+            raise ObjectNotFound(key) from e
+        except OSError as e:
+            raise StorageError(str(e)) from e
+
+    def put(self, key, data, content_type):
+        writer = self.open_writer(key, content_type)
+        writer.write(data)
+        writer.close()
+
+    def open_writer(self, key, content_type, part_size=S3_MULTIPART_PART_SIZE):
+        return LocalFileWriter(self.path(key), os.path.join(self.root, "tmp"), key)
+
+    def get_range(self, key, start=0, end=None):
+        with self.open(key) as file:
+            file.seek(start)
+            return file.read(-1 if end is None else end - start + 1)
+
+    def head(self, key):
+        try:
+            size = os.path.getsize(self.path(key))
+        except FileNotFoundError as e:
+            raise ObjectNotFound(key) from e
+        return ObjectInfo(size, mimetypes.guess_type(key)[0])
+
+    def delete(self, key):
+        try:
+            os.unlink(self.path(key))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            raise StorageError(str(e)) from e
+
+    def delete_many(self, keys):
+        for key in keys:
+            self.delete(key)
+
+    def presign_many(self, keys, expires_in):
+        expires = int(time.time()) + expires_in
+        return {
+            key: (
+                reverse("local-storage-object", args=[key])
+                + "?"
+                + urlencode({"expires": expires, "signature": self.sign(expires, key)})
+            )
+            for key in keys
+        }
+
+    def presign_post(self, key, content_type, max_size, expires_in):
+        expires = int(time.time()) + expires_in
+        fields = {
+            "key": key,
+            "Content-Type": content_type,
+            "max_size": max_size,
+            "expires": expires,
+            "signature": self.sign(expires, key, content_type, max_size),
+        }
+        # The fields are repeated in the URL so that the upload view can
+        # verify them before reading the request body
+        return {
+            "url": reverse("local-storage-upload") + "?" + urlencode(fields),
+            "fields": fields,
+        }
+
+    def _parts_dir(self, upload_id):
+        if not upload_id or not upload_id.isalnum():
+            raise ObjectNotFound(f"No such upload: {upload_id}")
+        return os.path.join(self.root, "multipart", upload_id)
+
+    def create_multipart(self, key, content_type):
+        self.path(key)
+        upload_id = uuid.uuid4().hex
+        os.makedirs(self._parts_dir(upload_id))
+        return upload_id
+
+    def upload_part(self, key, upload_id, part_number, body, size):
+        parts_dir = self._parts_dir(upload_id)
+        if not os.path.isdir(parts_dir):
+            raise ObjectNotFound(f"No such upload: {upload_id}")
+        writer = LocalFileWriter(os.path.join(parts_dir, str(part_number)), parts_dir)
+        digest = hashlib.md5()
+        remaining = size
+        while remaining:
+            chunk = body.read(min(remaining, UPLOAD_PART_READ_SIZE))
+            if not chunk:
+                writer.abort()
+                raise StorageError(f"Part {part_number} ended {remaining} bytes short.")
+            writer.write(chunk)
+            digest.update(chunk)
+            remaining -= len(chunk)
+        writer.close()
+        return f'"{digest.hexdigest()}"'
+
+    def complete_multipart(self, key, upload_id, parts):
+        parts_dir = self._parts_dir(upload_id)
+        writer = self.open_writer(key, None)
+        try:
+            for part_number, _ in parts:
+                with open(os.path.join(parts_dir, str(part_number)), "rb") as part:
+                    shutil.copyfileobj(part, writer.file)
+        except OSError as e:
+            writer.abort()
+            raise StorageError(str(e)) from e
+        writer.close()
+        shutil.rmtree(parts_dir, ignore_errors=True)
+
+    def abort_multipart(self, key, upload_id):
+        shutil.rmtree(self._parts_dir(upload_id), ignore_errors=True)
+
+
+STORAGE_ENGINES = {
+    "s3": S3Storage,
+    "local": LocalStorage,
+}
+
+_engines = {}
+
+
+def get_storage():
+    """Returns the engine selected by the ``FILE_STORAGE_ENGINE`` setting."""
+    name = settings.FILE_STORAGE_ENGINE
+    engine = _engines.get(name)
+    if engine is None:
+        engine = _engines[name] = STORAGE_ENGINES[name]()
+    return engine
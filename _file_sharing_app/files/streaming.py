@@ -0,0 +1,52 @@
+import functools
+import json
+
+from django.http import StreamingHttpResponse
+from rest_framework.utils.encoders import JSONEncoder
+
+# Streamed listing formats, selected with ``?stream=``, and their content types.
+STREAM_FORMATS = {"json": "application/json", "ndjson": "application/x-ndjson"}
+
+dumps = functools.partial(json.dumps, cls=JSONEncoder, separators=(",", ":"))
+
+
+def iter_batches(queryset, size):
+    """
+    Iterates a queryset in lists of ``size`` objects, without the queryset
+    caching its rows, so only one batch is held in memory at a time.
+    """
+    batch = []
+    for obj in queryset.iterator(chunk_size=size):
+        batch.append(obj)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _json_array(batches):
+    yield "["
+    first = True
+    for batch in batches:
+        if batch:
+            chunk = ",".join(dumps(item) for item in batch)
+            yield chunk if first else "," + chunk
+            first = False
+    yield "]"
+
+
+def _ndjson(batches):
+    for batch in batches:
+        yield "".join(dumps(item) + "\n" for item in batch)
+
+
+def streaming_response(batches, stream_format):
+    """
+    Streams batches of items as a JSON array or as newline-delimited JSON,
+    encoding each batch only when the client is ready for it.
+    """
+    encode = _ndjson if stream_format == "ndjson" else _json_array
+    return StreamingHttpResponse(
+        encode(batches), content_type=STREAM_FORMATS[stream_format]
+    )
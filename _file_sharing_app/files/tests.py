@@ -1,7 +1,62 @@
-from django.test import TestCase
+import asyncio
+import base64
+import datetime
+import hmac
+import io
+import json
+import os
+import shutil
+import tempfile
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import requests
+from botocore.exceptions import ClientError
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth.models import User
+from django.urls import reverse
+from django_redis import get_redis_connection
+from redis.exceptions import ConnectionError as RedisConnectionError
+from rest_framework import status
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import RefreshToken
 from teams.models import Team
-from files.models import File, SharedFile, UserFilePermission, TeamFilePermission
+from files.access import get_access, grant_owner_access, refresh_access, resolve_access
+from files.access_cache import _hash_key, invalidate_access
+from files.config import LISTING_ETAG_WINDOW, MAX_FILE_SIZE
+from files.loadtest import LoadGenerator, VirtualUser, percentile
+from files.middleware import peek_file_content_type
+from files.models import (
+    Blob,
+    ChangeEvent,
+    File,
+    FileAccess,
+    SharedFile,
+    UploadSession,
+    UserFilePermission,
+    TeamFilePermission,
+)
+from files.presigner import SigV4Presigner
+from files.queries import permission_grants
+from files.ratelimit import LeasingLimiter, SlidingWindowLimiter
+from files.s3 import S3ClientPool
+from files.serializers import FileReadSerializer, prefetch_shares
+from files.storage import (
+    STORAGE_ENGINES,
+    ObjectNotFound,
+    S3MultipartWriter,
+    StorageEngine,
+    StorageError,
+    get_storage,
+)
+from files.url_cache import get_cached_urls
+from files.utilities import check_file_permissions, generate_presigned_url
 
 
 class FileAppTests(TestCase):
@@ -85,3 +140,1939 @@ class FileAppTests(TestCase):
                 shared_file=self.shared_file,
                 permission="view-and-download",
             )
+
+
+class S3MultipartWriterTests(TestCase):
+    def setUp(self):
+        self.client = mock.Mock()
+        self.client.create_multipart_upload.return_value = {"UploadId": "upload-1"}
+        self.client.upload_part.side_effect = lambda **kwargs: {
+            "ETag": f"etag-{kwargs['PartNumber']}"
+        }
+
+    def test_small_file_uses_single_put(self):
+        """Test a file that fits in one part is written with PutObject"""
+        writer = S3MultipartWriter(self.client, "bucket", "key", "text/plain", 10)
+        writer.write(b"hello")
+        writer.write(b"world")
+        writer.close()
+
+        self.client.put_object.assert_called_once_with(
+            Bucket="bucket", Key="key", Body=b"helloworld", ContentType="text/plain"
+        )
+        self.client.create_multipart_upload.assert_not_called()
+
+    def test_large_file_is_streamed_as_parts(self):
+        """Test data beyond one part is sent as multipart upload parts"""
+        writer = S3MultipartWriter(self.client, "bucket", "key", "text/plain", 4)
+        writer.write(b"abcdef")
+        self.assertEqual(self.client.upload_part.call_count, 1)
+        writer.write(b"ghi")
+        writer.close()
+
+        bodies = [c.kwargs["Body"] for c in self.client.upload_part.call_args_list]
+        self.assertEqual(bodies, [b"abcd", b"efgh", b"i"])
+        self.client.complete_multipart_upload.assert_called_once_with(
+            Bucket="bucket",
+            Key="key",
+            UploadId="upload-1",
+            MultipartUpload={
+                "Parts": [
+                    {"ETag": "etag-1", "PartNumber": 1},
+                    {"ETag": "etag-2", "PartNumber": 2},
+                    {"ETag": "etag-3", "PartNumber": 3},
+                ]
+            },
+        )
+        self.client.put_object.assert_not_called()
+
+    def test_abort_discards_multipart_upload(self):
+        """Test aborting a started multipart upload releases it in S3"""
+        writer = S3MultipartWriter(self.client, "bucket", "key", "text/plain", 4)
+        writer.write(b"abcdefgh")
+        writer.abort()
+
+        self.client.abort_multipart_upload.assert_called_once_with(
+            Bucket="bucket", Key="key", UploadId="upload-1"
+        )
+
+
+class FileUploadStreamingTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="uploader", password="pass1234")
+        self.client.force_authenticate(self.user)
+
+        patcher = mock.patch("files.s3.S3ClientPool.get")
+        self.s3_client = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+
+    def test_upload_streams_file_to_s3(self):
+        """Test the uploaded file is streamed to S3 and its metadata saved"""
+        upload = SimpleUploadedFile("notes.txt", b"some notes", "text/plain")
+        response = self.client.post(
+            reverse("file-upload"), {"file": upload}, format="multipart"
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        file = File.objects.get(uploaded_by=self.user)
+        self.assertEqual(file.file_name, "notes.txt")
+        self.assertEqual(file.file_size, len(b"some notes"))
+        self.assertTrue(file.key.startswith(f"uploads/{self.user.id}/"))
+        self.s3_client.put_object.assert_called_once()
+        self.assertEqual(
+            self.s3_client.put_object.call_args.kwargs["Body"], b"some notes"
+        )
+
+    def test_upload_rejects_unsupported_type(self):
+        """Test a disallowed content type is rejected without writing to S3"""
+        upload = SimpleUploadedFile("run.sh", b"#!/bin/sh", "application/x-sh")
+        response = self.client.post(
+            reverse("file-upload"), {"file": upload}, format="multipart"
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(File.objects.exists())
+        self.s3_client.put_object.assert_not_called()
+
+    def test_upload_rejected_before_body_is_parsed(self):
+        """Test oversized bodies and disallowed part types never reach the parser"""
+        with mock.patch("django.http.multipartparser.MultiPartParser.parse") as parse:
+            upload = SimpleUploadedFile("notes.txt", b"some notes", "text/plain")
+            response = self.client.post(
+                reverse("file-upload"),
+                {"file": upload},
+                format="multipart",
+                CONTENT_LENGTH=str(MAX_FILE_SIZE * 2),
+            )
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn("File too large", response.json()["detail"])
+
+            upload = SimpleUploadedFile("run.sh", b"#!/bin/sh", "application/x-sh")
+            response = self.client.post(
+                reverse("file-upload"),
+                {"comment": "x" * 100, "file": upload},
+                format="multipart",
+            )
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(response.json()["detail"], "Unsupported file type.")
+
+        parse.assert_not_called()
+
+    def test_peeking_leaves_the_body_intact_and_skips_read_bodies(self):
+        """Test the peeked body is read whole and a read body is never peeked"""
+        upload = SimpleUploadedFile("run.sh", b"#!/bin/sh", "application/x-sh")
+        request = RequestFactory().post("/", {"file": upload})
+        body = request.read()
+        request = RequestFactory().post("/", {"file": upload.open()})
+
+        self.assertEqual(peek_file_content_type(request), "application/x-sh")
+        self.assertEqual(request.body, body)
+        self.assertIsNone(peek_file_content_type(request))
+
+    def test_upload_rejects_content_not_matching_type(self):
+        """Test a file whose leading bytes contradict its declared type is refused"""
+        upload = SimpleUploadedFile(
+            "invoice.pdf", b"MZ\x90\x00binary", "application/pdf"
+        )
+        response = self.client.post(
+            reverse("file-upload"), {"file": upload}, format="multipart"
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            response.data["detail"], "File content does not match its type."
+        )
+        self.s3_client.put_object.assert_not_called()
+
+    def test_update_streams_new_content(self):
+        """Test updating a file streams the new content and drops the old object"""
+        file = File.objects.create(
+            file_name="old.txt", key="uploads/old", file_size=3, uploaded_by=self.user
+        )
+        SharedFile.objects.create(file=file)
+        upload = SimpleUploadedFile("new.txt", b"new content", "text/plain")
+        response = self.client.put(
+            reverse("file-update", args=[file.uuid]),
+            {"file": upload},
+            format="multipart",
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        file.refresh_from_db()
+        self.assertEqual(file.file_name, "new.txt")
+        self.assertEqual(file.file_size, len(b"new content"))
+        self.assertEqual(self.s3_client.put_object.call_args.kwargs["Key"], file.key)
+        self.s3_client.delete_object.assert_called_once_with(
+            Bucket=mock.ANY, Key="uploads/old"
+        )
+
+
+class DirectUploadTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="direct", password="pass1234")
+        self.client.force_authenticate(self.user)
+
+        patcher = mock.patch("files.s3.S3ClientPool.get")
+        self.s3_client = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+
+    def test_presigned_post_mirrors_upload_limits(self):
+        """Test the presigned POST carries the content type and size conditions"""
+        self.s3_client.generate_presigned_post.return_value = {
+            "url": "https://bucket.s3.amazonaws.com/",
+            "fields": {"key": "k"},
+        }
+        response = self.client.post(
+            reverse("file-upload-direct"),
+            {
+                "file_name": "report.pdf",
+                "content_type": "application/pdf",
+                "file_size": 10,
+            },
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data["key"].startswith(f"uploads/{self.user.id}/"))
+        self.assertTrue(response.data["key"].endswith("-report.pdf"))
+        conditions = self.s3_client.generate_presigned_post.call_args.kwargs[
+            "Conditions"
+        ]
+        self.assertIn({"Content-Type": "application/pdf"}, conditions)
+        self.assertIn(["content-length-range", 1, MAX_FILE_SIZE], conditions)
+
+    def test_presigned_post_rejects_disallowed_type(self):
+        """Test a disallowed content type is refused before presigning"""
+        response = self.client.post(
+            reverse("file-upload-direct"),
+            {"file_name": "run.sh", "content_type": "application/x-sh", "file_size": 1},
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.s3_client.generate_presigned_post.assert_not_called()
+
+    def test_complete_creates_file_from_head(self):
+        """Test completing a direct upload records the object S3 reports"""
+        key = f"uploads/{self.user.id}/{uuid.uuid4()}-report.pdf"
+        self.s3_client.head_object.return_value = {
+            "ContentLength": 2048,
+            "ContentType": "application/pdf",
+        }
+        self.s3_client.get_object.return_value = {"Body": io.BytesIO(b"%PDF-1.7")}
+        response = self.client.post(
+            reverse("file-upload-direct-complete"), {"key": key}, format="json"
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(
+            self.s3_client.get_object.call_args.kwargs["Range"], "bytes=0-2047"
+        )
+        file = File.objects.get(key=key)
+        self.assertEqual(file.file_name, "report.pdf")
+        self.assertEqual(file.file_size, 2048)
+        self.assertTrue(SharedFile.objects.filter(file=file).exists())
+
+    def test_complete_rejects_other_users_key(self):
+        """Test a user cannot claim an object uploaded under someone else's prefix"""
+        key = f"uploads/{self.user.id + 1}/{uuid.uuid4()}-report.pdf"
+        response = self.client.post(
+            reverse("file-upload-direct-complete"), {"key": key}, format="json"
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.s3_client.head_object.assert_not_called()
+
+    def test_complete_deletes_oversized_object(self):
+        """Test an object breaking the size limit is deleted and rejected"""
+        key = f"uploads/{self.user.id}/{uuid.uuid4()}-big.pdf"
+        self.s3_client.head_object.return_value = {
+            "ContentLength": MAX_FILE_SIZE + 1,
+            "ContentType": "application/pdf",
+        }
+        response = self.client.post(
+            reverse("file-upload-direct-complete"), {"key": key}, format="json"
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(File.objects.filter(key=key).exists())
+        self.s3_client.delete_object.assert_called_once()
+        self.s3_client.get_object.assert_not_called()
+
+    def test_complete_deletes_object_with_wrong_signature(self):
+        """Test an object whose leading bytes contradict its type is deleted"""
+        key = f"uploads/{self.user.id}/{uuid.uuid4()}-report.pdf"
+        self.s3_client.head_object.return_value = {
+            "ContentLength": 2048,
+            "ContentType": "application/pdf",
+        }
+        self.s3_client.get_object.return_value = {"Body": io.BytesIO(b"MZ\x90\x00")}
+        response = self.client.post(
+            reverse("file-upload-direct-complete"), {"key": key}, format="json"
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(File.objects.filter(key=key).exists())
+        self.s3_client.delete_object.assert_called_once()
+
+
+class UploadSessionTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="resumer", password="pass1234")
+        self.client.force_authenticate(self.user)
+
+        patcher = mock.patch("files.s3.S3ClientPool.get")
+        self.s3_client = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        self.s3_client.create_multipart_upload.return_value = {"UploadId": "up-1"}
+        self.s3_client.upload_part.side_effect = lambda **kwargs: {
+            "ETag": f"etag-{kwargs['PartNumber']}"
+        }
+
+        part_size_patcher = mock.patch("files.views.UPLOAD_SESSION_PART_SIZE", 4)
+        part_size_patcher.start()
+        self.addCleanup(part_size_patcher.stop)
+
+        response = self.client.post(
+            reverse("upload-session-create"),
+            {"file_name": "data.csv", "content_type": "text/csv", "file_size": 10},
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["total_parts"], 3)
+        self.session_uuid = response.data["uuid"]
+
+    def put_part(self, part_number, body):
+        return self.client.put(
+            reverse("upload-session-part", args=[self.session_uuid, part_number]),
+            data=body,
+            content_type="application/octet-stream",
+        )
+
+    def test_parts_out_of_order_then_commit(self):
+        """Test parts can arrive in any order and commit assembles them in order"""
+        self.assertEqual(self.put_part(3, b"ij").status_code, status.HTTP_200_OK)
+        self.assertEqual(self.put_part(1, b"abcd").status_code, status.HTTP_200_OK)
+
+        response = self.client.get(reverse("upload-session", args=[self.session_uuid]))
+        self.assertEqual(response.data["missing_parts"], [2])
+
+        self.assertEqual(self.put_part(2, b"efgh").status_code, status.HTTP_200_OK)
+        self.s3_client.get_object.return_value = {"Body": io.BytesIO(b"abcdefghij")}
+        response = self.client.post(
+            reverse("upload-session-complete", args=[self.session_uuid])
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(
+            self.s3_client.get_object.call_args.kwargs["Range"], "bytes=0-2047"
+        )
+        upload_part = self.s3_client.upload_part.call_args.kwargs
+        self.assertEqual(upload_part["ContentLength"], 4)
+        parts = self.s3_client.complete_multipart_upload.call_args.kwargs[
+            "MultipartUpload"
+        ]["Parts"]
+        self.assertEqual([p["PartNumber"] for p in parts], [1, 2, 3])
+        file = File.objects.get(uploaded_by=self.user)
+        self.assertEqual(file.file_size, 10)
+        self.assertEqual(file.file_name, "data.csv")
+
+    def test_wrong_part_size_is_rejected(self):
+        """Test a part that does not match its expected size is refused"""
+        response = self.put_part(1, b"abc")
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.s3_client.upload_part.assert_not_called()
+
+    def test_commit_rejects_content_not_matching_type(self):
+        """Test an assembled file whose leading bytes contradict its type is dropped"""
+        for part_number, body in enumerate([b"MZ\x00\x00", b"\x00bin", b"ok"], 1):
+            self.put_part(part_number, body)
+        self.s3_client.get_object.return_value = {"Body": io.BytesIO(b"MZ\x00\x00")}
+        response = self.client.post(
+            reverse("upload-session-complete", args=[self.session_uuid])
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(File.objects.exists())
+        self.s3_client.delete_object.assert_called_once_with(
+            Bucket=mock.ANY, Key=mock.ANY
+        )
+        response = self.client.get(reverse("upload-session", args=[self.session_uuid]))
+        self.assertEqual(response.data["status"], "aborted")
+
+    def test_commit_with_missing_parts_fails(self):
+        """Test committing before all parts arrived reports the missing parts"""
+        self.put_part(1, b"abcd")
+        response = self.client.post(
+            reverse("upload-session-complete", args=[self.session_uuid])
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data["missing_parts"], [2, 3])
+        self.s3_client.complete_multipart_upload.assert_not_called()
+
+    def test_abort_releases_multipart_upload(self):
+        """Test aborting a session aborts the S3 upload and blocks new parts"""
+        response = self.client.delete(
+            reverse("upload-session", args=[self.session_uuid])
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.s3_client.abort_multipart_upload.assert_called_once()
+        self.assertEqual(
+            self.put_part(1, b"abcd").status_code, status.HTTP_409_CONFLICT
+        )
+
+
+class BlobDeduplicationTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="dedup", password="pass1234")
+        self.client.force_authenticate(self.user)
+
+        patcher = mock.patch("files.s3.S3ClientPool.get")
+        self.s3_client = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+
+    def upload(self, name, content):
+        upload = SimpleUploadedFile(name, content, "text/plain")
+        response = self.client.post(
+            reverse("file-upload"), {"file": upload}, format="multipart"
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return File.objects.get(uuid=response.data["uuid"])
+
+    def test_duplicate_content_skips_s3_write(self):
+        """Test re-uploading identical content reuses the stored blob"""
+        first = self.upload("a.txt", b"same bytes")
+        second = self.upload("b.txt", b"same bytes")
+
+        self.assertEqual(self.s3_client.put_object.call_count, 1)
+        self.assertEqual(first.blob, second.blob)
+        self.assertEqual(first.key, second.key)
+        self.assertEqual(Blob.objects.get().ref_count, 2)
+
+    def test_blob_deleted_with_last_reference(self):
+        """Test shared content is only deleted from S3 with its last file"""
+        first = self.upload("a.txt", b"same bytes")
+        second = self.upload("b.txt", b"same bytes")
+
+        self.client.delete(reverse("file-delete", args=[first.uuid]))
+        self.s3_client.delete_object.assert_not_called()
+        self.assertEqual(Blob.objects.get().ref_count, 1)
+
+        self.client.delete(reverse("file-delete", args=[second.uuid]))
+        self.s3_client.delete_object.assert_called_once_with(
+            Bucket=mock.ANY, Key=first.key
+        )
+        self.assertFalse(Blob.objects.exists())
+
+    def test_second_file_part_is_rejected_without_leaking(self):
+        """Test a request with two file parts is refused and keeps no blob"""
+        uploads = [
+            SimpleUploadedFile(name, content, "text/plain")
+            for name, content in (("a.txt", b"first"), ("b.txt", b"second"))
+        ]
+        response = self.client.post(
+            reverse("file-upload"), {"file": uploads}, format="multipart"
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data["detail"], "Only one file may be uploaded.")
+        self.assertFalse(Blob.objects.exists())
+        self.assertFalse(File.objects.exists())
+
+    def test_failed_save_releases_the_blob(self):
+        """Test blob references are given back when the files cannot be saved"""
+        first = self.upload("a.txt", b"same bytes")
+        with mock.patch(
+            "files.views.grant_owner_access", side_effect=IntegrityError
+        ), self.assertRaises(IntegrityError):
+            self.client.post(
+                reverse("file-upload"),
+                {"file": SimpleUploadedFile("b.txt", b"same bytes", "text/plain")},
+                format="multipart",
+            )
+        self.assertEqual(Blob.objects.get().ref_count, 1)
+
+        with mock.patch(
+            "files.views.grant_owner_access", side_effect=IntegrityError
+        ), self.assertRaises(IntegrityError):
+            self.client.post(
+                reverse("file-upload-batch"),
+                {
+                    "files": [
+                        SimpleUploadedFile("c.txt", b"same bytes", "text/plain"),
+                        SimpleUploadedFile("d.txt", b"other bytes", "text/plain"),
+                    ]
+                },
+                format="multipart",
+            )
+        self.assertEqual(Blob.objects.get().ref_count, 1)
+        self.assertEqual(Blob.objects.get().key, first.key)
+
+
+class FileAccessTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user(username="owner", password="pass1234")
+        self.friend = User.objects.create_user(username="friend", password="pass1234")
+        self.colleague = User.objects.create_user(
+            username="colleague", password="pass1234"
+        )
+        self.team = Team.objects.create(name="Access Team")
+        self.team.members.add(self.owner)
+        self.client.force_authenticate(self.owner)
+
+        self.file = File.objects.create(
+            file_name="plan.txt", key="plan", file_size=4, uploaded_by=self.owner
+        )
+        SharedFile.objects.create(file=self.file)
+        grant_owner_access([self.file])
+
+    def access(self):
+        return dict(
+            FileAccess.objects.filter(file=self.file).values_list(
+                "user__username", "permission"
+            )
+        )
+
+    def test_shares_and_membership_update_access(self):
+        """Test shares and team membership changes keep effective access current"""
+        self.client.post(
+            reverse("share-file", args=[self.file.uuid]),
+            {
+                "user_permissions": [{"user_id": self.friend.id, "permission": "view"}],
+                "team_permissions": [
+                    {"team_id": self.team.id, "permission": "view-and-download"}
+                ],
+            },
+            format="json",
+        )
+        self.assertEqual(self.access(), {"owner": "owner", "friend": "view"})
+
+        for user in (self.friend, self.colleague):
+            self.client.post(
+                reverse("add-member", args=[self.team.id]), {"user_id": user.id}
+            )
+        self.assertEqual(
+            self.access(),
+            {
+                "owner": "owner",
+                "friend": "view-and-download",
+                "colleague": "view-and-download",
+            },
+        )
+
+        self.client.post(
+            reverse("remove-member", args=[self.team.id]),
+            {"user_id": self.colleague.id},
+        )
+        self.client.post(
+            reverse("remove-member", args=[self.team.id]), {"user_id": self.friend.id}
+        )
+        self.assertEqual(self.access(), {"owner": "owner", "friend": "view"})
+
+    def test_access_check_is_one_query(self):
+        """Test checking access is a single lookup and deleted files lose it"""
+        with self.assertNumQueries(1):
+            self.assertTrue(check_file_permissions(self.owner, self.file))
+        with self.assertNumQueries(1):
+            self.assertFalse(check_file_permissions(self.friend, self.file))
+
+        with mock.patch("files.s3.S3ClientPool.get"):
+            self.client.delete(reverse("file-delete", args=[self.file.uuid]))
+        self.assertFalse(FileAccess.objects.exists())
+
+    def test_rebuild_matches_incremental_updates(self):
+        """Test rebuilding the table from scratch gives the same rows"""
+        TeamFilePermission.objects.create(
+            team=self.team, shared_file=self.file.shared_info, permission="view"
+        )
+        self.team.members.add(self.friend)
+        refresh_access([self.friend.id], [self.file.id])
+        incremental = self.access()
+
+        FileAccess.objects.all().delete()
+        call_command("rebuild_file_access", stdout=io.StringIO())
+        self.assertEqual(self.access(), incremental)
+
+    def test_rebuild_records_no_change_events(self):
+        """Test a full rebuild does not flood the change feeds with grants"""
+        UserFilePermission.objects.create(
+            user=self.friend, shared_file=self.file.shared_info, permission="view"
+        )
+        FileAccess.objects.all().delete()
+        ChangeEvent.objects.all().delete()
+
+        call_command("rebuild_file_access", stdout=io.StringIO())
+        self.assertEqual(self.access(), {"owner": "owner", "friend": "view"})
+        self.assertFalse(ChangeEvent.objects.exists())
+
+    def test_permission_sources_are_one_union_query(self):
+        """Test every grant of a user comes back from a single UNION query"""
+        UserFilePermission.objects.create(
+            user=self.friend, shared_file=self.file.shared_info, permission="view"
+        )
+        TeamFilePermission.objects.create(
+            team=self.team,
+            shared_file=self.file.shared_info,
+            permission="view-and-download",
+        )
+        self.team.members.add(self.friend)
+
+        with self.assertNumQueries(1):
+            grants = sorted(
+                permission_grants([self.owner.id, self.friend.id], [self.file.id])
+            )
+        self.assertEqual(
+            grants,
+            sorted(
+                [
+                    (self.owner.id, self.file.id, "owner"),
+                    (self.owner.id, self.file.id, "view-and-download"),
+                    (self.friend.id, self.file.id, "view"),
+                    (self.friend.id, self.file.id, "view-and-download"),
+                ]
+            ),
+        )
+
+        out = io.StringIO()
+        call_command("explain_access_queries", "friend", "--runs", "1", stdout=out)
+        self.assertIn("UNION ALL of permission sources", out.getvalue())
+
+
+class PresignedUrlCacheTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="cached", password="pass1234")
+        self.client.force_authenticate(self.user)
+        self.files = [
+            File.objects.create(
+                file_name=f"file{n}.txt",
+                key=f"uploads/file{n}.txt",
+                file_size=10,
+                uploaded_by=self.user,
+            )
+            for n in range(3)
+        ]
+        for file in self.files:
+            SharedFile.objects.create(file=file)
+        grant_owner_access(self.files)
+
+        patcher = mock.patch("files.utilities.get_storage")
+        self.presigner = patcher.start().return_value
+        self.presigner.presign_many.side_effect = lambda keys, expires_in: {
+            key: f"https://signed/{key}" for key in keys
+        }
+        self.addCleanup(patcher.stop)
+
+    def test_listing_reuses_cached_urls(self):
+        """Test a listing signs each URL once and then serves it from the cache"""
+        for _ in range(2):
+            response = self.client.get(reverse("file-retrieve"))
+            self.assertEqual(
+                sorted(item["download_url"] for item in response.data["results"]),
+                [f"https://signed/{file.key}" for file in self.files],
+            )
+
+        self.presigner.presign_many.assert_called_once()
+        self.assertEqual(
+            set(self.presigner.presign_many.call_args.args[0]),
+            {file.key for file in self.files},
+        )
+
+    def test_delete_invalidates_cached_url(self):
+        """Test deleting a file drops its cached URL"""
+        key = self.files[0].key
+        self.assertEqual(generate_presigned_url(key), f"https://signed/{key}")
+        self.assertEqual(get_cached_urls([key]), {key: f"https://signed/{key}"})
+
+        with mock.patch("files.s3.S3ClientPool.get"):
+            self.client.delete(reverse("file-delete", args=[self.files[0].uuid]))
+
+        self.assertEqual(get_cached_urls([key]), {})
+
+
+class PermissionResolverTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user(username="sharer", password="pass1234")
+        self.user = User.objects.create_user(username="reader", password="pass1234")
+        self.teams = [Team.objects.create(name=f"Team {n}") for n in range(2)]
+        for team in self.teams:
+            team.members.add(self.user)
+        self.client.force_authenticate(self.user)
+
+        patcher = mock.patch("files.utilities.get_storage")
+        patcher.start().return_value.presign_many.side_effect = (
+            lambda keys, expires_in: {key: f"https://signed/{key}" for key in keys}
+        )
+        self.addCleanup(patcher.stop)
+
+    def share_files(self, count):
+        """Shares files with the user both directly and through each team."""
+        files = []
+        start = File.objects.count()
+        for n in range(start, start + count):
+            file = File.objects.create(
+                file_name=f"doc{n}.txt",
+                key=f"docs/{n}",
+                file_size=1,
+                uploaded_by=self.owner,
+            )
+            shared = SharedFile.objects.create(file=file)
+            UserFilePermission.objects.create(
+                shared_file=shared, user=self.user, permission="view"
+            )
+            for team in self.teams:
+                TeamFilePermission.objects.create(
+                    shared_file=shared, team=team, permission="view-and-download"
+                )
+            files.append(file)
+        refresh_access(user_ids=[self.user.id])
+        return files
+
+    def count_queries(self, url_name):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(url_name))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(queries), response.data["results"]
+
+    def test_resolves_permission_source_and_teams(self):
+        """Test the strongest grant wins and granting teams are reported"""
+        (shared,) = self.share_files(1)
+        own = File.objects.create(
+            file_name="mine.txt", key="mine", file_size=1, uploaded_by=self.user
+        )
+        hidden = File.objects.create(
+            file_name="hidden.txt", key="hidden", file_size=1, uploaded_by=self.owner
+        )
+
+        with self.assertNumQueries(2):
+            resolved = resolve_access(self.user, [shared, own, hidden])
+
+        self.assertEqual(
+            resolved[shared.id],
+            ("view-and-download", "team", ["Team 0", "Team 1"]),
+        )
+        self.assertEqual(resolved[own.id], ("owner", "owner", []))
+        self.assertNotIn(hidden.id, resolved)
+
+    def test_listing_query_count_is_constant(self):
+        """Test each listing runs the same number of queries for 2 or 6 files"""
+        for url_name in (
+            "file-retrieve",
+            "files-shared-with-user",
+            "files-shared-with-user-teams",
+        ):
+            with self.subTest(url_name=url_name):
+                File.objects.all().delete()
+                self.share_files(2)
+                small, data = self.count_queries(url_name)
+                self.assertEqual(len(data), 2)
+
+                self.share_files(4)
+                large, data = self.count_queries(url_name)
+                self.assertEqual(len(data), 6)
+                self.assertEqual(small, large)
+                for item in data:
+                    self.assertEqual(item["permissions"], "view-and-download")
+                    self.assertTrue(item["download_url"].startswith("https://signed/"))
+
+
+class AccessCacheTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user(username="keeper", password="pass1234")
+        self.friend = User.objects.create_user(username="visitor", password="pass1234")
+        self.team = Team.objects.create(name="Cache Team")
+        self.team.members.add(self.owner)
+        self.client.force_authenticate(self.owner)
+
+        self.file = File.objects.create(
+            file_name="notes.txt", key="notes", file_size=5, uploaded_by=self.owner
+        )
+        SharedFile.objects.create(file=self.file)
+        grant_owner_access([self.file])
+
+    def test_access_checks_are_served_from_cache(self):
+        """Test repeated access checks do not query the database"""
+        self.assertEqual(get_access(self.owner, self.file), "owner")
+        with self.assertNumQueries(0):
+            self.assertEqual(get_access(self.owner, self.file), "owner")
+            self.assertIsNone(get_access(self.owner, mock.Mock(id=0)))
+
+    def test_share_and_membership_changes_invalidate(self):
+        """Test sharing and team membership changes reach cached access"""
+        self.assertIsNone(get_access(self.friend, self.file))
+
+        self.client.post(
+            reverse("share-file", args=[self.file.uuid]),
+            {"team_permissions": [{"team_id": self.team.id, "permission": "view"}]},
+            format="json",
+        )
+        self.client.post(
+            reverse("add-member", args=[self.team.id]), {"user_id": self.friend.id}
+        )
+        self.assertEqual(get_access(self.friend, self.file), "view")
+
+        self.client.post(
+            reverse("remove-member", args=[self.team.id]), {"user_id": self.friend.id}
+        )
+        self.assertIsNone(get_access(self.friend, self.file))
+
+    def test_delete_invalidates(self):
+        """Test deleting a file removes it from cached access"""
+        self.assertEqual(get_access(self.owner, self.file), "owner")
+        with mock.patch("files.s3.S3ClientPool.get"):
+            self.client.delete(reverse("file-delete", args=[self.file.uuid]))
+        self.assertIsNone(get_access(self.owner, self.file))
+
+    def test_redis_outage_falls_back_to_the_database(self):
+        """Test access checks read FileAccess while Redis is unreachable"""
+        with mock.patch(
+            "redis.Redis.execute_command", side_effect=RedisConnectionError
+        ), self.assertLogs("files.access_cache", level="WARNING"):
+            with self.assertNumQueries(1):
+                self.assertEqual(get_access(self.owner, self.file), "owner")
+            self.assertIsNone(get_access(self.friend, self.file))
+
+    def test_stale_versions_are_never_read(self):
+        """Test an entry written under an old version cannot grant access"""
+        redis = get_redis_connection("default")
+        self.assertIsNone(get_access(self.friend, self.file))
+        old_version = int(redis.get(f"file_access_version:{self.friend.id}"))
+
+        invalidate_access([self.friend.id])
+        # A request that raced the change writes its stale view back
+        redis.hset(_hash_key(self.friend.id, old_version), str(self.file.id), "owner")
+        self.assertIsNone(get_access(self.friend, self.file))
+
+        # An evicted version counter restarts from the clock, not from zero
+        redis.delete(f"file_access_version:{self.friend.id}")
+        invalidate_access([self.friend.id])
+        self.assertGreater(
+            int(redis.get(f"file_access_version:{self.friend.id}")), old_version
+        )
+
+
+class BulkShareTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user(username="bulkowner", password="pass1234")
+        self.stranger = User.objects.create_user(
+            username="stranger", password="pass1234"
+        )
+        self.team = Team.objects.create(name="Bulk Team")
+        self.client.force_authenticate(self.owner)
+
+    def create_files(self, count, owner=None):
+        start = File.objects.count()
+        return [
+            File.objects.create(
+                file_name=f"bulk{n}.txt",
+                key=f"bulk/{n}",
+                file_size=1,
+                uploaded_by=owner or self.owner,
+            )
+            for n in range(start, start + count)
+        ]
+
+    def create_users(self, count):
+        start = User.objects.count()
+        return [
+            User.objects.create_user(username=f"grantee{n}", password="pass1234")
+            for n in range(start, start + count)
+        ]
+
+    def share(self, files, users, teams=()):
+        return self.client.post(
+            reverse("share-bulk"),
+            {
+                "file_uuids": [str(file.uuid) for file in files],
+                "user_permissions": [
+                    {"user_id": user.id, "permission": "view"} for user in users
+                ],
+                "team_permissions": [
+                    {"team_id": team.id, "permission": "view-and-download"}
+                    for team in teams
+                ],
+            },
+            format="json",
+        )
+
+    def test_bulk_share_reports_per_item_errors(self):
+        """Test valid pairs are shared while bad files and principals are reported"""
+        files = self.create_files(2)
+        (foreign,) = self.create_files(1, owner=self.stranger)
+        users = self.create_users(2)
+        self.team.members.add(self.stranger)
+        missing = uuid.uuid4()
+
+        response = self.client.post(
+            reverse("share-bulk"),
+            {
+                "file_uuids": [str(file.uuid) for file in files]
+                + [str(foreign.uuid), str(missing)],
+                "user_permissions": [
+                    {"user_id": user.id, "permission": "view"}
+                    for user in users + [self.owner]
+                ]
+                + [{"user_id": 999999, "permission": "view"}],
+                "team_permissions": [
+                    {"team_id": self.team.id, "permission": "view-and-download"}
+                ],
+            },
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            set(response.data["shared_files"]), {file.uuid for file in files}
+        )
+        self.assertCountEqual(
+            [
+                error.get("file_uuid") or error.get("user_id")
+                for error in response.data["errors"]
+            ],
+            [str(foreign.uuid), str(missing), self.owner.id, 999999],
+        )
+        self.assertEqual(
+            UserFilePermission.objects.filter(shared_file__file__in=files).count(), 4
+        )
+        self.assertFalse(UserFilePermission.objects.filter(user=self.owner).exists())
+        for file in files:
+            self.assertTrue(check_file_permissions(self.stranger, file))
+        self.assertFalse(check_file_permissions(users[0], foreign))
+
+    def test_bulk_share_overwrites_existing_permissions(self):
+        """Test sharing again updates permissions instead of duplicating them"""
+        files = self.create_files(2)
+        (user,) = self.create_users(1)
+        self.share(files, [user])
+        self.client.post(
+            reverse("share-bulk"),
+            {
+                "file_uuids": [str(file.uuid) for file in files],
+                "user_permissions": [
+                    {"user_id": user.id, "permission": "view-and-download"}
+                ],
+            },
+            format="json",
+        )
+
+        self.assertEqual(
+            list(
+                UserFilePermission.objects.filter(user=user).values_list(
+                    "permission", flat=True
+                )
+            ),
+            ["view-and-download", "view-and-download"],
+        )
+        self.assertEqual(get_access(user, files[0]), "view-and-download")
+
+    def test_bulk_share_rejects_invalid_permission(self):
+        """Test an unknown permission fails validation before anything is written"""
+        files = self.create_files(1)
+        response = self.client.post(
+            reverse("share-bulk"),
+            {
+                "file_uuids": [str(files[0].uuid)],
+                "user_permissions": [
+                    {"user_id": self.stranger.id, "permission": "edit"}
+                ],
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(UserFilePermission.objects.exists())
+
+    def test_bulk_share_query_count_is_constant(self):
+        """Test sharing more files with more users takes the same number of queries"""
+        counts = []
+        # Sizes stay under one SQLite insert batch of change events
+        for file_count, user_count in ((2, 2), (12, 8)):
+            files, users = self.create_files(file_count), self.create_users(user_count)
+            with CaptureQueriesContext(connection) as queries:
+                response = self.share(files, users, [self.team])
+            self.assertEqual(len(response.data["shared_files"]), file_count)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+
+class KeysetPaginationTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="pager", password="pass1234")
+        self.client.force_authenticate(self.user)
+        self.team = Team.objects.create(name="Paging Team")
+        self.team.members.add(self.user)
+
+        self.files = [
+            File.objects.create(
+                file_name=f"page{n}.txt",
+                key=f"pages/{n}",
+                file_size=1,
+                uploaded_by=self.user,
+            )
+            for n in range(7)
+        ]
+        # Several files uploaded at the same instant are told apart by id
+        same_time = self.files[0].uploaded_at
+        File.objects.filter(id__in=[file.id for file in self.files[2:5]]).update(
+            uploaded_at=same_time
+        )
+        for file in self.files:
+            shared = SharedFile.objects.create(file=file)
+            TeamFilePermission.objects.create(
+                shared_file=shared, team=self.team, permission="view"
+            )
+        refresh_access(user_ids=[self.user.id])
+
+        patcher = mock.patch("files.utilities.get_storage")
+        patcher.start().return_value.presign_many.side_effect = (
+            lambda keys, expires_in: {key: f"https://signed/{key}" for key in keys}
+        )
+        self.addCleanup(patcher.stop)
+
+    def walk(self, url_name, *args, page_size=3):
+        """Follows next links and returns every page's results."""
+        pages = []
+        url = reverse(url_name, args=args) + f"?page_size={page_size}"
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            pages.append(response.data["results"])
+            url = response.data["next"]
+        return pages
+
+    def test_cursor_walks_every_file_once(self):
+        """Test following cursors visits each file exactly once, newest first"""
+        expected = [file.uuid for file in File.objects.order_by("-uploaded_at", "-id")]
+        for url_name in ("file-retrieve", "files-shared-with-user-teams"):
+            with self.subTest(url_name=url_name):
+                pages = self.walk(url_name)
+                self.assertEqual([len(page) for page in pages], [3, 3, 1])
+                self.assertEqual(
+                    [item["file_uuid"] for page in pages for item in page], expected
+                )
+
+        pages = self.walk("files-shared-with-team", self.team.id, page_size=4)
+        self.assertEqual(sum(len(page) for page in pages), 7)
+
+    def test_page_cost_does_not_depend_on_depth(self):
+        """Test a deep page runs the same queries as the first, without COUNT"""
+        with CaptureQueriesContext(connection) as first:
+            response = self.client.get(reverse("file-retrieve") + "?page_size=2")
+        with CaptureQueriesContext(connection) as deep:
+            self.client.get(response.data["next"])
+        self.assertEqual(len(first), len(deep))
+        self.assertFalse(
+            any("COUNT(" in query["sql"].upper() for query in first.captured_queries)
+        )
+
+    def test_invalid_cursor(self):
+        """Test a malformed cursor or one holding values of the wrong type is rejected"""
+        response = self.client.get(reverse("file-retrieve") + "?cursor=not-a-cursor")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        file_urls = [
+            reverse("file-retrieve"),
+            reverse("files-shared-with-team", args=[self.team.id]),
+        ]
+        for position, urls in (
+            (["abc", 1], file_urls),
+            (["2024-01-01T00:00:00+00:00", "x"], file_urls),
+            ([None, None], file_urls + [reverse("team-list")]),
+            ([{"a": 1}, 1], file_urls + [reverse("team-list")]),
+        ):
+            cursor = base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+            for url in urls:
+                with self.subTest(position=position, url=url):
+                    response = self.client.get(url, {"cursor": cursor})
+                    self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class FileReadSerializerTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user(username="reader1", password="pass1234")
+        self.friend = User.objects.create_user(username="reader2", password="pass1234")
+        self.team = Team.objects.create(name="Reading Team")
+        self.client.force_authenticate(self.owner)
+
+    def create_shared_files(self, count):
+        start = File.objects.count()
+        files = []
+        for n in range(start, start + count):
+            file = File.objects.create(
+                file_name=f"read{n}.txt",
+                key=f"read/{n}",
+                file_size=1,
+                uploaded_by=self.owner,
+            )
+            shared = SharedFile.objects.create(file=file)
+            UserFilePermission.objects.create(
+                shared_file=shared, user=self.friend, permission="view"
+            )
+            TeamFilePermission.objects.create(
+                shared_file=shared, team=self.team, permission="view-and-download"
+            )
+            files.append(file)
+        grant_owner_access(files)
+        return files
+
+    def test_prefetched_files_serialize_in_fixed_queries(self):
+        """Test serializing more files does not run more queries"""
+        for count in (2, 6):
+            self.create_shared_files(count)
+            files = list(File.objects.all())
+            with self.assertNumQueries(4):
+                data = FileReadSerializer(prefetch_shares(files), many=True).data
+
+        self.assertEqual(len(data), 8)
+        self.assertEqual(data[0]["shared_with_users"], ["reader2"])
+        self.assertEqual(data[0]["shared_with_teams"], ["Reading Team"])
+        self.assertEqual(
+            data[0]["permissions"],
+            {
+                "users": {"reader2": "view"},
+                "teams": {"Reading Team": "view-and-download"},
+            },
+        )
+
+    def test_sparse_fieldsets(self):
+        """Test ?fields= trims payloads and skips URLs that were not asked for"""
+        self.create_shared_files(2)
+
+        with mock.patch("files.utilities.get_storage") as get_storage:
+            response = self.client.get(
+                reverse("file-retrieve") + "?fields=file_uuid,file_name"
+            )
+        get_storage.assert_not_called()
+        self.assertEqual(
+            [set(item) for item in response.data["results"]],
+            [{"file_uuid", "file_name"}] * 2,
+        )
+
+        request = mock.Mock(query_params={"fields": "uuid,file_name"})
+        data = FileReadSerializer(
+            File.objects.first(), context={"request": request}
+        ).data
+        self.assertEqual(set(data), {"uuid", "file_name"})
+
+
+class ListingETagTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user(username="poller", password="pass1234")
+        self.friend = User.objects.create_user(username="watcher", password="pass1234")
+        self.team = Team.objects.create(name="Polling Team")
+        self.team.members.add(self.owner, self.friend)
+        self.client.force_authenticate(self.friend)
+
+        self.file = File.objects.create(
+            file_name="report.txt", key="report", file_size=6, uploaded_by=self.owner
+        )
+        SharedFile.objects.create(file=self.file)
+        grant_owner_access([self.file])
+
+        patcher = mock.patch("files.utilities.get_storage")
+        patcher.start().return_value.presign_many.side_effect = (
+            lambda keys, expires_in: {key: f"https://signed/{key}" for key in keys}
+        )
+        self.addCleanup(patcher.stop)
+
+    def share(self, **permissions):
+        self.client.force_authenticate(self.owner)
+        self.client.post(
+            reverse("share-file", args=[self.file.uuid]), permissions, format="json"
+        )
+        self.client.force_authenticate(self.friend)
+
+    def test_unchanged_listing_is_not_modified_without_queries(self):
+        """Test a matching If-None-Match gets a 304 before any listing query"""
+        for url, queries in (
+            (reverse("file-retrieve"), 0),
+            (reverse("files-shared-with-user"), 0),
+            (reverse("files-shared-with-user-teams"), 0),
+            # The team listing checks membership first
+            (reverse("files-shared-with-team", args=[self.team.id]), 1),
+        ):
+            with self.subTest(url=url):
+                etag = self.client.get(url)["ETag"]
+                with self.assertNumQueries(queries):
+                    response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+                self.assertEqual(response["ETag"], etag)
+
+                other = self.client.get(url + "?page_size=5")
+                self.assertNotEqual(other["ETag"], etag)
+
+    def test_team_listing_is_authorized_before_the_etag(self):
+        """Test outsiders get a 403 or 404, never a 304, for a team listing"""
+        outsider = User.objects.create_user(username="outsider", password="pass1234")
+        self.client.force_authenticate(outsider)
+        for team_id, expected in (
+            (self.team.id, status.HTTP_403_FORBIDDEN),
+            (self.team.id + 100, status.HTTP_404_NOT_FOUND),
+        ):
+            response = self.client.get(
+                reverse("files-shared-with-team", args=[team_id]),
+                HTTP_IF_NONE_MATCH="*",
+            )
+            self.assertEqual(response.status_code, expected)
+            self.assertNotIn("ETag", response)
+
+    def test_changes_move_the_etag(self):
+        """Test shares, updates and membership changes produce a new ETag"""
+        url = reverse("file-retrieve")
+        team_url = reverse("files-shared-with-team", args=[self.team.id])
+        etag, team_etag = (
+            self.client.get(url)["ETag"],
+            self.client.get(team_url)["ETag"],
+        )
+
+        self.share(user_permissions=[{"user_id": self.friend.id, "permission": "view"}])
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data["results"]), 1)
+        etag = response["ETag"]
+
+        self.share(team_permissions=[{"team_id": self.team.id, "permission": "view"}])
+        for current, listing in ((etag, url), (team_etag, team_url)):
+            response = self.client.get(listing, HTTP_IF_NONE_MATCH=current)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = self.client.get(url)["ETag"]
+
+        self.client.force_authenticate(self.owner)
+        self.client.post(
+            reverse("remove-member", args=[self.team.id]), {"user_id": self.friend.id}
+        )
+        self.client.force_authenticate(self.friend)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["results"][0]["granted_via"], "user")
+
+    def test_redis_outage_serves_listings_and_writes_without_etags(self):
+        """Test listings lose their ETag and writes still succeed without Redis"""
+        etag = self.client.get(reverse("file-retrieve"))["ETag"]
+        with mock.patch(
+            "redis.Redis.execute_command", side_effect=RedisConnectionError
+        ), mock.patch(
+            "redis.client.Pipeline.execute", side_effect=RedisConnectionError
+        ), self.assertLogs(
+            "files", level="WARNING"
+        ):
+            response = self.client.get(
+                reverse("file-retrieve"), HTTP_IF_NONE_MATCH=etag
+            )
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn("ETag", response)
+
+            self.share(
+                user_permissions=[{"user_id": self.friend.id, "permission": "view"}]
+            )
+            response = self.client.get(
+                reverse("files-shared-with-user"), HTTP_IF_NONE_MATCH=etag
+            )
+            self.assertEqual(len(response.data["results"]), 1)
+
+    def test_etag_rotates_with_url_window(self):
+        """Test ETags expire with the window cached download URLs are valid for"""
+        url = reverse("file-retrieve")
+        with mock.patch("files.etags.time.time", return_value=1_000_000):
+            etag = self.client.get(url)["ETag"]
+        with mock.patch(
+            "files.etags.time.time", return_value=1_000_000 + LISTING_ETAG_WINDOW
+        ):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class ChangeFeedTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user(username="author", password="pass1234")
+        self.friend = User.objects.create_user(username="follower", password="pass1234")
+        self.team = Team.objects.create(name="Feed Team")
+        self.team.members.add(self.owner)
+        self.client.force_authenticate(self.owner)
+
+        with transaction.atomic():
+            self.file = File.objects.create(
+                file_name="feed.txt", key="feed", file_size=4, uploaded_by=self.owner
+            )
+            SharedFile.objects.create(file=self.file)
+            grant_owner_access([self.file])
+
+    def changes(self, user, since=None):
+        self.client.force_authenticate(user)
+        url = reverse("file-changes")
+        response = self.client.get(url if since is None else f"{url}?since={since}")
+        self.client.force_authenticate(self.owner)
+        return response
+
+    def event_types(self, response):
+        return [event["event_type"] for event in response.data["events"]]
+
+    def test_events_are_scoped_to_the_caller(self):
+        """Test each user only sees the changes visible to them, in order"""
+        self.client.post(
+            reverse("share-file", args=[self.file.uuid]),
+            {"user_permissions": [{"user_id": self.friend.id, "permission": "view"}]},
+            format="json",
+        )
+        self.client.post(
+            reverse("share-file", args=[self.file.uuid]),
+            {"team_permissions": [{"team_id": self.team.id, "permission": "view"}]},
+            format="json",
+        )
+        self.client.post(
+            reverse("add-member", args=[self.team.id]), {"user_id": self.friend.id}
+        )
+        with mock.patch("files.s3.S3ClientPool.get"):
+            self.client.delete(reverse("file-delete", args=[self.file.uuid]))
+
+        self.assertEqual(
+            self.event_types(self.changes(self.owner)),
+            ["file_created", "member_added", "file_deleted"],
+        )
+        response = self.changes(self.friend)
+        self.assertEqual(
+            self.event_types(response),
+            ["permission_granted", "member_added", "file_deleted"],
+        )
+        self.assertEqual(response.data["events"][0]["file_uuid"], str(self.file.uuid))
+        self.assertEqual(response.data["events"][0]["data"], {"permission": "view"})
+        self.assertEqual(
+            response.data["events"][1]["data"]["member_id"], self.friend.id
+        )
+
+    def test_cursor_returns_only_newer_events(self):
+        """Test syncing from a cursor returns just what changed since"""
+        cursor = self.changes(self.friend).data["cursor"]
+        self.assertEqual(self.changes(self.friend, cursor).data["events"], [])
+
+        self.client.post(
+            reverse("share-file", args=[self.file.uuid]),
+            {"user_permissions": [{"user_id": self.friend.id, "permission": "view"}]},
+            format="json",
+        )
+        with mock.patch("files.views.CHANGE_FEED_PAGE_SIZE", 1):
+            self.client.post(
+                reverse("file-permission", args=[self.file.uuid]),
+                {
+                    "user_permissions": [
+                        {"user_id": self.friend.id, "permission": "view-and-download"}
+                    ]
+                },
+                format="json",
+            )
+            first = self.changes(self.friend, cursor)
+            self.assertTrue(first.data["has_more"])
+            second = self.changes(self.friend, first.data["cursor"])
+
+        self.assertFalse(second.data["has_more"])
+        self.assertEqual(
+            [first.data["events"][0]["data"], second.data["events"][0]["data"]],
+            [{"permission": "view"}, {"permission": "view-and-download"}],
+        )
+        self.assertEqual(
+            self.changes(self.friend, "not-a-cursor").status_code,
+            status.HTTP_400_BAD_REQUEST,
+        )
+
+
+class StreamingListingTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="streamer", password="pass1234")
+        self.client.force_authenticate(self.user)
+        self.files = [
+            File.objects.create(
+                file_name=f"stream{n}.txt",
+                key=f"stream/{n}",
+                file_size=1,
+                uploaded_by=self.user,
+            )
+            for n in range(5)
+        ]
+        grant_owner_access(self.files)
+
+        patcher = mock.patch("files.utilities.get_storage")
+        self.storage = patcher.start().return_value
+        self.storage.presign_many.side_effect = lambda keys, expires_in: {
+            key: f"https://signed/{key}" for key in keys
+        }
+        self.addCleanup(patcher.stop)
+
+    def read(self, query):
+        with mock.patch("files.views.STREAM_BATCH_SIZE", 2):
+            response = self.client.get(reverse("file-retrieve") + query)
+            self.assertTrue(response.streaming)
+            return response, b"".join(response.streaming_content).decode()
+
+    def test_streams_json_array_in_batches(self):
+        """Test the whole listing streams as one JSON array, signed per batch"""
+        response, body = self.read("?stream=json")
+
+        self.assertEqual(response["Content-Type"], "application/json")
+        items = json.loads(body)
+        self.assertEqual(
+            [item["file_uuid"] for item in items],
+            [str(file.uuid) for file in reversed(self.files)],
+        )
+        self.assertEqual(
+            items[0]["download_url"], f"https://signed/{self.files[-1].key}"
+        )
+        self.assertEqual(
+            [len(call.args[0]) for call in self.storage.presign_many.call_args_list],
+            [2, 2, 1],
+        )
+
+    def test_streams_ndjson_with_sparse_fields(self):
+        """Test NDJSON streams one object per line and honours ?fields="""
+        response, body = self.read("?stream=ndjson&fields=file_name")
+
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        self.assertEqual(
+            [json.loads(line) for line in body.splitlines()],
+            [{"file_name": file.file_name} for file in reversed(self.files)],
+        )
+        self.storage.presign_many.assert_not_called()
+
+    def test_empty_stream_is_valid_json(self):
+        """Test a user without files gets an empty JSON array"""
+        File.objects.all().delete()
+        self.assertEqual(json.loads(self.read("?stream=json")[1]), [])
+
+
+class SlidingWindowLimiterTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.limiter = SlidingWindowLimiter()
+
+    def test_rejects_hits_over_the_limit_within_a_window(self):
+        results = [self.limiter.hit("client", 3, 60, now=120.5) for _ in range(4)]
+        self.assertEqual([r.allowed for r in results], [True, True, True, False])
+        self.assertEqual([r.remaining for r in results], [2, 1, 0, 0])
+        self.assertEqual(results[-1].reset, 59.5)
+
+    def test_previous_window_is_weighted_by_its_overlap(self):
+        for _ in range(4):
+            self.limiter.hit("client", 4, 60, now=130)
+        # A quarter into the next window, 3 of the 4 earlier hits still count
+        self.assertTrue(self.limiter.hit("client", 4, 60, now=195).allowed)
+        result = self.limiter.hit("client", 4, 60, now=195)
+        self.assertFalse(result.allowed)
+        self.assertEqual(result.reset, 15)
+        self.assertTrue(self.limiter.hit("client", 4, 60, now=210).allowed)
+
+    def test_cost_counts_as_several_hits(self):
+        self.assertTrue(self.limiter.hit("client", 5, 60, cost=4, now=60).allowed)
+        self.assertFalse(self.limiter.hit("client", 5, 60, cost=2, now=60).allowed)
+        self.assertTrue(self.limiter.hit("client", 5, 60, cost=1, now=60).allowed)
+
+    def test_state_is_two_counters_per_key(self):
+        for now in range(120, 200):
+            self.limiter.hit("client", 1000, 60, now=now)
+        redis = get_redis_connection("default")
+        keys = sorted(key.decode() for key in redis.scan_iter(match="client:*"))
+        self.assertEqual(keys, ["client:2", "client:3"])
+        self.assertEqual(redis.get("client:3"), b"20")
+
+    def test_hits_are_counted_against_all_limits_or_none(self):
+        results = self.limiter.hit_many([("a", 5, 60, 2), ("b", 1, 60, 2)], now=60)
+        self.assertEqual([r.allowed for r in results], [True, False])
+        self.assertIsNone(get_redis_connection("default").get("a:1"))
+        results = self.limiter.hit_many([("a", 5, 60, 2), ("b", 3, 60, 2)], now=60)
+        self.assertEqual([r.remaining for r in results], [3, 1])
+
+
+class LeasingLimiterTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.redis = get_redis_connection("default")
+        self.inner = SlidingWindowLimiter()
+        self.limiter = LeasingLimiter(
+            self.inner, lease_size=5, lease_ttl=1, fallback_workers=2, fallback_retry=5
+        )
+
+    def hit(self, now, limit=100):
+        return self.limiter.hit_many([("k", limit, 60, 1)], now=now)[0]
+
+    def test_hits_are_decided_from_a_lease(self):
+        with mock.patch.object(
+            self.inner, "hit_many", wraps=self.inner.hit_many
+        ) as redis_hits:
+            results = [self.hit(120) for _ in range(6)]
+            self.assertEqual(redis_hits.call_count, 1)
+            self.assertEqual(self.redis.get("k:2"), b"6")
+            self.assertEqual([r.remaining for r in results], [99, 98, 97, 96, 95, 94])
+            self.hit(120)
+            self.assertEqual(redis_hits.call_count, 2)
+        self.assertEqual(self.redis.get("k:2"), b"12")
+
+    def test_unused_tokens_are_refunded_once_the_lease_expires(self):
+        self.hit(120)
+        self.hit(121.5)
+        self.assertEqual(self.redis.get("k:2"), b"7")
+
+    def test_small_limits_are_not_leased(self):
+        for _ in range(3):
+            self.hit(120, limit=10)
+        self.assertEqual(self.redis.get("k:2"), b"3")
+        self.assertEqual(self.limiter.leases, {})
+
+    def test_falls_back_to_a_local_share_while_redis_is_unreachable(self):
+        with mock.patch.object(
+            self.inner, "hit_many", side_effect=RedisConnectionError
+        ) as redis_hits:
+            allowed = [self.hit(120, limit=4).allowed for _ in range(3)]
+            self.assertEqual(allowed, [True, True, False])
+            self.assertEqual(redis_hits.call_count, 1)
+            self.hit(126, limit=4)
+            self.assertEqual(redis_hits.call_count, 2)
+        # Redis is used again once it is back and the retry delay has passed
+        self.assertFalse(self.hit(127, limit=4).allowed)
+        self.assertTrue(self.hit(132, limit=4).allowed)
+
+
+IP_POLICY = {"name": "ip", "key": ["ip"], "limit": 3, "window": 60}
+USER_POLICY = {"name": "user", "key": ["user"], "limit": 2, "window": 60}
+
+
+@override_settings(RATE_LIMIT_ROUTE_COSTS={}, RATE_LIMIT_TRUSTED_PROXIES=[])
+class RateLimitPolicyTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="limited", password="pass1234")
+        self.token = str(RefreshToken.for_user(self.user).access_token)
+        self.url = reverse("available-permissions")
+
+    def get(self, url=None, ip="10.0.0.1", **extra):
+        return self.client.get(url or self.url, REMOTE_ADDR=ip, **extra)
+
+    @override_settings(RATE_LIMIT_POLICIES=[IP_POLICY])
+    def test_ip_over_its_limit_gets_429_with_retry_after(self):
+        responses = [self.get() for _ in range(4)]
+        self.assertNotEqual(responses[2].status_code, 429)
+        self.assertEqual(responses[2]["RateLimit-Remaining"], "0")
+        self.assertEqual(responses[2]["RateLimit-Policy"], "3;w=60;name=ip")
+        self.assertEqual(responses[3].status_code, 429)
+        self.assertTrue(1 <= int(responses[3]["Retry-After"]) <= 60)
+        self.assertNotEqual(self.get(ip="10.0.0.2").status_code, 429)
+
+    @override_settings(RATE_LIMIT_POLICIES=[IP_POLICY, USER_POLICY])
+    def test_user_policy_follows_the_token_across_ips(self):
+        auth = {"HTTP_AUTHORIZATION": f"Bearer {self.token}"}
+        self.assertEqual(self.get(ip="10.0.0.1", **auth)["RateLimit-Remaining"], "1")
+        self.assertEqual(self.get(ip="10.0.0.2", **auth)["RateLimit-Remaining"], "0")
+        self.assertEqual(self.get(ip="10.0.0.3", **auth).status_code, 429)
+        # Without a valid token only the IP policy applies
+        bad = {"HTTP_AUTHORIZATION": "Bearer not-a-token"}
+        response = self.get(ip="10.0.0.3", **bad)
+        self.assertEqual(response["RateLimit-Policy"], "3;w=60;name=ip")
+        self.assertEqual(response["RateLimit-Remaining"], "2")
+
+    @override_settings(
+        RATE_LIMIT_POLICIES=[dict(IP_POLICY, routes=["available-permissions"])],
+        RATE_LIMIT_ROUTE_COSTS={"available-permissions": 2},
+    )
+    def test_route_policies_and_costs(self):
+        self.assertEqual(self.get()["RateLimit-Remaining"], "1")
+        self.assertEqual(self.get().status_code, 429)
+        other = self.get(reverse("file-changes"))
+        self.assertNotEqual(other.status_code, 429)
+        self.assertNotIn("RateLimit-Limit", other)
+
+    @override_settings(RATE_LIMIT_POLICIES=[IP_POLICY])
+    def test_forwarded_for_is_only_trusted_from_trusted_proxies(self):
+        spoofed = {"HTTP_X_FORWARDED_FOR": "203.0.113.1"}
+        for _ in range(3):
+            self.get(ip="10.0.0.1", **spoofed)
+        self.assertEqual(self.get(ip="10.0.0.1").status_code, 429)
+
+        with override_settings(RATE_LIMIT_TRUSTED_PROXIES=["10.0.0.0/8"]):
+            self.client = self.client_class()
+            forwarded = {"HTTP_X_FORWARDED_FOR": "203.0.113.9, 10.1.1.1"}
+            self.assertEqual(
+                self.get(ip="10.0.0.1", **forwarded)["RateLimit-Remaining"], "2"
+            )
+            # The first untrusted hop counts, not one the client prepended
+            forwarded = {"HTTP_X_FORWARDED_FOR": "198.51.100.7, 203.0.113.9"}
+            self.assertEqual(
+                self.get(ip="10.0.0.1", **forwarded)["RateLimit-Remaining"], "1"
+            )
+
+
+class LoadGeneratorTests(TestCase):
+    def setUp(self):
+        self.users = [VirtualUser(1, "t1", 10, [3]), VirtualUser(2, "t2", 10, [3])]
+        self.generator = LoadGenerator("http://server/", self.users, seed=1)
+
+    def respond(self, *statuses):
+        responses = []
+        for status_code in statuses:
+            response = mock.Mock(status_code=status_code)
+            response.json.return_value = {"uuid": "f-1"}
+            responses.append(response)
+        return mock.patch("requests.Session.request", side_effect=responses)
+
+    def test_percentiles_use_the_nearest_rank(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([7], 95), 7)
+        self.assertIsNone(percentile([], 50))
+
+    def test_scenarios_record_each_request_under_its_endpoint(self):
+        user = self.users[0]
+        with self.respond(201, 200, 429, 200, 400) as request:
+            self.generator.upload(user)
+            self.generator.retrieve(user)
+            self.generator.list_files(user)
+            self.generator.team_membership(user)
+        self.assertEqual(user.files, ["f-1"])
+        method, url = request.call_args_list[1].args
+        self.assertEqual(url, "http://server/api/files/retrieve/")
+        self.assertEqual(request.call_args_list[1].kwargs["params"], {"uuid": "f-1"})
+        self.assertEqual(
+            request.call_args_list[0].kwargs["headers"], {"Authorization": "Bearer t1"}
+        )
+
+        report = self.generator.report(elapsed=2)
+        self.assertEqual(report["summary"]["requests"], 5)
+        self.assertEqual(report["summary"]["achieved_rps"], 2.5)
+        self.assertEqual(report["summary"]["errors"], {"429": 1, "400": 1})
+        self.assertEqual(report["endpoints"]["list"]["rate_limited_rate"], 1.0)
+        self.assertEqual(
+            report["endpoints"]["team_remove_member"]["status_codes"], {"400": 1}
+        )
+
+    def test_connection_failures_are_counted_as_errors(self):
+        with mock.patch(
+            "requests.Session.request", side_effect=requests.ConnectionError
+        ):
+            self.generator.list_files(self.users[0])
+        report = self.generator.report(elapsed=1)["endpoints"]["list"]
+        self.assertEqual(report["errors"], {"ConnectionError": 1})
+        self.assertEqual(report["error_rate"], 1.0)
+        self.assertIsNone(report["latency_ms"]["p50"])
+
+    def test_concurrency_run_keeps_running_scenarios_until_the_deadline(self):
+        with self.respond(*[200] * 1000):
+            asyncio.run(self.generator.run_concurrency(2, 0.05))
+        self.assertGreater(
+            self.generator.report(elapsed=0.05)["summary"]["requests"], 0
+        )
+
+
+class BatchFileUploadTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="batcher", password="pass1234")
+        self.client.force_authenticate(self.user)
+
+        patcher = mock.patch("files.s3.S3ClientPool.get")
+        self.s3_client = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+
+    def test_batch_upload_creates_all_files(self):
+        """Test every file of a batch is stored and recorded"""
+        files = [
+            SimpleUploadedFile(f"file{i}.txt", f"content {i}".encode(), "text/plain")
+            for i in range(5)
+        ]
+        response = self.client.post(
+            reverse("file-upload-batch"), {"files": files}, format="multipart"
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(
+            [result["file_name"] for result in response.data["results"]],
+            [f"file{i}.txt" for i in range(5)],
+        )
+        self.assertEqual(File.objects.filter(uploaded_by=self.user).count(), 5)
+        self.assertEqual(SharedFile.objects.count(), 5)
+        self.assertEqual(self.s3_client.put_object.call_count, 5)
+
+    def test_batch_upload_reports_partial_failures(self):
+        """Test rejected files are reported without failing the rest"""
+        files = [
+            SimpleUploadedFile("ok.txt", b"fine", "text/plain"),
+            SimpleUploadedFile("run.sh", b"#!/bin/sh", "application/x-sh"),
+        ]
+        response = self.client.post(
+            reverse("file-upload-batch"), {"files": files}, format="multipart"
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        ok, rejected = response.data["results"]
+        self.assertEqual(ok["status"], status.HTTP_201_CREATED)
+        self.assertEqual(rejected["status"], status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(rejected["detail"], "Unsupported file type.")
+        self.assertEqual(
+            list(File.objects.values_list("file_name", flat=True)), ["ok.txt"]
+        )
+
+    def test_batch_upload_reports_s3_failures(self):
+        """Test a failed S3 write is reported for that file only"""
+        self.s3_client.put_object.side_effect = ClientError(
+            {"Error": {"Code": "500", "Message": "boom"}}, "PutObject"
+        )
+        files = [SimpleUploadedFile("a.txt", b"a", "text/plain")]
+        response = self.client.post(
+            reverse("file-upload-batch"), {"files": files}, format="multipart"
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            response.data["results"][0]["status"], status.HTTP_502_BAD_GATEWAY
+        )
+        self.assertFalse(File.objects.exists())
+        self.assertFalse(Blob.objects.exists())
+
+
+class S3ClientPoolTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch("files.s3.boto3.session.Session")
+        self.session_class = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @override_settings(AWS_S3_MAX_POOL_CONNECTIONS=7, AWS_S3_RETRY_MODE="adaptive")
+    def test_client_built_once_with_tuned_config(self):
+        """Test the pool builds a single tuned client and reuses it"""
+        pool = S3ClientPool()
+        first = pool.get()
+        second = pool.get()
+
+        self.assertIs(first, second)
+        self.session_class.assert_called_once()
+        config = self.session_class.return_value.client.call_args.kwargs["config"]
+        self.assertEqual(config.max_pool_connections, 7)
+        self.assertEqual(config.retries["mode"], "adaptive")
+        self.assertEqual(
+            pool.stats(),
+            {
+                "clients_created": 1,
+                "checkouts": 2,
+                "reuses": 1,
+                "max_pool_connections": 7,
+            },
+        )
+
+    def test_client_shared_across_threads(self):
+        """Test concurrent use from many threads builds one client, counting every checkout"""
+        pool = S3ClientPool()
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            clients = list(executor.map(lambda _: pool.get(), range(3200)))
+
+        self.assertTrue(all(client is clients[0] for client in clients))
+        self.assertEqual(pool.stats()["clients_created"], 1)
+        self.assertEqual(pool.stats()["checkouts"], 3200)
+
+
+@override_settings(AWS_S3_REGION_NAME="eu-west-2")
+class SigV4PresignerTests(TestCase):
+    def setUp(self):
+        credentials = {
+            "AWS_ACCESS_KEY_ID": "AKIDEXAMPLE",
+            "AWS_SECRET_ACCESS_KEY": "wJalrXUtnFEMI/K7MDENG+bPxRfiCYEXAMPLEKEY",
+            "AWS_SESSION_TOKEN": "session/token+value=",
+        }
+        patcher = mock.patch.dict(os.environ, credentials)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.now = datetime.datetime(2024, 5, 17, 12, 30, 45)
+        self.pool = S3ClientPool()
+        self.client = self.pool.get()
+        self.presigner = SigV4Presigner(
+            self.client, "test-bucket", self.pool.credentials
+        )
+
+    def botocore_url(self, key, expires_in=3600):
+        with mock.patch("botocore.auth.get_current_datetime", return_value=self.now):
+            return self.client.generate_presigned_url(
+                "get_object",
+                Params={"Bucket": "test-bucket", "Key": key},
+                ExpiresIn=expires_in,
+            )
+
+    def test_urls_match_botocore(self):
+        """Test locally signed URLs are identical to botocore's"""
+        keys = ["uploads/report.pdf", "a b+c/é&?=.txt", "~user/file%20.png"]
+        urls = self.presigner.presign_many(keys, expires_in=900, now=self.now)
+
+        for key in keys:
+            self.assertEqual(urls[key], self.botocore_url(key, expires_in=900))
+
+    def test_signing_key_derived_once_per_day(self):
+        """Test the signing key is cached and only rederived on a new day"""
+        with mock.patch("files.presigner.hmac.new", wraps=hmac.new) as hmac_new:
+            self.presigner.presign("first.pdf", now=self.now)
+            first = hmac_new.call_count
+            self.presigner.presign("second.pdf", now=self.now)
+            self.assertEqual(hmac_new.call_count - first, 1)
+
+            next_day = self.now + datetime.timedelta(days=1)
+            self.presigner.presign("third.pdf", now=next_day)
+            self.assertEqual(hmac_new.call_count - first, 1 + 5)
+
+
+class LocalStorageTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="local", password="pass1234")
+        self.client.force_authenticate(self.user)
+
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        settings_override = override_settings(
+            FILE_STORAGE_ENGINE="local", LOCAL_STORAGE_ROOT=self.root
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def upload(self, name, content):
+        upload = SimpleUploadedFile(name, content, "text/plain")
+        response = self.client.post(
+            reverse("file-upload"), {"file": upload}, format="multipart"
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return File.objects.get(uuid=response.data["uuid"])
+
+    def test_upload_and_signed_download(self):
+        """Test files are kept on disk and served through signed URLs"""
+        file = self.upload("notes.txt", b"kept on local disk")
+        SharedFile.objects.get_or_create(file=file)
+
+        response = self.client.get(reverse("file-retrieve"), {"uuid": file.uuid})
+        download_url = response.data["download_url"]
+        self.client.logout()
+
+        response = self.client.get(download_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b"".join(response.streaming_content), b"kept on local disk")
+
+        tampered = download_url.replace("signature=", "signature=0")
+        self.assertEqual(
+            self.client.get(tampered).status_code, status.HTTP_403_FORBIDDEN
+        )
+
+    def test_expired_signature_rejected(self):
+        """Test a download URL stops working once it expires"""
+        file = self.upload("notes.txt", b"short lived")
+        storage = get_storage()
+        download_url = storage.presign_many([file.key], expires_in=-1)[file.key]
+
+        response = self.client.get(download_url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_keys_cannot_escape_root(self):
+        """Test keys resolving outside the storage root are refused"""
+        with self.assertRaises(StorageError):
+            get_storage().put("../../escape.txt", b"x", "text/plain")
+
+    def test_direct_upload_through_signed_form(self):
+        """Test the presigned POST flow works against the local engine"""
+        response = self.client.post(
+            reverse("file-upload-direct"),
+            {"file_name": "direct.txt", "content_type": "text/plain", "file_size": 6},
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        fields = dict(response.data["fields"])
+        fields["file"] = SimpleUploadedFile("direct.txt", b"direct", "text/plain")
+
+        upload = self.client.post(response.data["url"], fields, format="multipart")
+        self.assertEqual(upload.status_code, status.HTTP_204_NO_CONTENT)
+
+        complete = self.client.post(
+            reverse("file-upload-direct-complete"), {"key": response.data["key"]}
+        )
+        self.assertEqual(complete.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(get_storage().get_range(response.data["key"], 1, 3), b"ire")
+
+    @mock.patch("files.views.MAX_FILE_SIZE", 8)
+    def test_direct_upload_is_held_to_the_signed_limits(self):
+        """Test direct uploads are refused past the signed size or signature"""
+        response = self.client.post(
+            reverse("file-upload-direct"),
+            {"file_name": "direct.txt", "content_type": "text/plain", "file_size": 6},
+        )
+        url, fields, key = (
+            response.data["url"],
+            response.data["fields"],
+            response.data["key"],
+        )
+
+        tampered = url.replace(f"max_size={fields['max_size']}", "max_size=99")
+        upload = self.client.post(
+            tampered,
+            {"file": SimpleUploadedFile("direct.txt", b"direct", "text/plain")},
+            format="multipart",
+        )
+        self.assertEqual(upload.status_code, status.HTTP_403_FORBIDDEN)
+
+        upload = self.client.post(
+            url,
+            {"file": SimpleUploadedFile("direct.txt", b"x" * 100, "text/plain")},
+            format="multipart",
+        )
+        self.assertEqual(upload.status_code, status.HTTP_400_BAD_REQUEST)
+        with self.assertRaises(ObjectNotFound):
+            get_storage().head(key)
+
+    def test_incomplete_engine_fails_when_selected(self):
+        """Test an engine missing interface methods cannot be instantiated"""
+
+        class PutOnlyStorage(StorageEngine):
+            def put(self, key, data, content_type):
+                pass
+
+        with mock.patch.dict(STORAGE_ENGINES, {"put-only": PutOnlyStorage}):
+            with override_settings(FILE_STORAGE_ENGINE="put-only"):
+                with self.assertRaises(TypeError):
+                    get_storage()
+
+    @mock.patch("files.views.UPLOAD_SESSION_PART_SIZE", 4)
+    def test_upload_session_parts_are_streamed_to_disk(self):
+        """Test session parts are streamed to disk and short ones are refused"""
+        response = self.client.post(
+            reverse("upload-session-create"),
+            {"file_name": "parts.txt", "content_type": "text/plain", "file_size": 10},
+            format="json",
+        )
+        session_uuid = response.data["uuid"]
+
+        def put_part(part_number, body):
+            return self.client.put(
+                reverse("upload-session-part", args=[session_uuid, part_number]),
+                data=body,
+                content_type="application/octet-stream",
+            )
+
+        session = UploadSession.objects.get(uuid=session_uuid)
+        with self.assertRaises(StorageError):
+            get_storage().upload_part(
+                session.key, session.upload_id, 2, io.BytesIO(b"ef"), 4
+            )
+
+        for part_number, body in enumerate([b"abcd", b"efgh", b"ij"], 1):
+            self.assertEqual(
+                put_part(part_number, body).status_code, status.HTTP_200_OK
+            )
+        response = self.client.post(
+            reverse("upload-session-complete", args=[session_uuid])
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        file = File.objects.get(uuid=response.data["uuid"])
+        self.assertEqual(get_storage().get_range(file.key), b"abcdefghij")
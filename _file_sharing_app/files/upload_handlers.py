@@ -0,0 +1,310 @@
+import hashlib
+import logging
+import threading
+import uuid
+
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import (
+    FileUploadHandler,
+    SkipFile,
+    StopFutureHandlers,
+    StopUpload,
+)
+from rest_framework import status
+
+from .config import (
+    ALLOWED_FILE_TYPES,
+    BATCH_UPLOAD_MAX_WORKERS,
+    FILE_SNIFF_SIZE,
+    MAX_FILE_SIZE,
+)
+from .storage import StorageError, get_storage
+from .utilities import acquire_blob, content_matches_type, register_blob, release_blob
+
+logger = logging.getLogger(__name__)
+
+
+class StoredUploadedFile(UploadedFile):
+    """
+    An uploaded file whose content is written to storage under ``key``. Once
+    stored, ``blob`` holds the blob reference taken for it, which the caller
+    owns. While the final write is still running, ``future`` tracks it.
+    """
+
+    def __init__(self, key, name, content_type, size, charset=None, extra=None):
+        super().__init__(None, name, content_type, size, charset, extra)
+        self.key = key
+        self.sha256 = None
+        self.blob = None
+        self.future = None
+
+
+class UploadValidationHandler(FileUploadHandler):
+    """
+    Upload handler that checks every file against the upload limits while it
+    is received: the declared content type when the file starts, then its
+    size as each chunk arrives and its leading bytes in the first chunk.
+
+    Placed first in the handler list, it stops the upload at the first
+    offending chunk without reading the rest of the body, so a rejected upload
+    costs almost no I/O. The reason is recorded on ``error`` as a ``(detail,
+    status code)`` tuple.
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.error = None
+
+    def new_file(self, field_name, file_name, content_type, *args, **kwargs):
+        super().new_file(field_name, file_name, content_type, *args, **kwargs)
+        if content_type not in ALLOWED_FILE_TYPES:
+            self.reject("Unsupported file type.")
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > MAX_FILE_SIZE:
+            self.reject(
+                f"File too large. Maximum size is {MAX_FILE_SIZE // (1024 * 1024)}MB."
+            )
+        if start == 0 and not content_matches_type(
+            raw_data[:FILE_SNIFF_SIZE], self.content_type
+        ):
+            self.reject("File content does not match its type.")
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
+
+    def reject(
+        self, detail, status_code=status.HTTP_400_BAD_REQUEST, connection_reset=True
+    ):
+        """
+        Refuse the file currently being received and stop the upload. Unless
+        ``connection_reset`` is False, the remainder of the request body is
+        left unread.
+        """
+        self.error = (detail, status_code)
+        self.upload_interrupted()
+        raise StopUpload(connection_reset=connection_reset)
+
+
+class StreamingUploadHandler(UploadValidationHandler):
+    """
+    Upload handler that streams the ``field_name`` file of a multipart request
+    straight into storage while the body is still being received, instead of
+    spooling it to memory or a temporary file first.
+
+    The file is validated as it streams in and hashed with SHA-256. New content
+    is written to a fresh ``{key_prefix}{uuid}-{file name}`` key; content that
+    is already stored is discarded and the existing blob is reused instead.
+    Failures are recorded on ``error`` as a ``(detail, status code)`` tuple and
+    stop the upload, as does a second ``field_name`` file.
+
+    The received file, ``uploaded``, holds a reference to its blob. Callers
+    that do not end up saving it must call ``release()``.
+    """
+
+    def __init__(self, request=None, key_prefix="", field_name="file"):
+        super().__init__(request)
+        self.key_prefix = key_prefix
+        self.field_name = field_name
+        self.writer = None
+        self.hasher = None
+        self.uploaded = None
+
+    def new_file(self, field_name, file_name, content_type, *args, **kwargs):
+        if field_name != self.field_name:
+            raise SkipFile()
+        if self.uploaded is not None:
+            self.reject("Only one file may be uploaded.")
+        super().new_file(field_name, file_name, content_type, *args, **kwargs)
+
+        self.writer = get_storage().open_writer(
+            self.storage_key(file_name), content_type
+        )
+        self.hasher = hashlib.sha256()
+        raise StopFutureHandlers()
+
+    def storage_key(self, file_name):
+        """Returns the key the received file is written to."""
+        return f"{self.key_prefix}{uuid.uuid4()}-{file_name}"
+
+    def receive_data_chunk(self, raw_data, start):
+        super().receive_data_chunk(raw_data, start)
+        self.hasher.update(raw_data)
+        try:
+            self.writer.write(raw_data)
+        except StorageError as e:
+            logger.error(f"Failed to stream file part to storage: {e}")
+            self.reject("Failed to upload file.", status.HTTP_502_BAD_GATEWAY)
+        return None
+
+    def file_complete(self, file_size):
+        sha256 = self.hasher.hexdigest()
+        blob = acquire_blob(sha256)
+        if blob:
+            # Already stored: drop whatever was stored for this copy
+            self.writer.abort()
+        else:
+            try:
+                self.writer.close()
+            except StorageError as e:
+                logger.error(f"Failed to complete upload: {e}")
+                # The file's data has all been read; let the parser finish
+                self.reject(
+                    "Failed to upload file.",
+                    status.HTTP_502_BAD_GATEWAY,
+                    connection_reset=False,
+                )
+            blob = register_blob(sha256, self.writer.key, file_size)
+
+        uploaded = self.uploaded_file(blob.key, file_size)
+        uploaded.sha256 = sha256
+        uploaded.blob = blob
+        self.writer = None
+        self.uploaded = uploaded
+        return uploaded
+
+    def release(self):
+        """Drops the blob reference taken for the received file, if any."""
+        if self.uploaded is not None and self.uploaded.blob is not None:
+            release_blob(self.uploaded.blob)
+        self.uploaded = None
+
+    def uploaded_file(self, key, file_size):
+        return StoredUploadedFile(
+            key,
+            self.file_name,
+            self.content_type,
+            file_size,
+            self.charset,
+            self.content_type_extra,
+        )
+
+    def upload_interrupted(self):
+        if self.writer:
+            self.writer.abort()
+            self.writer = None
+
+
+class DirectUploadHandler(StreamingUploadHandler):
+    """
+    Streaming handler for uploads posted to a presigned direct-upload form.
+    The file is written to the ``key`` the form was signed for, and is refused
+    once it grows past the signed ``max_size``. No blob is registered for it;
+    the object is recorded when the direct upload is completed.
+    """
+
+    def __init__(self, request, key, max_size):
+        super().__init__(request)
+        self.key = key
+        self.max_size = max_size
+
+    def storage_key(self, file_name):
+        return self.key
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > self.max_size:
+            self.reject("Uploaded file violates the upload limits.")
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        if not file_size:
+            self.reject(
+                "Uploaded file violates the upload limits.", connection_reset=False
+            )
+        try:
+            self.writer.close()
+        except StorageError as e:
+            logger.error(f"Failed to complete direct upload: {e}")
+            self.reject(
+                "Failed to upload file.",
+                status.HTTP_502_BAD_GATEWAY,
+                connection_reset=False,
+            )
+        self.uploaded = self.uploaded_file(self.key, file_size)
+        self.writer = None
+        return self.uploaded
+
+
+class BatchUploadHandler(StreamingUploadHandler):
+    """
+    Streams every ``field_name`` file of a multipart request to storage.
+
+    The final write of each file runs on ``executor`` so that files are stored
+    concurrently while the rest of the body is still being parsed; at most
+    ``max_pending`` writes are queued at once to bound memory use. A rejected
+    file is skipped rather than stopping the upload. ``outcomes`` lists, in
+    request order, a ``StoredUploadedFile`` or a ``(file name, detail, status
+    code)`` tuple for every file received.
+    """
+
+    def __init__(
+        self,
+        request=None,
+        key_prefix="",
+        field_name="files",
+        executor=None,
+        max_pending=BATCH_UPLOAD_MAX_WORKERS * 2,
+    ):
+        super().__init__(request, key_prefix, field_name)
+        self.executor = executor
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.outcomes = []
+
+    def reject(
+        self, detail, status_code=status.HTTP_400_BAD_REQUEST, connection_reset=True
+    ):
+        self.outcomes.append((self.file_name, detail, status_code))
+        self.upload_interrupted()
+        raise SkipFile()
+
+    def file_complete(self, file_size):
+        writer, self.writer = self.writer, None
+        uploaded = self.uploaded_file(writer.key, file_size)
+        uploaded.sha256 = self.hasher.hexdigest()
+
+        blob = acquire_blob(uploaded.sha256)
+        if blob:
+            writer.abort()
+            uploaded.key = blob.key
+            uploaded.blob = blob
+        else:
+            self.slots.acquire()
+            uploaded.future = self.executor.submit(self._close, writer)
+
+        self.outcomes.append(uploaded)
+        return uploaded
+
+    def _close(self, writer):
+        try:
+            writer.close()
+        except StorageError:
+            writer.abort()
+            raise
+        finally:
+            self.slots.release()
+
+    def stored_outcomes(self):
+        """
+        Waits for pending writes, registers the blobs of the files stored and
+        returns ``outcomes`` with failed writes turned into rejections.
+        """
+        results = []
+        for outcome in self.outcomes:
+            if isinstance(outcome, StoredUploadedFile) and outcome.future:
+                try:
+                    outcome.future.result()
+                except StorageError as e:
+                    logger.error(f"Failed to upload {outcome.name} to storage: {e}")
+                    outcome = (
+                        outcome.name,
+                        "Failed to upload file.",
+                        status.HTTP_502_BAD_GATEWAY,
+                    )
+                else:
+                    outcome.blob = register_blob(
+                        outcome.sha256, outcome.key, outcome.size
+                    )
+                    outcome.key = outcome.blob.key
+            results.append(outcome)
+        return results
@@ -0,0 +1,36 @@
+import hashlib
+
+from django.core.cache import cache
+
+from .config import PRESIGNED_URL_EXPIRES_IN, PRESIGNED_URL_MIN_LIFETIME
+
+
+def _cache_key(key, expires_in):
+    digest = hashlib.sha256(key.encode()).hexdigest()
+    return f"presigned_url:{expires_in}:{digest}"
+
+
+def get_cached_urls(keys, expires_in=PRESIGNED_URL_EXPIRES_IN):
+    """Returns a dict of the still usable cached URLs for ``keys``."""
+    cache_keys = {_cache_key(key, expires_in): key for key in keys}
+    cached = cache.get_many(list(cache_keys))
+    return {cache_keys[cache_key]: url for cache_key, url in cached.items()}
+
+
+def cache_urls(urls, expires_in=PRESIGNED_URL_EXPIRES_IN):
+    """
+    Caches freshly signed URLs, keyed by object key and expiry window. Entries
+    expire while the URL still has ``PRESIGNED_URL_MIN_LIFETIME`` seconds left.
+    """
+    timeout = expires_in - PRESIGNED_URL_MIN_LIFETIME
+    if not urls or timeout <= 0:
+        return
+    cache.set_many(
+        {_cache_key(key, expires_in): url for key, url in urls.items()},
+        timeout=timeout,
+    )
+
+
+def invalidate_urls(keys, expires_in=PRESIGNED_URL_EXPIRES_IN):
+    """Drops cached URLs for objects that were replaced or deleted."""
+    cache.delete_many([_cache_key(key, expires_in) for key in keys])
@@ -1,6 +1,15 @@
 from django.urls import path
 from .views import (
+    BatchFileUploadView,
+    DirectUploadCompleteView,
+    DirectUploadView,
     FileUploadView,
+    UploadSessionCompleteView,
+    UploadSessionCreateView,
+    UploadSessionPartView,
+    UploadSessionView,
+    LocalStorageObjectView,
+    LocalStorageUploadView,
     FileRetrieveView,
     FileUpdateView,
     FileDeleteView,
@@ -10,10 +19,49 @@ from .views import (
     FilesSharedWithUserView,
     FilesSharedWithUserTeamsView,
     ShareFileView,
+    ChangeFeedView,
+    BulkShareView,
 )
 
 urlpatterns = [
     path("upload/", FileUploadView.as_view(), name="file-upload"),
+    path("upload/batch/", BatchFileUploadView.as_view(), name="file-upload-batch"),
+    path("upload/direct/", DirectUploadView.as_view(), name="file-upload-direct"),
+    path(
+        "upload/direct/complete/",
+        DirectUploadCompleteView.as_view(),
+        name="file-upload-direct-complete",
+    ),
+    path(
+        "upload/sessions/",
+        UploadSessionCreateView.as_view(),
+        name="upload-session-create",
+    ),
+    path(
+        "upload/sessions/<uuid:uuid>/",
+        UploadSessionView.as_view(),
+        name="upload-session",
+    ),
+    path(
+        "upload/sessions/<uuid:uuid>/parts/<int:part_number>/",
+        UploadSessionPartView.as_view(),
+        name="upload-session-part",
+    ),
+    path(
+        "upload/sessions/<uuid:uuid>/complete/",
+        UploadSessionCompleteView.as_view(),
+        name="upload-session-complete",
+    ),
+    path(
+        "storage/upload/",
+        LocalStorageUploadView.as_view(),
+        name="local-storage-upload",
+    ),
+    path(
+        "storage/objects/<path:key>",
+        LocalStorageObjectView.as_view(),
+        name="local-storage-object",
+    ),
     path("retrieve/", FileRetrieveView.as_view(), name="file-retrieve"),
     path("<uuid:uuid>/update/", FileUpdateView.as_view(), name="file-update"),
     path("<uuid:uuid>/delete/", FileDeleteView.as_view(), name="file-delete"),
@@ -26,6 +74,8 @@ urlpatterns = [
         name="available-permissions",
     ),
     path("share/<uuid:uuid>", ShareFileView.as_view(), name="share-file"),
+    path("share/bulk/", BulkShareView.as_view(), name="share-bulk"),
+    path("changes/", ChangeFeedView.as_view(), name="file-changes"),
     path(
         "shared-with-team/<int:team_id>/",
         FilesSharedWithTeamView.as_view(),
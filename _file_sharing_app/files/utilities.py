@@ -1,51 +1,130 @@
-import boto3
 import logging
 
-from botocore.exceptions import ClientError
-from django.conf import settings
+from django.db.models import F
 
-from .models import UserFilePermission, TeamFilePermission
+from .access import get_access
+from .config import (
+    FILE_SIGNATURES,
+    FILE_SNIFF_SIZE,
+    PRESIGNED_URL_EXPIRES_IN,
+    TEXT_FILE_TYPES,
+)
+from .models import Blob
+from .storage import StorageError, get_storage
+from .url_cache import cache_urls, get_cached_urls
 
 
 logger = logging.getLogger(__name__)
 
 
-def upload_to_s3(file, key):
-    """Uploads a file to S3."""
-    s3_client = boto3.client("s3")
-    bucket_name = settings.AWS_STORAGE_BUCKET_NAME
+def delete_from_storage(key):
+    """Deletes an object from the storage engine."""
     try:
-        s3_client.upload_fileobj(file, bucket_name, key)
+        get_storage().delete(key)
         return True
-    except ClientError as e:
-        logger.error(f"S3 upload failed: {e}")
+    except StorageError as e:
+        logger.error(f"Storage delete failed: {e}")
         return False
 
 
-def generate_presigned_url(key, expires_in=3600):
-    """Generates a presigned URL for accessing an S3 object."""
-    s3_client = boto3.client("s3")
-    bucket_name = settings.AWS_STORAGE_BUCKET_NAME
-    try:
-        return s3_client.generate_presigned_url(
-            "get_object",
-            Params={"Bucket": bucket_name, "Key": key},
-            ExpiresIn=expires_in,
-        )
-    except ClientError as e:
-        logger.error(f"Failed to generate presigned URL: {e}")
-        return None
+def acquire_blob(sha256):
+    """Takes a reference to the stored blob with this digest, if there is one."""
+    if Blob.objects.filter(sha256=sha256).update(ref_count=F("ref_count") + 1):
+        return Blob.objects.get(sha256=sha256)
+    return None
+
+
+def register_blob(sha256, key, size):
+    """
+    Records content just written to ``key`` as a blob and takes a reference to it.
+    If a concurrent upload registered the same content first, its blob is used
+    and the duplicate object is deleted.
+    """
+    blob, created = Blob.objects.get_or_create(
+        sha256=sha256, defaults={"key": key, "size": size, "ref_count": 1}
+    )
+    if created:
+        return blob
+
+    existing = acquire_blob(sha256)
+    if existing is None:
+        # The other blob was released in the meantime; ours becomes the blob
+        return register_blob(sha256, key, size)
+    delete_from_storage(key)
+    return existing
+
+
+def release_blob(blob):
+    """Drops a reference to a blob, deleting its content once nothing uses it."""
+    Blob.objects.filter(pk=blob.pk).update(ref_count=F("ref_count") - 1)
+    deleted, _ = Blob.objects.filter(pk=blob.pk, ref_count=0).delete()
+    if deleted:
+        delete_from_storage(blob.key)
+
+
+def generate_presigned_url(key, expires_in=PRESIGNED_URL_EXPIRES_IN):
+    """Generates a presigned URL for downloading a stored object."""
+    return generate_presigned_urls([key], expires_in).get(key)
+
+
+def generate_presigned_urls(keys, expires_in=PRESIGNED_URL_EXPIRES_IN):
+    """
+    Generates presigned URLs for many stored objects at once. URLs signed
+    earlier are reused while they have enough lifetime left; the rest are
+    signed by the storage engine. Returns a dict mapping each key to its URL,
+    omitting failures.
+    """
+    keys = set(keys)
+    if not keys:
+        return {}
+
+    urls = get_cached_urls(keys, expires_in)
+    missing = keys - urls.keys()
+    if missing:
+        try:
+            signed = get_storage().presign_many(missing, expires_in)
+        except StorageError as e:
+            logger.error(f"Failed to generate presigned URL: {e}")
+            return urls
+        cache_urls(signed, expires_in)
+        urls.update(signed)
+    return urls
+
+
+class CountingReader:
+    """Wraps a file-like object and counts the bytes read from it."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.count = 0
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.count += len(data)
+        return data
 
 
 def check_file_permissions(user, file):
     """Checks if a user has access to a file."""
-    shared_file = file.shared_info
-    return (
-        file.uploaded_by == user
-        or UserFilePermission.objects.filter(
-            user=user, shared_file=shared_file
-        ).exists()
-        or TeamFilePermission.objects.filter(
-            shared_file=shared_file, team__in=user.teams.all()
-        ).exists()
-    )
+    return get_access(user, file) is not None
+
+
+def content_matches_type(data, content_type):
+    """
+    Checks the leading bytes of a file against the signature of its declared
+    content type, so a renamed executable cannot pass as a PDF or an image.
+    """
+    if content_type in TEXT_FILE_TYPES:
+        return b"\x00" not in data
+    signature = FILE_SIGNATURES.get(content_type)
+    return signature is not None and data.startswith(signature)
+
+
+def stored_content_matches_type(storage, key, content_type):
+    """
+    Checks the leading bytes of a stored object against its declared content
+    type, fetching only those bytes. Raises ``StorageError`` if they cannot be
+    read.
+    """
+    leading_bytes = storage.get_range(key, 0, FILE_SNIFF_SIZE - 1)
+    return content_matches_type(leading_bytes, content_type)
@@ -0,0 +1,68 @@
+import logging
+import time
+
+from django.db import transaction
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+logger = logging.getLogger(__name__)
+
+
+def read_versions(keys):
+    """
+    Returns the current value of each version counter in ``keys``. Counters
+    start from the clock, so one that was evicted never comes back to a value
+    that was already handed out.
+    """
+    redis = get_redis_connection("default")
+    values = redis.mget(keys)
+    missing = [key for key, value in zip(keys, values) if value is None]
+    if missing:
+        pipe = redis.pipeline()
+        for key in missing:
+            pipe.set(key, time.time_ns(), nx=True)
+        pipe.execute()
+        values = redis.mget(keys)
+    return [int(value) for value in values]
+
+
+def bump_versions(keys):
+    """
+    Moves each version counter in ``keys`` to a value never used before.
+    Bumps run after writes that already happened, so a Redis failure is
+    logged rather than raised.
+    """
+    keys = set(keys)
+    if not keys:
+        return
+    try:
+        pipe = get_redis_connection("default").pipeline()
+        for key in keys:
+            pipe.set(key, time.time_ns(), nx=True)
+            pipe.incr(key)
+        pipe.execute()
+    except RedisError:
+        logger.error(
+            f"Failed to bump {len(keys)} version counters in Redis.", exc_info=True
+        )
+
+
+def user_listing_key(user_id):
+    return f"listing_version:user:{user_id}"
+
+
+def team_listing_key(team_id):
+    return f"listing_version:team:{team_id}"
+
+
+def touch_listings(user_ids=(), team_ids=()):
+    """
+    Records that the file listings of the given users and teams changed, so
+    their ETags change. Counters are bumped right away and again once the
+    transaction commits, so a listing read from the old rows meanwhile cannot
+    be served under the new version.
+    """
+    keys = [user_listing_key(user_id) for user_id in user_ids]
+    keys += [team_listing_key(team_id) for team_id in team_ids]
+    bump_versions(keys)
+    transaction.on_commit(lambda: bump_versions(keys))
@@ -1,34 +1,84 @@
 import logging
 import uuid
-import boto3
+from concurrent.futures import ThreadPoolExecutor
 from django.forms import ValidationError
+from django.http import FileResponse, Http404
 from django.shortcuts import get_object_or_404
 from django.contrib.auth import get_user_model
-from django.db.models import Q
 from django.db import IntegrityError, transaction
+from django.db.models import Exists, OuterRef
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework import generics, status
 from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework.exceptions import PermissionDenied
-from rest_framework.pagination import PageNumberPagination
 from drf_yasg import openapi
-from django.conf import settings
-from botocore.exceptions import ClientError
 
 from teams.models import Team
+from .etags import conditional_listing
 from .models import (
     PERMISSION_CHOICES,
+    ChangeEvent,
     File,
     SharedFile,
     TeamFilePermission,
+    UploadPart,
+    UploadSession,
     UserFilePermission,
 )
-from .serializers import FileSerializer, SharedFileSerializer
-
+from .access import (
+    DOWNLOAD_PERMISSIONS,
+    file_audience,
+    get_access,
+    grant_owner_access,
+    invalidate_on_commit,
+    resolve_access,
+)
+from .changes import record_file_event
+from .config import (
+    ALLOWED_FILE_TYPES,
+    BATCH_UPLOAD_MAX_WORKERS,
+    CHANGE_FEED_PAGE_SIZE,
+    DIRECT_UPLOAD_EXPIRES_IN,
+    MAX_FILE_SIZE,
+    STREAM_BATCH_SIZE,
+    UPLOAD_SESSION_PART_SIZE,
+)
+from .pagination import KeysetPagination, SharedFilePagination
+from .serializers import (
+    BulkShareSerializer,
+    ChangeEventSerializer,
+    DirectUploadCompleteSerializer,
+    DirectUploadRequestSerializer,
+    FileReadSerializer,
+    FileSerializer,
+    SharedFileSerializer,
+    UploadSessionSerializer,
+    prefetch_shares,
+    requested_fields,
+    select_fields,
+)
+from .sharing import bulk_share, missing_ids, share_files
+from .storage import LocalStorage, ObjectNotFound, StorageError, get_storage
+from .streaming import STREAM_FORMATS, iter_batches, streaming_response
+from .upload_handlers import (
+    BatchUploadHandler,
+    DirectUploadHandler,
+    StreamingUploadHandler,
+)
+from .url_cache import invalidate_urls
+from .utilities import (
+    CountingReader,
+    delete_from_storage,
+    generate_presigned_url,
+    generate_presigned_urls,
+    release_blob,
+    stored_content_matches_type,
+)
+from .versions import touch_listings
 
 User = get_user_model()
 
@@ -37,47 +87,677 @@ class FileUploadView(APIView):
     authentication_classes = [JWTAuthentication]
     permission_classes = [IsAuthenticated]
     parser_classes = [MultiPartParser, FormParser]
+    stream_uploads = True
     logger = logging.getLogger(__name__)
 
     @swagger_auto_schema(
         operation_description="Upload a file to S3 and save metadata to the database.",
         request_body=FileSerializer,
-        responses={201: FileSerializer, 400: "Invalid input", 502: "S3 upload failed"},
+        responses={
+            201: FileReadSerializer,
+            400: "Invalid input",
+            502: "S3 upload failed",
+        },
     )
     def post(self, request):
+        # Stream the file to S3 while the request body is being parsed
+        handler = StreamingUploadHandler(
+            request, key_prefix=f"uploads/{request.user.id}/"
+        )
+        request.upload_handlers = [handler]
+
         file = request.FILES.get("file")
+        if handler.error:
+            handler.release()
+            detail, status_code = handler.error
+            return Response({"detail": detail}, status=status_code)
         if not file:
             return Response(
                 {"detail": "No file provided."}, status=status.HTTP_400_BAD_REQUEST
             )
 
-        # Upload to S3
-        s3_client = boto3.client("s3")
-        bucket_name = settings.AWS_STORAGE_BUCKET_NAME
-        key = f"uploads/{request.user.id}/{uuid.uuid4()}-{file.name}"
+        try:
+            with transaction.atomic():
+                # Save metadata to the database
+                file_instance = File.objects.create(
+                    file_name=file.name,
+                    file_size=file.size,
+                    uploaded_by=request.user,
+                    key=file.key,
+                    blob=file.blob,
+                )
+
+                # Create default permissions
+                SharedFile.objects.create(file=file_instance)
+                grant_owner_access([file_instance])
+        except Exception:
+            # Nothing refers to the stored content; give its reference back
+            handler.release()
+            raise
+
+        # Return serialized metadata
+        return Response(
+            FileReadSerializer(file_instance, context={"request": request}).data,
+            status=status.HTTP_201_CREATED,
+        )
+
+
+class BatchFileUploadView(APIView):
+    """
+    Upload many files in one request. Files are written to S3 concurrently and
+    their metadata is saved in a single transaction.
+    """
+
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAuthenticated]
+    parser_classes = [MultiPartParser, FormParser]
+    stream_uploads = True
+    batch_upload = True
+
+    @swagger_auto_schema(
+        operation_description="Upload several files (multipart field 'files') to S3 at once.",
+        manual_parameters=[
+            openapi.Parameter(
+                "files",
+                openapi.IN_FORM,
+                description="Files to upload; repeat the field for each file.",
+                type=openapi.TYPE_FILE,
+                required=True,
+            )
+        ],
+        responses={
+            201: "All files uploaded",
+            207: "Some files failed; see the per-file results",
+            400: "No file could be uploaded",
+        },
+    )
+    def post(self, request):
+        with ThreadPoolExecutor(max_workers=BATCH_UPLOAD_MAX_WORKERS) as executor:
+            handler = BatchUploadHandler(
+                request, key_prefix=f"uploads/{request.user.id}/", executor=executor
+            )
+            request.upload_handlers = [handler]
+            # Parsing the body streams each file to S3
+            request.FILES
+            outcomes = handler.stored_outcomes()
+
+        if not outcomes:
+            return Response(
+                {"detail": "No file provided."}, status=status.HTTP_400_BAD_REQUEST
+            )
+
+        stored = [outcome for outcome in outcomes if not isinstance(outcome, tuple)]
+        try:
+            with transaction.atomic():
+                files = File.objects.bulk_create(
+                    File(
+                        file_name=uploaded.name,
+                        file_size=uploaded.size,
+                        uploaded_by=request.user,
+                        key=uploaded.key,
+                        blob=uploaded.blob,
+                    )
+                    for uploaded in stored
+                )
+                SharedFile.objects.bulk_create(SharedFile(file=file) for file in files)
+                grant_owner_access(files)
+        except Exception:
+            for uploaded in stored:
+                release_blob(uploaded.blob)
+            raise
+        created = iter(
+            FileReadSerializer(
+                prefetch_shares(files), many=True, context={"request": request}
+            ).data
+        )
+
+        results = []
+        for outcome in outcomes:
+            if isinstance(outcome, tuple):
+                file_name, detail, status_code = outcome
+                results.append(
+                    {
+                        "file_name": file_name,
+                        "status": status_code,
+                        "detail": detail,
+                    }
+                )
+            else:
+                results.append(
+                    {
+                        "file_name": outcome.name,
+                        "status": status.HTTP_201_CREATED,
+                        "file": next(created),
+                    }
+                )
+
+        if len(stored) == len(outcomes):
+            response_status = status.HTTP_201_CREATED
+        elif stored:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_400_BAD_REQUEST
+        return Response({"results": results}, status=response_status)
+
+
+class DirectUploadView(APIView):
+    """
+    Hand out a presigned POST so the client can upload a file straight to the
+    bucket without routing its bytes through the application.
+    """
+
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAuthenticated]
+    logger = logging.getLogger(__name__)
+
+    @swagger_auto_schema(
+        operation_description="Request a presigned POST to upload a file directly to S3.",
+        request_body=DirectUploadRequestSerializer,
+        responses={
+            200: "Presigned POST URL, form fields and object key",
+            400: "Invalid input",
+            502: "Failed to presign upload",
+        },
+    )
+    def post(self, request):
+        serializer = DirectUploadRequestSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        file_name = serializer.validated_data["file_name"]
+        content_type = serializer.validated_data["content_type"]
+        key = f"uploads/{request.user.id}/{uuid.uuid4()}-{file_name}"
 
         try:
-            s3_client.upload_fileobj(file, bucket_name, key)
-        except ClientError as e:
-            self.logger.error(f"Failed to upload file to S3: {e}")
+            presigned_post = get_storage().presign_post(
+                key, content_type, MAX_FILE_SIZE, DIRECT_UPLOAD_EXPIRES_IN
+            )
+        except StorageError as e:
+            self.logger.error(f"Failed to presign upload: {e}")
             return Response(
-                {"detail": "Failed to upload file."}, status=status.HTTP_502_BAD_GATEWAY
+                {"detail": "Failed to presign upload."},
+                status=status.HTTP_502_BAD_GATEWAY,
             )
 
-        # Save metadata to the database
-        file_instance = File.objects.create(
-            file_name=file.name, file_size=file.size, uploaded_by=request.user, key=key
+        return Response(
+            {
+                "url": presigned_post["url"],
+                "fields": presigned_post["fields"],
+                "key": key,
+                "expires_in": DIRECT_UPLOAD_EXPIRES_IN,
+            },
+            status=status.HTTP_200_OK,
         )
 
-        # Create default permissions
-        SharedFile.objects.create(file=file_instance)
 
-        # Return serialized metadata
+class DirectUploadCompleteView(APIView):
+    """
+    Record a file the client uploaded directly to the bucket.
+    """
+
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAuthenticated]
+    logger = logging.getLogger(__name__)
+
+    @swagger_auto_schema(
+        operation_description="Verify a direct upload in S3 and save its metadata to the database.",
+        request_body=DirectUploadCompleteSerializer,
+        responses={
+            201: FileReadSerializer,
+            400: "Invalid or missing upload",
+            403: "Permission denied",
+            409: "Upload already completed",
+            502: "Failed to verify upload",
+        },
+    )
+    def post(self, request):
+        serializer = DirectUploadCompleteSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        key = serializer.validated_data["key"]
+        prefix = f"uploads/{request.user.id}/"
+        if not key.startswith(prefix):
+            return Response(
+                {"detail": "You do not have permission to complete this upload."},
+                status=status.HTTP_403_FORBIDDEN,
+            )
+        if File.objects.filter(key=key).exists():
+            return Response(
+                {"detail": "Upload already completed."},
+                status=status.HTTP_409_CONFLICT,
+            )
+
+        # Keys are "uploads/<user id>/<uuid>-<file name>"
+        file_name = key.removeprefix(prefix)[37:]
+        if not file_name:
+            return Response(
+                {"detail": "Invalid upload key."}, status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # Verify the object exists and honours the upload limits
+        storage = get_storage()
+        try:
+            head = storage.head(key)
+        except ObjectNotFound:
+            return Response(
+                {"detail": "Upload not found."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        except StorageError as e:
+            self.logger.error(f"Failed to verify upload: {e}")
+            return Response(
+                {"detail": "Failed to verify upload."},
+                status=status.HTTP_502_BAD_GATEWAY,
+            )
+
+        file_size = head.size
+        valid = (
+            head.content_type in ALLOWED_FILE_TYPES and 0 < file_size <= MAX_FILE_SIZE
+        )
+        if valid:
+            try:
+                valid = stored_content_matches_type(storage, key, head.content_type)
+            except StorageError as e:
+                self.logger.error(f"Failed to verify upload: {e}")
+                return Response(
+                    {"detail": "Failed to verify upload."},
+                    status=status.HTTP_502_BAD_GATEWAY,
+                )
+        if not valid:
+            try:
+                storage.delete(key)
+            except StorageError as e:
+                self.logger.error(f"Failed to delete rejected upload: {e}")
+            return Response(
+                {"detail": "Uploaded file violates the upload limits."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        with transaction.atomic():
+            file_instance = File.objects.create(
+                file_name=file_name,
+                file_size=file_size,
+                uploaded_by=request.user,
+                key=key,
+            )
+            SharedFile.objects.create(file=file_instance)
+            grant_owner_access([file_instance])
+
+        return Response(
+            FileReadSerializer(file_instance, context={"request": request}).data,
+            status=status.HTTP_201_CREATED,
+        )
+
+
+class UploadSessionCreateView(APIView):
+    """
+    Start a resumable upload session backed by an S3 multipart upload.
+    """
+
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAuthenticated]
+    logger = logging.getLogger(__name__)
+
+    @swagger_auto_schema(
+        operation_description="Start a resumable upload session for a file.",
+        request_body=DirectUploadRequestSerializer,
+        responses={
+            201: UploadSessionSerializer,
+            400: "Invalid input",
+            502: "Failed to start upload",
+        },
+    )
+    def post(self, request):
+        serializer = DirectUploadRequestSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        file_name = serializer.validated_data["file_name"]
+        content_type = serializer.validated_data["content_type"]
+        key = f"uploads/{request.user.id}/{uuid.uuid4()}-{file_name}"
+
+        try:
+            upload_id = get_storage().create_multipart(key, content_type)
+        except StorageError as e:
+            self.logger.error(f"Failed to start multipart upload: {e}")
+            return Response(
+                {"detail": "Failed to start upload."},
+                status=status.HTTP_502_BAD_GATEWAY,
+            )
+
+        session = UploadSession.objects.create(
+            user=request.user,
+            file_name=file_name,
+            content_type=content_type,
+            file_size=serializer.validated_data["file_size"],
+            part_size=UPLOAD_SESSION_PART_SIZE,
+            key=key,
+            upload_id=upload_id,
+        )
+        return Response(
+            UploadSessionSerializer(session).data, status=status.HTTP_201_CREATED
+        )
+
+
+class UploadSessionView(APIView):
+    """
+    Inspect or abort a resumable upload session.
+    """
+
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAuthenticated]
+    logger = logging.getLogger(__name__)
+
+    @swagger_auto_schema(
+        operation_description="Retrieve an upload session and the parts received so far.",
+        responses={200: UploadSessionSerializer, 404: "Upload session not found"},
+    )
+    def get(self, request, uuid):
+        session = get_object_or_404(
+            UploadSession.objects.prefetch_related("parts"),
+            uuid=uuid,
+            user=request.user,
+        )
+        return Response(UploadSessionSerializer(session).data)
+
+    @swagger_auto_schema(
+        operation_description="Abort an upload session and discard its parts.",
+        responses={
+            204: "Upload session aborted",
+            404: "Upload session not found",
+            409: "Upload session is not active",
+            502: "Failed to abort upload",
+        },
+    )
+    def delete(self, request, uuid):
+        session = get_object_or_404(UploadSession, uuid=uuid, user=request.user)
+        if session.status != "active":
+            return Response(
+                {"detail": "Upload session is not active."},
+                status=status.HTTP_409_CONFLICT,
+            )
+
+        try:
+            get_storage().abort_multipart(session.key, session.upload_id)
+        except StorageError as e:
+            self.logger.error(f"Failed to abort multipart upload: {e}")
+            return Response(
+                {"detail": "Failed to abort upload."},
+                status=status.HTTP_502_BAD_GATEWAY,
+            )
+
+        session.status = "aborted"
+        session.save(update_fields=["status", "updated_at"])
+        session.parts.all().delete()
+        return Response(
+            {"detail": "Upload session aborted."}, status=status.HTTP_204_NO_CONTENT
+        )
+
+
+class UploadSessionPartView(APIView):
+    """
+    Receive one numbered part of a resumable upload. Parts may be sent in
+    parallel and in any order; re-sending a part replaces it.
+    """
+
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAuthenticated]
+    logger = logging.getLogger(__name__)
+
+    @swagger_auto_schema(
+        operation_description="Upload one part of a resumable upload as the raw request body.",
+        responses={
+            200: "Part received",
+            400: "Invalid part",
+            404: "Upload session not found",
+            409: "Upload session is not active",
+            502: "Failed to upload part",
+        },
+    )
+    def put(self, request, uuid, part_number):
+        session = get_object_or_404(UploadSession, uuid=uuid, user=request.user)
+        if session.status != "active":
+            return Response(
+                {"detail": "Upload session is not active."},
+                status=status.HTTP_409_CONFLICT,
+            )
+        if not 1 <= part_number <= session.total_parts:
+            return Response(
+                {"detail": f"Part number must be between 1 and {session.total_parts}."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        # Reject a wrongly sized part before reading its body
+        expected_size = session.expected_part_size(part_number)
+        try:
+            content_length = int(request.META.get("CONTENT_LENGTH") or 0)
+        except ValueError:
+            content_length = 0
+        if content_length != expected_size:
+            return Response(
+                {
+                    "detail": f"Part {part_number} must be exactly {expected_size} bytes."
+                },
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        # The body is streamed to storage as it arrives, never held whole
+        body = CountingReader(request.stream)
+        try:
+            etag = get_storage().upload_part(
+                session.key, session.upload_id, part_number, body, expected_size
+            )
+        except StorageError as e:
+            if body.count < expected_size:
+                return Response(
+                    {"detail": "Incomplete part received."},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            self.logger.error(f"Failed to upload part {part_number}: {e}")
+            return Response(
+                {"detail": "Failed to upload part."},
+                status=status.HTTP_502_BAD_GATEWAY,
+            )
+
+        UploadPart.objects.update_or_create(
+            session=session,
+            part_number=part_number,
+            defaults={"etag": etag, "size": expected_size},
+        )
+        return Response(
+            {"part_number": part_number, "etag": etag},
+            status=status.HTTP_200_OK,
+        )
+
+
+class UploadSessionCompleteView(APIView):
+    """
+    Commit a resumable upload once every part has been received.
+    """
+
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAuthenticated]
+    logger = logging.getLogger(__name__)
+
+    @swagger_auto_schema(
+        operation_description="Assemble the uploaded parts and save the file metadata.",
+        responses={
+            201: FileReadSerializer,
+            400: "Parts are missing or content does not match its type",
+            404: "Upload session not found",
+            409: "Upload session is not active",
+            502: "Failed to complete upload",
+        },
+    )
+    def post(self, request, uuid):
+        session = get_object_or_404(UploadSession, uuid=uuid, user=request.user)
+        if session.status != "active":
+            return Response(
+                {"detail": "Upload session is not active."},
+                status=status.HTTP_409_CONFLICT,
+            )
+
+        parts = list(session.parts.order_by("part_number"))
+        received = {part.part_number for part in parts}
+        missing = [n for n in range(1, session.total_parts + 1) if n not in received]
+        if missing:
+            return Response(
+                {"detail": "Parts are missing.", "missing_parts": missing},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        storage = get_storage()
+        try:
+            storage.complete_multipart(
+                session.key,
+                session.upload_id,
+                [(part.part_number, part.etag) for part in parts],
+            )
+            valid = stored_content_matches_type(
+                storage, session.key, session.content_type
+            )
+        except StorageError as e:
+            self.logger.error(f"Failed to complete multipart upload: {e}")
+            return Response(
+                {"detail": "Failed to complete upload."},
+                status=status.HTTP_502_BAD_GATEWAY,
+            )
+        if not valid:
+            try:
+                storage.delete(session.key)
+            except StorageError as e:
+                self.logger.error(f"Failed to delete rejected upload: {e}")
+            UploadSession.objects.filter(pk=session.pk, status="active").update(
+                status="aborted"
+            )
+            session.parts.all().delete()
+            return Response(
+                {"detail": "File content does not match its type."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        with transaction.atomic():
+            # Guard against two concurrent commits of the same session
+            updated = UploadSession.objects.filter(
+                pk=session.pk, status="active"
+            ).update(status="completed")
+            if not updated:
+                return Response(
+                    {"detail": "Upload session is not active."},
+                    status=status.HTTP_409_CONFLICT,
+                )
+            file_instance = File.objects.create(
+                file_name=session.file_name,
+                file_size=session.file_size,
+                uploaded_by=request.user,
+                key=session.key,
+            )
+            SharedFile.objects.create(file=file_instance)
+            grant_owner_access([file_instance])
+
         return Response(
-            FileSerializer(file_instance).data, status=status.HTTP_201_CREATED
+            FileReadSerializer(file_instance, context={"request": request}).data,
+            status=status.HTTP_201_CREATED,
         )
 
 
+class LocalStorageObjectView(APIView):
+    """
+    Serve an object of the local storage engine to the holder of a URL signed
+    by ``LocalStorage.presign_many``.
+    """
+
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    @swagger_auto_schema(
+        operation_description="Download a file kept by the local storage engine.",
+        responses={
+            200: "File content",
+            403: "Invalid or expired signature",
+            404: "File not found",
+        },
+    )
+    def get(self, request, key):
+        storage = get_storage()
+        if not isinstance(storage, LocalStorage):
+            raise Http404
+        if not storage.verify(
+            request.query_params.get("signature"),
+            request.query_params.get("expires"),
+            key,
+        ):
+            return Response(
+                {"detail": "Invalid or expired signature."},
+                status=status.HTTP_403_FORBIDDEN,
+            )
+
+        try:
+            file = storage.open(key)
+        except StorageError:
+            raise Http404
+        # Handed to the server's file wrapper, which can send it with sendfile
+        return FileResponse(file)
+
+
+class LocalStorageUploadView(APIView):
+    """
+    Receive a direct upload posted with the form fields handed out by
+    ``LocalStorage.presign_post``, standing in for an S3 presigned POST.
+    """
+
+    authentication_classes = []
+    permission_classes = [AllowAny]
+    parser_classes = [MultiPartParser, FormParser]
+    stream_uploads = True
+
+    @swagger_auto_schema(
+        operation_description="Upload a file directly to the local storage engine.",
+        responses={
+            204: "File stored",
+            400: "File missing or outside the signed limits",
+            403: "Invalid or expired signature",
+            404: "Local storage is not in use",
+        },
+    )
+    def post(self, request):
+        storage = get_storage()
+        if not isinstance(storage, LocalStorage):
+            raise Http404
+
+        # The signed fields travel in the query string, so the signature is
+        # checked before the body is read and the file streams straight to
+        # the signed key.
+        key = request.query_params.get("key")
+        content_type = request.query_params.get("Content-Type")
+        max_size = request.query_params.get("max_size")
+        if not storage.verify(
+            request.query_params.get("signature"),
+            request.query_params.get("expires"),
+            key,
+            content_type,
+            max_size,
+        ):
+            return Response(
+                {"detail": "Invalid or expired signature."},
+                status=status.HTTP_403_FORBIDDEN,
+            )
+
+        handler = DirectUploadHandler(request, key, int(max_size))
+        request.upload_handlers = [handler]
+        file = request.FILES.get("file")
+        if handler.error:
+            detail, status_code = handler.error
+            return Response({"detail": detail}, status=status_code)
+        if not file:
+            return Response(
+                {"detail": "Uploaded file violates the upload limits."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
 class FileRetrieveView(APIView):
     authentication_classes = [JWTAuthentication]
     permission_classes = [IsAuthenticated]
@@ -96,63 +776,47 @@ class FileRetrieveView(APIView):
                 description="UUID of the file to retrieve. Leave empty to retrieve all accessible files.",
                 type=openapi.TYPE_STRING,
                 required=False,
-            )
+            ),
+            openapi.Parameter(
+                "stream",
+                openapi.IN_QUERY,
+                description=(
+                    "Stream every accessible file instead of a page, as a JSON array "
+                    "(`json`) or newline-delimited JSON (`ndjson`)."
+                ),
+                type=openapi.TYPE_STRING,
+                enum=list(STREAM_FORMATS),
+                required=False,
+            ),
         ],
     )
+    @conditional_listing()
     def get(self, request):
         uuid = request.query_params.get("uuid", None)
 
         # If a specific file UUID is provided, retrieve it
         if uuid:
             try:
-                file = File.objects.get(uuid=uuid)
+                file = File.objects.select_related("uploaded_by").get(uuid=uuid)
             except File.DoesNotExist:
                 return Response(
                     {"detail": "File not found."}, status=status.HTTP_404_NOT_FOUND
                 )
 
-            # Check permissions for the specific file
-            shared_file = file.shared_info
-            user_has_access = (
-                file.uploaded_by == request.user
-                or UserFilePermission.objects.filter(
-                    user=request.user, shared_file=shared_file
-                ).exists()
-                or TeamFilePermission.objects.filter(
-                    shared_file=shared_file, team__in=request.user.teams.all()
-                ).exists()
-            )
-
-            if not user_has_access:
+            # Effective permission, including ownership and team shares
+            user_permission = get_access(request.user, file)
+            if user_permission is None:
                 return Response(
                     {"detail": "Access denied."}, status=status.HTTP_403_FORBIDDEN
                 )
 
-            # Determine user-specific permissions
-            user_permission = "view"  # Default permission
-            user_permission_obj = UserFilePermission.objects.filter(
-                user=request.user, shared_file=shared_file
-            ).first()
-            if user_permission_obj:
-                user_permission = user_permission_obj.permission
-
             # Generate download URL if permitted
             download_url = None
-            if (
-                user_permission in ["view-and-download", "edit"]
-                or file.uploaded_by == request.user
-            ):
-                s3_client = boto3.client("s3")
-                bucket_name = settings.AWS_STORAGE_BUCKET_NAME
-                try:
-                    download_url = s3_client.generate_presigned_url(
-                        "get_object",
-                        Params={"Bucket": bucket_name, "Key": file.key},
-                        ExpiresIn=3600,
-                    )
-                except ClientError as e:
+            if user_permission in DOWNLOAD_PERMISSIONS:
+                download_url = generate_presigned_url(file.key)
+                if download_url is None:
                     return Response(
-                        {"detail": f"Failed to generate download URL: {str(e)}"},
+                        {"detail": "Failed to generate download URL."},
                         status=status.HTTP_500_INTERNAL_SERVER_ERROR,
                     )
 
@@ -168,48 +832,50 @@ class FileRetrieveView(APIView):
             }
             return Response(response_data, status=status.HTTP_200_OK)
 
-        # If no UUID is provided, retrieve all files the user has access to
-        user_files = File.objects.filter(uploaded_by=request.user)
-        shared_files = SharedFile.objects.filter(
-            Q(userfilepermission__user=request.user)
-            | Q(teamfilepermission__team__in=request.user.teams.all())
-        ).distinct()
+        # If no UUID is provided, retrieve the files the user has access to
+        fields = requested_fields(request)
+        files = File.objects.filter(access__user=request.user).select_related(
+            "uploaded_by"
+        )
+
+        # Very large listings can be streamed whole, one batch at a time
+        stream_format = request.query_params.get("stream")
+        if stream_format in STREAM_FORMATS:
+            batches = iter_batches(
+                files.order_by(*KeysetPagination.ordering), STREAM_BATCH_SIZE
+            )
+            return streaming_response(
+                (self.describe_files(request.user, batch, fields) for batch in batches),
+                stream_format,
+            )
 
-        # Combine user files and shared files, ensuring distinct results
-        accessible_files = (
-            user_files.distinct()
-            | File.objects.filter(shared_info__in=shared_files).distinct()
+        paginator = KeysetPagination()
+        page = paginator.paginate_queryset(files, request, self)
+        return paginator.get_paginated_response(
+            self.describe_files(request.user, page, fields)
         )
 
+    def describe_files(self, user, files, fields):
+        """
+        Builds the metadata of a batch of files, resolving the user's
+        permissions and signing download URLs for the whole batch at once.
+        """
+        resolved = resolve_access(user, files)
+
         # Build metadata for each accessible file
         file_data = []
-        for file in accessible_files:
-            shared_file = file.shared_info
-            user_permission = "view"
-            if shared_file:
-                user_permission_obj = UserFilePermission.objects.filter(
-                    user=request.user, shared_file=shared_file
-                ).first()
-                user_permission = (
-                    user_permission_obj.permission if user_permission_obj else "view"
-                )
-
-            # Generate download URL if permitted
-            download_url = None
-            if (
-                user_permission in ["view-and-download", "edit"]
-                or file.uploaded_by == request.user
-            ):
-                s3_client = boto3.client("s3")
-                bucket_name = settings.AWS_STORAGE_BUCKET_NAME
-                try:
-                    download_url = s3_client.generate_presigned_url(
-                        "get_object",
-                        Params={"Bucket": bucket_name, "Key": file.key},
-                        ExpiresIn=3600,
-                    )
-                except ClientError:
-                    download_url = None  # Fallback in case of S3 error
+        download_keys = []
+        for file in files:
+            access = resolved.get(file.id)
+            if access is None:
+                continue
+
+            # Download URLs are signed together once the batch is built, and
+            # only when the client asked for them
+            can_download = access.permission in DOWNLOAD_PERMISSIONS and (
+                fields is None or "download_url" in fields
+            )
+            download_keys.append(file.key if can_download else None)
 
             # Append file metadata
             file_data.append(
@@ -219,24 +885,31 @@ class FileRetrieveView(APIView):
                     "file_name": file.file_name,
                     "file_size": file.file_size,
                     "uploaded_at": file.uploaded_at,
-                    "permissions": user_permission,
-                    "download_url": download_url,
+                    "permissions": access.permission,
+                    "granted_via": access.granted_via,
+                    "download_url": None,
                 }
             )
 
-        return Response(file_data, status=status.HTTP_200_OK)
+        # Generate download URLs where permitted
+        download_urls = generate_presigned_urls([key for key in download_keys if key])
+        for item, key in zip(file_data, download_keys):
+            item["download_url"] = download_urls.get(key)
+
+        return select_fields(file_data, fields)
 
 
 class FileUpdateView(APIView):
     authentication_classes = [JWTAuthentication]
     permission_classes = [IsAuthenticated]
     parser_classes = [MultiPartParser, FormParser]
+    stream_uploads = True
 
     @swagger_auto_schema(
         operation_description="Update an existing file in S3 and metadata in the database.",
         request_body=FileSerializer,
         responses={
-            200: FileSerializer,
+            200: FileReadSerializer,
             400: "No file provided",
             403: "Permission denied",
             500: "Internal server error",
@@ -256,29 +929,47 @@ class FileUpdateView(APIView):
                 status=status.HTTP_403_FORBIDDEN,
             )
 
-        # Replace the file in S3
+        # Stream the new content to S3 while the body is parsed. Content may be
+        # shared with other files, so it is never overwritten in place.
+        handler = StreamingUploadHandler(
+            request, key_prefix=f"uploads/{request.user.id}/"
+        )
+        request.upload_handlers = [handler]
+
         new_file = request.FILES.get("file")
+        if handler.error:
+            handler.release()
+            detail, status_code = handler.error
+            return Response({"detail": detail}, status=status_code)
         if not new_file:
             return Response(
                 {"detail": "No file provided."}, status=status.HTTP_400_BAD_REQUEST
             )
 
-        s3_client = boto3.client("s3")
-        bucket_name = settings.AWS_STORAGE_BUCKET_NAME
-        try:
-            s3_client.upload_fileobj(new_file, bucket_name, file.key)
-        except ClientError as e:
-            return Response(
-                {"detail": f"Failed to update file: {str(e)}"},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            )
-
-        # Update metadata
+        # Update metadata and point the file at its new content
+        old_blob, old_key = file.blob, file.key
         file.file_name = new_file.name
         file.file_size = new_file.size
-        file.save()
+        file.key = new_file.key
+        file.blob = new_file.blob
+        holders, teams = file_audience([file.id])
+        try:
+            with transaction.atomic():
+                file.save()
+                record_file_event("file_updated", holders, file)
+        except Exception:
+            handler.release()
+            raise
+        touch_listings(holders, teams)
+
+        if old_key != file.key:
+            invalidate_urls([old_key])
+        if old_blob:
+            release_blob(old_blob)
+        elif old_key != file.key:
+            delete_from_storage(old_key)
 
-        return Response(FileSerializer(file).data)
+        return Response(FileReadSerializer(file, context={"request": request}).data)
 
 
 class FileDeleteView(APIView):
@@ -310,24 +1001,107 @@ class FileDeleteView(APIView):
                 status=status.HTTP_403_FORBIDDEN,
             )
 
-        # Delete the file from S3
-        s3_client = boto3.client("s3")
-        bucket_name = settings.AWS_STORAGE_BUCKET_NAME
+        invalidate_urls([file.key])
+        # Deleting the file drops its FileAccess rows, so cached access goes too
+        holders, teams = file_audience([file.id])
+
+        # Deduplicated content is only deleted from S3 with its last reference
+        if file.blob:
+            with transaction.atomic():
+                file.delete()
+                record_file_event("file_deleted", holders, file)
+            invalidate_on_commit(holders)
+            touch_listings(team_ids=teams)
+            release_blob(file.blob)
+            return Response(
+                {"detail": "File deleted successfully."},
+                status=status.HTTP_204_NO_CONTENT,
+            )
+
+        # Delete the file content from storage
         try:
-            s3_client.delete_object(Bucket=bucket_name, Key=file.key)
-        except ClientError as e:
+            get_storage().delete(file.key)
+        except StorageError as e:
             return Response(
                 {"detail": f"Failed to delete file: {str(e)}"},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR,
             )
 
         # Delete the file metadata from the database
-        file.delete()
+        with transaction.atomic():
+            file.delete()
+            record_file_event("file_deleted", holders, file)
+        invalidate_on_commit(holders)
+        touch_listings(team_ids=teams)
         return Response(
             {"detail": "File deleted successfully."}, status=status.HTTP_204_NO_CONTENT
         )
 
 
+class ChangeFeedView(APIView):
+    """
+    API view to sync changes incrementally instead of listing every file again.
+    """
+
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(
+        operation_description=(
+            "List the changes visible to the user after the given cursor, oldest "
+            "first. Pass the returned cursor as `since` to get the next changes."
+        ),
+        manual_parameters=[
+            openapi.Parameter(
+                "since",
+                openapi.IN_QUERY,
+                description="Cursor returned by the previous call. Omit to start from the beginning.",
+                type=openapi.TYPE_STRING,
+                required=False,
+            )
+        ],
+        responses={
+            200: openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    "events": openapi.Schema(
+                        type=openapi.TYPE_ARRAY,
+                        items=openapi.Schema(type=openapi.TYPE_OBJECT),
+                    ),
+                    "cursor": openapi.Schema(type=openapi.TYPE_STRING),
+                    "has_more": openapi.Schema(type=openapi.TYPE_BOOLEAN),
+                },
+            ),
+            400: "Invalid cursor",
+        },
+    )
+    def get(self, request):
+        since = request.query_params.get("since", "0")
+        if not since.isdigit():
+            return Response(
+                {"detail": "Invalid cursor."}, status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # Events are fanned out per user, so this is a range scan of one index
+        limit = CHANGE_FEED_PAGE_SIZE + 1
+        events = list(
+            ChangeEvent.objects.filter(user=request.user, id__gt=int(since)).order_by(
+                "id"
+            )[:limit]
+        )
+        has_more = len(events) > CHANGE_FEED_PAGE_SIZE
+        del events[CHANGE_FEED_PAGE_SIZE:]
+
+        return Response(
+            {
+                "events": ChangeEventSerializer(events, many=True).data,
+                "cursor": str(events[-1].id) if events else since,
+                "has_more": has_more,
+            },
+            status=status.HTTP_200_OK,
+        )
+
+
 class AvailablePermissionsView(APIView):
     """
     View to retrieve a list of available permissions for files.
@@ -470,30 +1244,21 @@ class FilePermissionView(APIView):
         """
         file = self.get_file_and_check_ownership(uuid, request.user)
 
-        # Fetch or create the shared file object
-        shared_file, created = SharedFile.objects.get_or_create(file=file)
+        user_permissions = {
+            up.get("user_id"): up.get("permission")
+            for up in request.data.get("user_permissions", [])
+        }
+        team_permissions = {
+            tp.get("team_id"): tp.get("permission")
+            for tp in request.data.get("team_permissions", [])
+        }
 
-        # Update user permissions
-        user_permissions = request.data.get("user_permissions", [])
-        for user_permission in user_permissions:
-            user = get_object_or_404(User, id=user_permission.get("user_id"))
-            permission = user_permission.get("permission")
-            UserFilePermission.objects.update_or_create(
-                user=user,
-                shared_file=shared_file,
-                defaults={"permission": permission},
-            )
+        # Check every user and team exists, with one query per type
+        if missing_ids(User, user_permissions) or missing_ids(Team, team_permissions):
+            raise Http404
 
-        # Update team permissions
-        team_permissions = request.data.get("team_permissions", [])
-        for team_permission in team_permissions:
-            team = get_object_or_404(Team, id=team_permission.get("team_id"))
-            permission = team_permission.get("permission")
-            TeamFilePermission.objects.update_or_create(
-                team=team,
-                shared_file=shared_file,
-                defaults={"permission": permission},
-            )
+        # Update user and team permissions
+        share_files([file], user_permissions, team_permissions)
 
         return Response(
             {"detail": "Permissions updated successfully."},
@@ -501,10 +1266,61 @@ class FilePermissionView(APIView):
         )
 
 
-class StandardResultsSetPagination(PageNumberPagination):
-    page_size = 10
-    page_size_query_param = "page_size"
-    max_page_size = 100
+class BulkShareView(APIView):
+    """
+    API view to share many files with many users and teams in one request.
+    """
+
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(
+        operation_description=(
+            "Share many files with many users and teams. Files, users and teams that "
+            "cannot be shared are skipped and reported in `errors`."
+        ),
+        request_body=BulkShareSerializer,
+        responses={
+            200: openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    "shared_files": openapi.Schema(
+                        type=openapi.TYPE_ARRAY,
+                        items=openapi.Schema(
+                            type=openapi.TYPE_STRING, format=openapi.FORMAT_UUID
+                        ),
+                    ),
+                    "errors": openapi.Schema(
+                        type=openapi.TYPE_ARRAY,
+                        items=openapi.Schema(type=openapi.TYPE_OBJECT),
+                    ),
+                },
+            ),
+            400: "Invalid request",
+        },
+    )
+    def post(self, request):
+        serializer = BulkShareSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        try:
+            shared, errors = bulk_share(
+                request.user,
+                data["file_uuids"],
+                data.get("user_permissions", []),
+                data.get("team_permissions", []),
+            )
+        except IntegrityError:
+            return Response(
+                {"detail": "A database error occurred while updating permissions."},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            )
+
+        return Response(
+            {"shared_files": [file.uuid for file in shared], "errors": errors},
+            status=status.HTTP_200_OK,
+        )
 
 
 class FilesSharedWithTeamView(generics.ListAPIView):
@@ -514,7 +1330,35 @@ class FilesSharedWithTeamView(generics.ListAPIView):
 
     serializer_class = SharedFileSerializer
     permission_classes = [IsAuthenticated]
-    pagination_class = StandardResultsSetPagination
+    pagination_class = SharedFilePagination
+
+    def check_team_access(self, request, team_id):
+        """
+        Returns the response refusing the team's listing to the user, or
+        None if they belong to the team. Takes a single query.
+        """
+        is_member = (
+            Team.objects.filter(id=team_id)
+            .annotate(
+                is_member=Exists(
+                    Team.members.through.objects.filter(
+                        team=OuterRef("pk"), user=request.user
+                    )
+                )
+            )
+            .values_list("is_member", flat=True)
+            .first()
+        )
+        if is_member is None:
+            return Response(
+                {"detail": "Team not found."}, status=status.HTTP_404_NOT_FOUND
+            )
+        if not is_member:
+            return Response(
+                {"detail": "You do not have permission to view files for this team."},
+                status=status.HTTP_403_FORBIDDEN,
+            )
+        return None
 
     @swagger_auto_schema(
         operation_description="Retrieve a list of files shared with a specific team.",
@@ -524,30 +1368,22 @@ class FilesSharedWithTeamView(generics.ListAPIView):
             404: "Team not found",
         },
     )
+    @conditional_listing(team_kwarg="team_id", authorize=check_team_access)
     def get(self, request, team_id):
         """
-        Retrieve files shared with the specified team.
+        Retrieve files shared with the specified team. Access is checked by
+        ``check_team_access`` before the listing's ETag.
         """
-        try:
-            team = Team.objects.get(id=team_id)  # Get the team by ID
-        except Team.DoesNotExist:
-            return Response(
-                {"detail": "Team not found."}, status=status.HTTP_404_NOT_FOUND
-            )
-
-        # Check if the user has permission to view files for this team
-        if request.user not in team.members.all():
-            return Response(
-                {"detail": "You do not have permission to view files for this team."},
-                status=status.HTTP_403_FORBIDDEN,
-            )
-
-        # Fetch the shared files for the team
-        shared_files = SharedFile.objects.filter(teamfilepermission__team=team)
+        # Fetch a page of the shared files for the team
+        shared_files = self.paginate_queryset(
+            SharedFile.objects.filter(
+                teamfilepermission__team_id=team_id
+            ).select_related("file")
+        )
 
         # Serialize the data and return the response
         serializer = self.serializer_class(shared_files, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return self.get_paginated_response(serializer.data)
 
 
 class FilesSharedWithUserView(generics.ListAPIView):
@@ -558,8 +1394,8 @@ class FilesSharedWithUserView(generics.ListAPIView):
 
     authentication_classes = [JWTAuthentication]
     permission_classes = [IsAuthenticated]
-    serializer_class = FileSerializer
-    pagination_class = StandardResultsSetPagination
+    serializer_class = FileReadSerializer
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         """
@@ -570,80 +1406,34 @@ class FilesSharedWithUserView(generics.ListAPIView):
             shared_info__userfilepermission__user=user
         ).distinct()
 
-    def get_download_url(self, file):
-        """
-        Helper method to generate the pre-signed URL for downloading the file from S3.
-        """
-        s3_client = boto3.client("s3")
-        bucket_name = settings.AWS_STORAGE_BUCKET_NAME
-        try:
-            download_url = s3_client.generate_presigned_url(
-                "get_object",
-                Params={"Bucket": bucket_name, "Key": file.key},
-                ExpiresIn=3600,  # URL expires in 1 hour
-            )
-            return download_url
-        except ClientError:
-            return None  # Return None if there is an error generating the URL
-
+    @conditional_listing()
     def list(self, request, *args, **kwargs):
         """
         Lists all files shared with the authenticated user and includes download URLs if allowed.
         """
-        files = self.get_queryset()
-        file_data = []
+        files = self.paginate_queryset(
+            self.get_queryset().select_related("uploaded_by")
+        )
+        # Every user and team permission of the page, in a fixed number of queries
+        resolved = resolve_access(request.user, files)
+        fields = requested_fields(request)
+        download_urls = {}
+        if fields is None or "download_url" in fields:
+            download_urls = generate_presigned_urls(
+                file.key
+                for file in files
+                if resolved[file.id].permission in DOWNLOAD_PERMISSIONS
+            )
 
+        file_data = []
         for file in files:
-            shared_file = file.shared_info
-            download_url = None
-            most_recent_team_permission = None  # Ensure initialization
-
-            # Check if the user is the file owner and can always download
-            if file.uploaded_by == request.user:
-                download_url = self.get_download_url(file)
-
-            # Check user permissions (direct permissions first)
-            user_permission_obj = UserFilePermission.objects.filter(
-                user=request.user, shared_file=shared_file
-            ).first()
-
-            if user_permission_obj:
-                user_permission = user_permission_obj.permission
+            access = resolved[file.id]
+            if access.permission in DOWNLOAD_PERMISSIONS:
+                download_url = download_urls.get(file.key)
             else:
-                user_permission = None
-
-            # If the user doesn't have direct permission, check their team permissions
-            if not user_permission:
-                # Get the most recent team permission (by 'updated_at')
-                most_recent_team_permission = (
-                    TeamFilePermission.objects.filter(
-                        shared_file=shared_file, team__in=request.user.teams.all()
-                    )
-                    .order_by("-updated_at")
-                    .first()
-                )
-
-                if most_recent_team_permission:
-                    user_permission = most_recent_team_permission.permission
-
-            # If the user has 'view-and-download' permission, generate the download URL
-            if user_permission == "view-and-download" and not download_url:
-                download_url = self.get_download_url(file)
-
-            # If the user doesn't have download permission, set message
-            if user_permission == "view" and not download_url:
                 download_url = "not allowed to download"
 
-            # Append file metadata including the name of the team if shared with a team
-            teams_with_permission = []
-            if most_recent_team_permission:
-                teams_with_permission = [
-                    team.name
-                    for team in request.user.teams.all()
-                    if most_recent_team_permission.team == team
-                    and most_recent_team_permission.permission == "view-and-download"
-                ]
-
+            # Append file metadata including the teams the file is shared through
             file_data.append(
                 {
                     "file_uuid": file.uuid,
@@ -651,13 +1441,14 @@ class FilesSharedWithUserView(generics.ListAPIView):
                     "file_name": file.file_name,
                     "file_size": file.file_size,
                     "uploaded_at": file.uploaded_at,
-                    "permissions": user_permission,
+                    "permissions": access.permission,
+                    "granted_via": access.granted_via,
                     "download_url": download_url,
-                    "teams_with_permission": teams_with_permission,
+                    "teams_with_permission": access.team_names,
                 }
             )
 
-        return Response(file_data, status=status.HTTP_200_OK)
+        return self.get_paginated_response(select_fields(file_data, fields))
 
 
 class FilesSharedWithUserTeamsView(generics.ListAPIView):
@@ -667,8 +1458,8 @@ class FilesSharedWithUserTeamsView(generics.ListAPIView):
 
     authentication_classes = [JWTAuthentication]
     permission_classes = [IsAuthenticated]
-    serializer_class = FileSerializer
-    pagination_class = StandardResultsSetPagination
+    serializer_class = FileReadSerializer
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         # Fetch user's teams
@@ -677,64 +1468,43 @@ class FilesSharedWithUserTeamsView(generics.ListAPIView):
         return (
             File.objects.filter(shared_info__teamfilepermission__team__in=user_teams)
             .distinct()
-            .prefetch_related("shared_info__teamfilepermission_set__team")
+            .select_related("uploaded_by")
         )
 
+    @conditional_listing()
     def list(self, request, *args, **kwargs):
-        queryset = self.get_queryset()
-        files_data = []
-        user_teams = list(request.user.teams.all())  # Cache user's teams
+        files = self.paginate_queryset(self.get_queryset())
+        # Every team permission of the page, in a fixed number of queries
+        resolved = resolve_access(request.user, files)
+        fields = requested_fields(request)
+        download_urls = {}
+        if fields is None or "download_url" in fields:
+            download_urls = generate_presigned_urls(
+                file.key
+                for file in files
+                if resolved[file.id].permission in DOWNLOAD_PERMISSIONS
+            )
 
-        for file in queryset:
-            permissions = "not allowed to download"
+        files_data = []
+        for file in files:
+            access = resolved[file.id]
             download_url = None
+            if access.permission in DOWNLOAD_PERMISSIONS:
+                download_url = download_urls.get(file.key)
 
-            # Owner permissions
-            if file.uploaded_by == request.user:
-                permissions = "view-and-download"
-
-            # Check permissions for user's teams
-            shared_info = file.shared_info
-            team_permissions = TeamFilePermission.objects.filter(
-                shared_file=shared_info, team__in=user_teams
-            ).select_related("team")
-
-            for permission in team_permissions:
-                if permission.permission in ["view-and-download", "view"]:
-                    permissions = permission.permission
-                    if permissions == "view-and-download":
-                        # Generate S3 presigned URL
-                        try:
-                            s3_client = boto3.client("s3")
-                            bucket_name = settings.AWS_STORAGE_BUCKET_NAME
-                            download_url = s3_client.generate_presigned_url(
-                                "get_object",
-                                Params={"Bucket": bucket_name, "Key": file.key},
-                                ExpiresIn=3600,
-                            )
-                        except ClientError as e:
-                            logging.error(f"S3 ClientError: {e}")
-                            download_url = None
-                    break  # Use the most permissive access found
-
-            # Prepare the response data
-            team_names = [
-                team_permission.team.name
-                for team_permission in shared_info.teamfilepermission_set.all()
-            ]
-
-            file_data = {
-                "file_uuid": file.uuid,
-                "file_name": file.file_name,
-                "owner": file.uploaded_by.username,
-                "permissions": permissions,
-                "download_url": download_url or "not allowed to download",
-                "team_names": team_names,
-            }
-
-            files_data.append(file_data)
+            files_data.append(
+                {
+                    "file_uuid": file.uuid,
+                    "file_name": file.file_name,
+                    "owner": file.uploaded_by.username,
+                    "permissions": access.permission,
+                    "granted_via": access.granted_via,
+                    "download_url": download_url or "not allowed to download",
+                    "team_names": access.team_names,
+                }
+            )
 
-        return Response(files_data, status=status.HTTP_200_OK)
+        return self.get_paginated_response(select_fields(files_data, fields))
 
 
 class ShareFileView(APIView):
@@ -837,36 +1607,16 @@ class ShareFileView(APIView):
         self.validate_permissions(all_permissions, valid_permissions)
 
         # Remove duplicates from user and team permissions
-        user_permissions = {
-            up["user_id"]: up["permission"] for up in user_permissions
-        }.items()
-        team_permissions = {
-            tp["team_id"]: tp["permission"] for tp in team_permissions
-        }.items()
+        user_permissions = {up["user_id"]: up["permission"] for up in user_permissions}
+        team_permissions = {tp["team_id"]: tp["permission"] for tp in team_permissions}
 
-        # Fetch or create the shared file object
-        shared_file, created = SharedFile.objects.get_or_create(file=file)
+        # Check every user and team exists, with one query per type
+        if missing_ids(User, user_permissions) or missing_ids(Team, team_permissions):
+            raise Http404
 
         # Update permissions in a transaction to ensure atomicity
         try:
-            with transaction.atomic():
-                # Update user permissions
-                for user_id, permission in user_permissions:
-                    user = get_object_or_404(User, id=user_id)
-                    UserFilePermission.objects.update_or_create(
-                        user=user,
-                        shared_file=shared_file,
-                        defaults={"permission": permission},
-                    )
-
-                # Update team permissions
-                for team_id, permission in team_permissions:
-                    team = get_object_or_404(Team, id=team_id)
-                    TeamFilePermission.objects.update_or_create(
-                        team=team,
-                        shared_file=shared_file,
-                        defaults={"permission": permission},
-                    )
+            share_files([file], user_permissions, team_permissions)
         except IntegrityError:
             return Response(
                 {"detail": "A database error occurred while updating permissions."},
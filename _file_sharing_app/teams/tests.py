@@ -3,6 +3,8 @@ from rest_framework.test import APITestCase
 from rest_framework import status
 from django.urls import reverse
 from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
 from .models import Team
 
@@ -61,6 +63,22 @@ class TeamTests(APITestCase):
         url = reverse("team-list")  # Update with correct team URL
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn("results", response.data)
+        self.assertIn("next", response.data)
+
+    def test_list_teams_query_count_does_not_grow_with_teams(self):
+        def list_queries():
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse("team-list"))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return len(queries)
+
+        for i in range(2):
+            Team.objects.create(name=f"Few {i}").members.add(self.user)
+        few = list_queries()
+        for i in range(8):
+            Team.objects.create(name=f"Many {i}").members.add(self.user)
+        self.assertEqual(list_queries(), few)
 
     def test_add_member(self):
         # Create a team for testing
@@ -1,9 +1,14 @@
 # _file_sharing_app/teams/views.py
 
+from django.db import transaction
 from rest_framework import status, viewsets
 from rest_framework.response import Response
 from rest_framework.decorators import action
 from drf_yasg.utils import swagger_auto_schema
+from files.access import refresh_access, team_file_ids
+from files.changes import record_membership_event
+from files.pagination import KeysetPagination
+from files.versions import touch_listings
 from .models import Team
 from django.contrib.auth.models import User
 from rest_framework.permissions import IsAuthenticated
@@ -15,19 +20,58 @@ from .serializers import (
 )
 
 
+class TeamPagination(KeysetPagination):
+    # Team names are unique, so the name alone would do; ``id`` keeps it total
+    ordering = ("name", "id")
+
+
 class TeamViewSet(viewsets.ModelViewSet):
     """
     ViewSet for managing teams, including creating, updating, deleting, and managing members.
     """
 
-    queryset = Team.objects.all()
+    # Members are listed by every serialized team
+    queryset = Team.objects.prefetch_related("members")
     serializer_class = TeamSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = TeamPagination
 
+    @transaction.atomic
     def perform_create(self, serializer):
         # Associate the team with the current user as a member upon creation
         team = serializer.save()
         team.members.add(self.request.user)
+        # Each founding member is told about their own membership
+        for member_id in team.members.values_list("id", flat=True):
+            record_membership_event("member_added", team, member_id, [member_id])
+
+    @transaction.atomic
+    def perform_update(self, serializer):
+        # Members added or dropped gain or lose access to the team's files
+        before = set(serializer.instance.members.values_list("id", flat=True))
+        team = serializer.save()
+        after = set(team.members.values_list("id", flat=True))
+        for member_id in after - before:
+            record_membership_event("member_added", team, member_id, after)
+        for member_id in before - after:
+            record_membership_event(
+                "member_removed", team, member_id, after | {member_id}
+            )
+        members = before | after
+        refresh_access(members, team_file_ids(team))
+        touch_listings(members, [team.id])
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        members = list(instance.members.values_list("id", flat=True))
+        file_ids = team_file_ids(instance)
+        team_id = instance.id
+        # Each member is told about their own membership ending
+        for member_id in members:
+            record_membership_event("member_removed", instance, member_id, [member_id])
+        instance.delete()
+        refresh_access(members, file_ids)
+        touch_listings(members, [team_id])
 
     @swagger_auto_schema(
         operation_description="Add a user as a member of the team.",
@@ -59,7 +103,13 @@ class TeamViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        team.members.add(user)
+        with transaction.atomic():
+            team.members.add(user)
+            record_membership_event(
+                "member_added", team, user.id, team.members.values_list("id", flat=True)
+            )
+            refresh_access([user.id], team_file_ids(team))
+        touch_listings([user.id])
         return Response(
             {"detail": "User added as a member."}, status=status.HTTP_200_OK
         )
@@ -93,7 +143,16 @@ class TeamViewSet(viewsets.ModelViewSet):
                 {"detail": "User is not a member."}, status=status.HTTP_400_BAD_REQUEST
             )
 
-        team.members.remove(user)
+        with transaction.atomic():
+            team.members.remove(user)
+            record_membership_event(
+                "member_removed",
+                team,
+                user.id,
+                [user.id, *team.members.values_list("id", flat=True)],
+            )
+            refresh_access([user.id], team_file_ids(team))
+        touch_listings([user.id])
         return Response(
             {"detail": "User removed from team."}, status=status.HTTP_200_OK
         )
@@ -118,6 +177,8 @@ class TeamViewSet(viewsets.ModelViewSet):
             team.description = description
 
         team.save()
+        # Listings name the teams files are shared through
+        touch_listings(team.members.values_list("id", flat=True), [team.id])
         return Response(
             {"detail": "Team updated successfully."}, status=status.HTTP_200_OK
         )
@@ -132,7 +193,7 @@ class TeamViewSet(viewsets.ModelViewSet):
         Delete the team.
         """
         team = self.get_object()
-        team.delete()
+        self.perform_destroy(team)
         return Response(
             {"detail": "Team deleted successfully."}, status=status.HTTP_204_NO_CONTENT
         )